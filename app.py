@@ -1,8 +1,17 @@
 # app.py - Core of the SAS QA Translation Framework
 import streamlit as st
+from sas_blueprint import lex_and_blueprint, summarize_blueprint, summarize_code, read_blueprints  # No UI
 import parse_functions  # Your new, custom-installed tokenizer
 import pandas as pd  # For eventual validation reports
-import hashlib  # For secure password hashing
+import hashlib  # For secure password hashing (and hashing the uploaded code)
+import threading  # The analysis cache is shared by every session
+import io
+import os
+import zipfile  # Batch mode takes a zip of a project folder
+import functools
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 # import json  # To handle blueprint serialization
  
 # ====================
@@ -74,292 +83,160 @@ This tool implements a **two-stage, quality-assured process** for migrating SAS
 """)
 
 # ====================
-# BLUEPRINT GENERATION FUNCTION
+# ANALYSIS CACHE
 # ====================
-def generate_blueprint(tokens, raw_sas_code):
-    """
-    Analyze SAS tokens to create a translation blueprint.
-    Production version - clean, focused, reliable.
+# Lexing and the blueprint only depend on the code, so they are cached on the SHA-256 of the uploaded bytes
+# and shared by all sessions: re-uploading or re-running the same script is instant, and a session only keeps
+# the hash of its file in st.session_state
+APPROX_BYTES_PER_TOKEN = 250  # measured size of a sas-lexer token and its fields
+
+
+class AnalysisCache:
+    """Least recently used cache of analysis results, bounded by number of entries and by approximate memory"""
+
+    def __init__(self, max_entries=64, max_bytes=512 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()  # content hash -> (analysis, approximate bytes)
+        self._lock = threading.Lock()
+
+    def get(self, content_hash):
+        with self._lock:
+            if content_hash not in self._entries:
+                return None
+            self._entries.move_to_end(content_hash)
+            return self._entries[content_hash][0]
+
+    def put(self, content_hash, analysis, size):
+        with self._lock:
+            if content_hash in self._entries:
+                self.total_bytes -= self._entries.pop(content_hash)[1]
+            self._entries[content_hash] = (analysis, size)
+            self.total_bytes += size
+            # Evict the least recently used, but always keep the entry just added
+            while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes):
+                self.total_bytes -= self._entries.popitem(last=False)[1][1]
+
+
+@st.cache_resource
+def get_analysis_cache():
+    """The one AnalysisCache of the server, shared across sessions and reruns"""
+    return AnalysisCache()
+
+
+def analyze_sas_code(raw_sas_code, content_hash, cache=None):
+    """Lex the code and generate its blueprint, or return them from the cache if this code was seen before
+
+    Returns a dict with the 'tokens', the number of lexing 'errors', the 'blueprint' and the 'token_frame'
+    (see token_frame), all built before the analysis is put in the cache so its size accounts for them and
+    the shared dict is never changed afterwards.
     """
-    # Initialize counters and trackers
-    analysis = {
-        "data_steps": 0,
-        "proc_blocks": 0,
-        "proc_sql_blocks": 0,
-        "macro_definitions": 0,
-        "macro_calls": 0,
-        "proc_types": set(),
-        "datasets_created": set(),
-        "datasets_used": set(),
-        "has_retain": False,
-        "has_lag": False,
-        "has_merge": False,
-        "has_arrays": False,
-        "in_data_step": False,
-        "in_proc_block": False,
-        "current_proc": None,
-        "pointer_controls": 0,      # Count of @n pointers
-        "line_hold_single": False,  # Single @ at end of INPUT
-        "line_hold_double": False,  # Double @@ at end of INPUT
-        "platform_concerns": [],    # List of platform-specific issues found
-        "has_proc_import": False,
-    }
-    
-    # Helper: Safe token text extraction
-    def get_token_text_safe(token_idx):
-        if token_idx >= len(tokens) or token_idx < 0:
-            return None
-        token = tokens[token_idx]
-        return raw_sas_code[token.start:token.stop].upper()
-    
-    # Helper: Safe token type check
-    def get_token_type_safe(token_idx):
-        if token_idx >= len(tokens) or token_idx < 0:
-            return None
-        return tokens[token_idx].token_type.name
-    
-    i = 0
-    while i < len(tokens):
-        token = tokens[i]
-        token_text = raw_sas_code[token.start:token.stop].upper()
-        token_type = token.token_type.name
-        
-        # Skip whitespace and comments
-        if token_type in ['WS', 'COMMENT']:
-            i += 1
-            continue
-        
-        # --- DETECT PROC SORT PARAMETERS ---
-        if analysis["current_proc"] == 'SORT' and token_text in ['DATA', 'OUT']:
-            # Find '=' after DATA/OUT
-            eq_pos = i + 1
-            while eq_pos < len(tokens) and get_token_type_safe(eq_pos) == 'WS':
-                eq_pos += 1
-            
-            if eq_pos < len(tokens) and get_token_text_safe(eq_pos) == '=':
-                # Find dataset name after '='
-                ds_pos = eq_pos + 1
-                while ds_pos < len(tokens) and get_token_type_safe(ds_pos) == 'WS':
-                    ds_pos += 1
-                
-                if ds_pos < len(tokens) and get_token_type_safe(ds_pos) in ['IDENT', 'IDENTIFIER']:
-                    ds_name = raw_sas_code[tokens[ds_pos].start:tokens[ds_pos].stop]
-                    if token_text == 'DATA':
-                        analysis["datasets_used"].add(ds_name)
-                    elif token_text == 'OUT':
-                        analysis["datasets_created"].add(ds_name)
-        
-        # --- DETECT DATA STEPS ---
-        elif token_text == 'DATA' and not analysis["in_data_step"]:
-            # Check it's not part of a function or PROC parameter
-            next_text = get_token_text_safe(i+1)
-            if next_text and next_text not in ['_NULL_', 'STEP', '='] and not next_text.startswith('('):
-                analysis["data_steps"] += 1
-                analysis["in_data_step"] = True
-                
-                # Capture dataset name (handle variable whitespace)
-                name_pos = i + 1
-                while name_pos < len(tokens) and get_token_type_safe(name_pos) == 'WS':
-                    name_pos += 1
-                
-                if name_pos < len(tokens) and get_token_type_safe(name_pos) in ['IDENT', 'IDENTIFIER']:
-                    ds_name = raw_sas_code[tokens[name_pos].start:tokens[name_pos].stop]
-                    analysis["datasets_created"].add(ds_name)
-        
-        # --- DETECT PROC BLOCKS ---
-        elif token_text == 'PROC':
-            # Find procedure name, skipping whitespace
-            proc_pos = i + 1
-            while proc_pos < len(tokens) and get_token_type_safe(proc_pos) == 'WS':
-                proc_pos += 1
-            
-            if proc_pos < len(tokens):
-                proc_name = get_token_text_safe(proc_pos)
-                if proc_name and proc_name.isalpha():
-                    proc_name = proc_name.upper()
-                    analysis["proc_types"].add(proc_name)
-                    analysis["proc_blocks"] += 1
-                    analysis["in_proc_block"] = True
-                    analysis["current_proc"] = proc_name
-
-                    # Special flag for high-complexity procedures
-                    if proc_name == 'IMPORT':
-                        analysis["has_proc_import"] = True
-
-                    if proc_name == 'SQL':
-                        analysis["proc_sql_blocks"] += 1
-        
-        # --- DETECT SET/MERGE REFERENCES ---
-        elif token_text in ['SET', 'MERGE', 'UPDATE', 'MODIFY'] and analysis["in_data_step"]:
-            # Find dataset name after the keyword
-            ds_pos = i + 1
-            while ds_pos < len(tokens) and get_token_type_safe(ds_pos) == 'WS':
-                ds_pos += 1
-            
-            if ds_pos < len(tokens) and get_token_type_safe(ds_pos) in ['IDENT', 'IDENTIFIER']:
-                ds_name = raw_sas_code[tokens[ds_pos].start:tokens[ds_pos].stop]
-                analysis["datasets_used"].add(ds_name)
-        
-        # --- DETECT MACROS ---
-        elif token_text.startswith('%'):
-            if token_text == '%MACRO':
-                analysis["macro_definitions"] += 1
-            else:
-                analysis["macro_calls"] += 1
-        
-        # --- DETECT COMPLEXITY PATTERNS ---
-        elif token_text == 'RETAIN':
-            analysis["has_retain"] = True
-        elif token_text in ['LAG', 'LAG1', 'LAG2']:
-            analysis["has_lag"] = True
-        elif token_text == 'MERGE':
-            analysis["has_merge"] = True
-        elif token_text == 'ARRAY':
-            analysis["has_arrays"] = True
-
-        # --- DETECT @ PATTERNS ---
-        elif token_text == '@':
-            # Check what type of @ this is
-            # Look ahead to see if it's @@ or @n
-            if i+1 < len(tokens):
-                next_text = get_token_text_safe(i+1)
-                
-                # Case 1: @@ (double line hold)
-                if next_text == '@':
-                    analysis["line_hold_double"] = True
-                    i += 1  # Skip the second @
-                
-                # Case 2: @n (pointer control with number)
-                elif next_text and next_text.isdigit():
-                    analysis["pointer_controls"] += 1
-                    i += 1  # Skip the number
-                
-                # Case 3: Single @ (could be line hold, need more context)
-                else:
-                    # We'll determine if it's line hold later based on position
-                    pass
-        
-        # --- DETECT PLATFORM CONCERNS ---
-        # X command (immediate host execution)
-        elif token_text == 'X':
-            analysis["platform_concerns"].append("X command (host-specific execution)")
-        
-        # FILENAME/LIBNAME (often OS-specific paths)
-        elif token_text in ['FILENAME', 'LIBNAME']:
-            analysis["platform_concerns"].append(f"{token_text} statement (check path portability)")
-        
-        # CALL SYSTEM (function-based execution)
-        elif token_text == 'CALL' and i+1 < len(tokens):
-            next_text = get_token_text_safe(i+1)
-            if next_text == 'SYSTEM':
-                analysis["platform_concerns"].append("CALL SYSTEM() (host command execution)")
-        
-        # --- DETECT BLOCK ENDINGS ---
-        elif token_text in ['RUN', 'QUIT', 'DATALINES']:
-            analysis["in_data_step"] = False
-            analysis["in_proc_block"] = False
-            analysis["current_proc"] = None
-        
-        i += 1
-    
-    # --- CALCULATE COMPLEXITY SCORE ---
-    complexity_score = (
-        analysis["data_steps"] * 1 +
-        analysis["proc_blocks"] * 1 +
-        analysis["proc_sql_blocks"] * 2 +
-        analysis["macro_definitions"] * 5 +
-        analysis["macro_calls"] * 2 +
-        (5 if analysis["has_retain"] else 0) +
-        (5 if analysis["has_lag"] else 0) +
-        (3 if analysis["has_merge"] else 0) +
-        (3 if analysis["has_arrays"] else 0) +
-        (analysis["pointer_controls"] * 2) +       # @n pointers add some complexity
-        (10 if analysis["line_hold_double"] else 0) + # @@ is high complexity
-        (8 if analysis["line_hold_single"] else 0) +  # @ is high complexity
-        (len(analysis["platform_concerns"]) * 3)   # Each platform concern adds risk
-        + (10 if analysis["has_proc_import"] else 0)
-    )
-    
-    # Determine priority
-    if complexity_score > 25:
-        priority = "High"
-        confidence = "Manual review strongly recommended"
-    elif complexity_score > 15:
-        priority = "Medium"
-        confidence = "Mixed automation with oversight"
-    else:
-        priority = "Low"
-        confidence = "Good candidate for automated translation"
-    
-    # Generate recommendations
-    recommendations = []
-    if analysis["macro_definitions"] > 0:
-        recommendations.append("**Manual review required for custom macro definitions.**")
-    if analysis["proc_sql_blocks"] > 0:
-        recommendations.append(f"**Verify logic of {analysis['proc_sql_blocks']} PROC SQL block(s).**")
-    if analysis["has_retain"]:
-        recommendations.append("**RETAIN statements require stateful translation logic.**")
-    if analysis["has_lag"]:
-        recommendations.append("**LAG functions need special handling for row context.**")
-    if not recommendations:
-        recommendations.append("**Code structure appears straightforward for automated translation.**")
-    if analysis["pointer_controls"] > 0:
-        recommendations.append(f"**Column pointer controls (@) detected: {analysis['pointer_controls']} instance(s). Requires careful input parsing translation.**")
-    
-    if analysis["line_hold_single"]:
-        recommendations.append("**Single trailing @ detected: Line hold requires stateful INPUT buffer management.**")
-    
-    if analysis["line_hold_double"]:
-        recommendations.append("**Double trailing @@ detected: Complex line hold across multiple records.**")
-    
-    # NEW: Platform concerns
-    if analysis["platform_concerns"]:
-        unique_concerns = list(set(analysis["platform_concerns"]))
-        concerns_text = ", ".join(sorted(unique_concerns))
-        recommendations.append(f"**Platform-specific code: {concerns_text}. Review for portability.**")
-
-    if analysis["has_proc_import"]:
-        recommendations.append("**PROC IMPORT detected: Requires manual mapping to pandas.read_csv()/read_excel() with specific parameter analysis.**")
-
-    # --- STRUCTURE FINAL BLUEPRINT ---
-    blueprint = {
-        "summary": {
-            "translation_priority": priority,
-            "confidence_assessment": confidence,
-            "complexity_score": complexity_score,
-            "total_lines": len(raw_sas_code.split('\n')),
-            "total_tokens": len(tokens)
-        },
-        "detailed_counts": {
-            "DATA Steps": analysis["data_steps"],
-            "PROC Blocks": analysis["proc_blocks"],
-            "PROC SQL Blocks": analysis["proc_sql_blocks"],
-            "Macro Definitions": analysis["macro_definitions"],
-            "Macro Calls": analysis["macro_calls"],
-            "PROC Types Found": list(sorted(analysis["proc_types"]))
-        },
-        "data_flow": {
-            "datasets_created": list(sorted(analysis["datasets_created"])),
-            "datasets_used": list(sorted(analysis["datasets_used"]))
-        },
-        "complexity_flags": {
-            "has_retain_statement": analysis["has_retain"],
-            "has_lag_function": analysis["has_lag"],
-            "has_merge_statement": analysis["has_merge"],
-            "has_array_declarations": analysis["has_arrays"],
-            "pointer_controls_count": analysis["pointer_controls"],
-            "has_line_hold_single": analysis["line_hold_single"],
-            "has_line_hold_double": analysis["line_hold_double"],
-            "platform_concerns": analysis["platform_concerns"]
-        },  
-        "recommendations": recommendations
-    }
-    st.write("Quick structure check:", list(blueprint.keys()))
-    st.write("Detailed counts:", blueprint.get("detailed_counts", "MISSING"))
-
-    return blueprint
-
-def display_blueprint(blueprint, tokens, raw_sas_code):
+    if cache is None:
+        cache = get_analysis_cache()
+    analysis = cache.get(content_hash)
+    if analysis is None:
+        tokens, errors, blueprint = lex_and_blueprint(raw_sas_code)
+        frame = token_frame(tokens, raw_sas_code)
+        analysis = {
+            "tokens": tokens,
+            "errors": errors,
+            "blueprint": blueprint,
+            "token_frame": frame,
+        }
+        cache.put(content_hash, analysis, len(tokens) * APPROX_BYTES_PER_TOKEN + len(raw_sas_code)
+                  + int(frame.memory_usage(deep=True).sum()))
+    return analysis
+
+
+# ====================
+# TOKEN EXPLORER & CODE VIEWER
+# ====================
+# A large script has hundreds of thousands of lines and tokens: the tokens are put in a DataFrame once per
+# analysis (built by analyze_sas_code and counted in the cache size), the lines are split once per distinct
+# code, and both viewers only send the page / window on screen to the browser
+TOKEN_PAGE_SIZES = [50, 100, 250, 500]
+CODE_WINDOW_SIZES = [100, 250, 500, 1000]
+
+
+def token_frame(tokens, raw_sas_code):
+    """DataFrame of the tokens, one row per token"""
+    frame = pd.DataFrame({
+        "Line": [token_obj.line for token_obj in tokens],
+        "Column": [token_obj.column for token_obj in tokens],
+        "Kind": pd.Categorical([token_obj.token_type.name for token_obj in tokens]),
+        "Channel": pd.Categorical([token_obj.channel.name for token_obj in tokens]),
+        "Text": [raw_sas_code[token_obj.start:token_obj.stop] for token_obj in tokens],
+    })
+    frame.index.name = "Index"
+    return frame
+
+
+def _jump_to_line(lines, page_size):
+    """Callback of 'Go to line': show the page holding the first token on or after that line"""
+    position = int(lines.searchsorted(st.session_state.token_line))
+    st.session_state.token_page = position // page_size + 1
+
+
+def display_token_explorer(frame):
+    """Filterable, searchable token table, paginated so only the rows of the current page are rendered"""
+    col1, col2 = st.columns([2, 1])
+    with col1:
+        kinds = st.multiselect("Token kinds", list(frame["Kind"].cat.categories), key="token_kinds",
+                               placeholder="All kinds")
+    with col2:
+        search = st.text_input("Search token text", key="token_search")
+    show_hidden = st.checkbox("Include whitespace tokens", key="token_hidden")
+
+    # Vectorized filters over the whole frame, only their result is paginated
+    mask = pd.Series(True, index=frame.index)
+    if not show_hidden:
+        mask &= frame["Channel"] != "HIDDEN"
+    if kinds:
+        mask &= frame["Kind"].isin(kinds)
+    if search:
+        mask &= frame["Text"].str.contains(search, case=False, regex=False)
+    view = frame[mask]
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        page_size = st.selectbox("Rows per page", TOKEN_PAGE_SIZES, index=1, key="token_page_size")
+    pages = max(1, -(-len(view) // page_size))
+    if st.session_state.get("token_page", 1) > pages:
+        st.session_state.token_page = pages  # the filters left fewer pages
+    with col2:
+        page = st.number_input(f"Page (of {pages:,})", min_value=1, max_value=pages, key="token_page")
+    with col3:
+        st.number_input("Go to line", min_value=1, key="token_line", on_change=_jump_to_line,
+                        args=(view["Line"].to_numpy(), page_size))
+
+    start = (page - 1) * page_size
+    st.dataframe(view.iloc[start:start + page_size])
+    st.caption(f"Tokens {min(start + 1, len(view)):,}-{min(start + page_size, len(view)):,} of {len(view):,} "
+               f"shown ({len(frame):,} in total)")
+
+
+@st.cache_resource(max_entries=8)
+def code_lines(content_hash, _raw_sas_code):
+    """Lines of the code (split as the lexer counts them), once per distinct code"""
+    return _raw_sas_code.split("\n")
+
+
+def display_code_window(lines):
+    """Show a window of the code with its line numbers, only those lines are sent to the browser"""
+    col1, col2 = st.columns(2)
+    with col1:
+        window = st.selectbox("Lines shown", CODE_WINDOW_SIZES, key="code_window")
+    with col2:
+        first = st.number_input(f"From line (of {len(lines):,})", min_value=1, max_value=max(1, len(lines)),
+                                value=1, step=window, key="code_first")
+    last = min(len(lines), first - 1 + window)
+    width = len(str(last))
+    st.code("\n".join(f"{number:>{width}}  {line.rstrip(chr(13))}"
+                      for number, line in enumerate(lines[first - 1:last], first)), language='sas')
+
+
+def display_blueprint(blueprint, tokens_frame):
     """Display the blueprint in a clean, single container"""
 
     st.sidebar.write("🔍 DEBUG: display_blueprint called")
@@ -396,18 +273,8 @@ def display_blueprint(blueprint, tokens, raw_sas_code):
             for rec in blueprint["recommendations"]:
                 st.markdown(f"- {rec}")
         
-        # OPTIONAL: Keep token preview for debugging
-        with st.expander("🔎 Preview first 150 tokens (Debug)", expanded=False):
-            preview_data = []
-            for idx, token_obj in enumerate(tokens[:150]):
-                token_text = raw_sas_code[token_obj.start:token_obj.stop]
-                token_kind = token_obj.token_type.name
-                preview_data.append({
-                    "Index": idx,
-                    "Text": token_text,
-                    "Kind": token_kind
-                })
-            st.table(preview_data)
+        with st.expander("🔎 Token explorer", expanded=False):
+            display_token_explorer(tokens_frame)
     
     return blueprint_container
 
@@ -417,92 +284,242 @@ def display_blueprint(blueprint, tokens, raw_sas_code):
 st.header("📁 Stage 1: Upload & Analyze")
 
 if st.button("🔄 Start New Analysis"):
-    for key in ['blueprint_generated', 'current_blueprint', 'raw_sas_code', 'last_file_id', 'should_display_blueprint', 'current_tokens',
-                'already_displayed']:
+    for key in ['blueprint_generated', 'current_hash', 'should_display_blueprint']:
         if key in st.session_state:   
             del st.session_state[key]
     st.rerun()
 
 uploaded_file = st.file_uploader("Upload your SAS script (.sas)", type=['sas'])
 raw_sas_code = ""
-current_file_id = None 
+content_hash = None 
 
 if uploaded_file is not None:
-    current_file_id = f"{uploaded_file.name}_{uploaded_file.size}" 
-    raw_sas_code = uploaded_file.read().decode()
+    raw_sas_bytes = uploaded_file.getvalue()
+    content_hash = hashlib.sha256(raw_sas_bytes).hexdigest()  # same code, same analysis, whatever the file name
+    raw_sas_code = raw_sas_bytes.decode()
     
     # Display the uploaded code for immediate review
     with st.expander("📄 View Uploaded SAS Code", expanded=False):
-        st.code(raw_sas_code, language='sas')
+        display_code_window(code_lines(content_hash, raw_sas_code))
     
     # ====================
     # CORE LEXING STEP
     # ====================
     if st.button("🔍 Generate Analysis Blueprint", type="primary"):
-        if ('last_file_id' in st.session_state and 
-            st.session_state.last_file_id == current_file_id and
-            'blueprint_generated' in st.session_state and 
-            st.session_state.blueprint_generated):
-                st.info("Blueprint already generated for this file. Upload a new file to analyze again.")
-        else:        
-            # Inform the user that processing has started
-            with st.spinner("Lexing and analyzing SAS code..."):
-            
-                # -------------------------------------
-                # THIS IS WHERE sas-lexer DOES ITS WORK
-                # -------------------------------------
-                try:
-                    # Pass the raw code string to the lexer
-                    lex_result = sas_lexer.lex_program_from_str(raw_sas_code)
-                    
-                    # Unpack the 3-item tuple correctly
-                    tokens, errors, _ = lex_result  # We ignore the 3rd bytes item
-                    
-                    # Check for lexing errors
-                    if errors:
-                        st.warning(f"⚠️ Lexing completed with {len(errors)} warnings")
-                        
-                    # Basic confirmation for the user
-                    st.success(f"✅ Lexing complete. Found {len(tokens)} tokens.")
-                   
-                    # --- Generate and Display the Blueprint ---
-                    blueprint = generate_blueprint(tokens, raw_sas_code)
-                    
-                    # Store for Stage 2 AND for display (DON'T display here)
-                    st.session_state.current_blueprint = blueprint
-                    st.session_state.current_tokens = tokens  # Store tokens too
-                    st.session_state.raw_sas_code = raw_sas_code
-                    st.session_state.blueprint_generated = True
-                    st.session_state.last_file_id = current_file_id
-                    st.session_state.should_display_blueprint = True  # New flag
-
-                    # Temporary debug
-                    st.sidebar.write("Debug - Session State:")
-                    st.sidebar.write(f"should_display_blueprint: {'should_display_blueprint' in st.session_state}")
-                    if 'should_display_blueprint' in st.session_state:
-                        st.sidebar.write(f"Value: {st.session_state.should_display_blueprint}")
-                    st.sidebar.write(f"current_blueprint exists: {'current_blueprint' in st.session_state}")
-                    
-                    # --- CONDITIONAL BLUEPRINT DISPLAY ---
-                    # This runs AFTER the button logic, on every script re-run
-
-                    if ('should_display_blueprint' in st.session_state and 
-                        st.session_state.should_display_blueprint and
-                        'current_blueprint' in st.session_state and
-                        'current_tokens' in st.session_state):
-
-                        if not st.session_state.get('already_displayed', False):  
-                            st.write("TEST: About to display blueprint")
-                            st.write(f"Recommendations count: {len(blueprint['recommendations'])}")
-
-                            # Display the blueprint using session state data
-                            display_blueprint(
-                                st.session_state.current_blueprint,
-                                st.session_state.current_tokens,
-                                st.session_state.raw_sas_code
-                            )
-
-                except Exception as e:
-                    st.error(f"❌ Lexing failed: {e}")
-                    st.info("This might be due to extremely complex or malformed SAS syntax.")
+        # Inform the user that processing has started
+        with st.spinner("Lexing and analyzing SAS code..."):
+        
+            # -------------------------------------
+            # THIS IS WHERE sas-lexer DOES ITS WORK
+            # (only once per distinct code, see analyze_sas_code)
+            # -------------------------------------
+            try:
+                analysis = analyze_sas_code(raw_sas_code, content_hash)
+                
+                # Check for lexing errors
+                if analysis["errors"]:
+                    st.warning(f"⚠️ Lexing completed with {analysis['errors']} warnings")
                     
+                # Basic confirmation for the user
+                st.success(f"✅ Lexing complete. Found {len(analysis['tokens'])} tokens.")
+               
+                # Store only the hash for Stage 2 and for display, the results stay in the shared cache
+                st.session_state.current_hash = content_hash
+                st.session_state.blueprint_generated = True
+                st.session_state.should_display_blueprint = True  # New flag
+
+                # Temporary debug
+                st.sidebar.write("Debug - Session State:")
+                st.sidebar.write(f"should_display_blueprint: {'should_display_blueprint' in st.session_state}")
+                if 'should_display_blueprint' in st.session_state:
+                    st.sidebar.write(f"Value: {st.session_state.should_display_blueprint}")
+                st.sidebar.write(f"current_hash: {st.session_state.current_hash[:12]}")
+                st.sidebar.write("Quick structure check:", list(analysis["blueprint"].keys()))
+                st.sidebar.write("Detailed counts:", analysis["blueprint"].get("detailed_counts", "MISSING"))
+
+            except Exception as e:
+                st.error(f"❌ Lexing failed: {e}")
+                st.info("This might be due to extremely complex or malformed SAS syntax.")
+
+    # --- CONDITIONAL BLUEPRINT DISPLAY ---
+    # This runs AFTER the button logic, on every script re-run, for as long as the uploaded code is unchanged
+    if (st.session_state.get('should_display_blueprint') and
+        st.session_state.get('current_hash') == content_hash):
+        try:
+            # Instant when cached, re-analyzed if the entry was evicted in the meantime
+            analysis = analyze_sas_code(raw_sas_code, content_hash)
+            display_blueprint(analysis["blueprint"], analysis["token_frame"])
+        except Exception as e:
+            st.error(f"❌ Lexing failed: {e}")
+
+
+# ====================
+# BATCH ANALYSIS (MULTI-FILE / ZIP)
+# ====================
+# Every program is lexed and blueprinted in a pool of worker processes (generate_blueprint is pure Python and
+# holds the GIL, threads would share one core with the script thread), while a fragment polls the job to show its
+# progress. Only one summary row per program comes back from the workers and is kept in the session, the programs
+# already in the shared analysis cache are summarized from it without being sent to the pool.
+BATCH_WORKERS = max(1, min(8, os.cpu_count() or 1))
+
+
+def read_batch_programs(uploaded_files):
+    """Return (name, bytes) of every .sas program uploaded, directly or inside a zip"""
+    programs = []
+    for uploaded in uploaded_files:
+        if uploaded.name.lower().endswith('.zip'):
+            with zipfile.ZipFile(io.BytesIO(uploaded.getvalue())) as archive:
+                for member in archive.infolist():
+                    if not member.is_dir() and member.filename.lower().endswith('.sas'):
+                        programs.append((f"{uploaded.name}/{member.filename}", archive.read(member)))
+        else:
+            programs.append((uploaded.name, uploaded.getvalue()))
+    return programs
+
+
+# Portfolio table column of each summary field of sas_blueprint.summarize_blueprint
+PORTFOLIO_COLUMNS = {
+    "translation_priority": "Priority",
+    "complexity_score": "Complexity Score",
+    "total_lines": "Lines",
+    "total_tokens": "Tokens",
+    "data_steps": "DATA Steps",
+    "proc_blocks": "PROC Blocks",
+    "proc_sql_blocks": "PROC SQL Blocks",
+    "macro_definitions": "Macro Definitions",
+    "macro_calls": "Macro Calls",
+    "lexing_warnings": "Lexing Warnings",
+}
+
+
+def portfolio_columns(summary):
+    return {PORTFOLIO_COLUMNS[field]: value for field, value in summary.items()}
+
+
+def precomputed_portfolio_rows(records):
+    """Portfolio rows of the records of a JSON Lines file written by sas_blueprint.py"""
+    rows = []
+    for record in records:
+        row = {"File": os.path.join(record["dir_path"], record["f_name"])}
+        if "blueprint" in record:
+            row["Status"] = "Done"
+            row.update(portfolio_columns(summarize_blueprint(record["blueprint"], record["lexing_warnings"])))
+        else:
+            row.update({"Status": "Failed", "Error": record.get("error")})
+        rows.append(row)
+    return rows
+
+
+class BatchJob:
+    """Analysis of many programs, running in the background; rows holds one summary row per program"""
+
+    def __init__(self, programs, cache, max_workers=BATCH_WORKERS):
+        self.rows = [{"File": name, "Status": "Queued"} for name, _ in programs]
+        self.completed = 0
+        self._lock = threading.Lock()
+        # spawned workers, forking the threaded Streamlit server isn't safe
+        executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+        for index, (_, raw_sas_bytes) in enumerate(programs):
+            analysis = cache.get(hashlib.sha256(raw_sas_bytes).hexdigest())
+            if analysis is not None:
+                self._finish(index, summarize_blueprint(analysis["blueprint"], analysis["errors"]))
+                continue
+            future = executor.submit(summarize_code, raw_sas_bytes)
+            future.add_done_callback(functools.partial(self._collect, index))
+        executor.shutdown(wait=False)  # the workers finish the queue, nothing waits on them
+
+    @property
+    def total(self):
+        return len(self.rows)
+
+    @property
+    def done(self):
+        return self.completed == self.total
+
+    def _collect(self, index, future):
+        try:
+            summary = future.result()
+        except Exception as e:
+            self._finish(index, error=str(e))
+        else:
+            self._finish(index, summary)
+
+    def _finish(self, index, summary=None, error=None):
+        row = self.rows[index]
+        if error is None:
+            row.update(portfolio_columns(summary))
+            row["Status"] = "Done"
+        else:
+            row.update({"Status": "Failed", "Error": error})
+        with self._lock:
+            self.completed += 1
+
+
+def display_batch_progress():
+    """Progress bar and table of the running batch job, refreshed every second until it is done"""
+    job = st.session_state.get("batch_job")
+    if job is None:
+        return
+    if job.done:
+        st.rerun()  # the whole page, so the portfolio view replaces the progress
+    st.progress(job.completed / job.total, text=f"Analyzed {job.completed} of {job.total} programs...")
+    st.dataframe(pd.DataFrame(list(job.rows)), use_container_width=True, hide_index=True, height=300)
+
+
+def display_portfolio(rows):
+    """Portfolio view of a finished batch job (or of precomputed blueprints): totals and a sortable per-program table"""
+    portfolio = pd.DataFrame(rows)
+    analyzed = portfolio[portfolio["Status"] == "Done"]
+    st.subheader("📊 Portfolio Blueprint")
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Programs", len(portfolio))
+    with col2:
+        st.metric("Total Lines", int(analyzed["Lines"].sum()) if len(analyzed) else 0)
+    with col3:
+        st.metric("Total Complexity", int(analyzed["Complexity Score"].sum()) if len(analyzed) else 0)
+    with col4:
+        st.metric("Failed", int((portfolio["Status"] == "Failed").sum()))
+
+    priorities = analyzed["Priority"].value_counts() if len(analyzed) else pd.Series(dtype=int)
+    col1, col2, col3 = st.columns(3)
+    for column, priority in zip((col1, col2, col3), ("High", "Medium", "Low")):
+        with column:
+            st.metric(f"{priority} Priority", int(priorities.get(priority, 0)))
+
+    # st.dataframe sorts on a click of the column header
+    st.dataframe(portfolio.sort_values("Complexity Score", ascending=False) if len(analyzed) else portfolio,
+                 use_container_width=True, hide_index=True)
+    st.download_button("⬇️ Download Portfolio (CSV)", portfolio.to_csv(index=False), file_name="sas_portfolio.csv",
+                       mime="text/csv")
+
+
+st.header("📦 Batch Analysis: Whole Projects")
+batch_files = st.file_uploader("Upload several SAS scripts, or a zip of a project folder", type=['sas', 'zip'],
+                               accept_multiple_files=True, key="batch_files")
+
+if batch_files:
+    if st.button("🚀 Analyze All Programs", type="primary"):
+        programs = read_batch_programs(batch_files)
+        if programs:
+            st.session_state.batch_job = BatchJob(programs, get_analysis_cache())
+        else:
+            st.warning("No .sas programs found in the upload.")
+
+    batch_job = st.session_state.get("batch_job")
+    if batch_job is not None:
+        if batch_job.done:
+            display_portfolio(batch_job.rows)
+        else:
+            st.fragment(run_every=1.0)(display_batch_progress)()
+
+# Blueprints computed offline (e.g. in CI) with: python sas_blueprint.py -i code_dir -o blueprints.jsonl
+precomputed_file = st.file_uploader("...or load precomputed blueprints (.jsonl written by sas_blueprint.py)",
+                                    type=['jsonl'], key="precomputed_blueprints")
+if precomputed_file is not None:
+    try:
+        display_portfolio(precomputed_portfolio_rows(read_blueprints(io.TextIOWrapper(precomputed_file,
+                                                                                      encoding='utf-8'))))
+    except (ValueError, KeyError) as e:
+        st.error(f"❌ Not a blueprints file written by sas_blueprint.py: {e}")
@@ -0,0 +1,228 @@
+"""
+AUDIT SCAN
+file: audit_scan.py
+purpose: sweep a whole SAS estate for hardcoded dates and credentials, the checks of find_date_lines and
+        get_password_lines (parse_functions.py) without running them file by file and line by line
+        the files are read in batches of about 64 MB into one buffer (each file's line endings normalized as
+        text mode reads them), the date and credential patterns run once over the whole buffer, and the hits
+        are mapped back to their file and line with a file-offset index and a line-offset index (numpy) built
+        once per batch; the next batch is read while the current one is scanned
+        the patterns work on the cp1252 bytes and give the same results as the parse functions: the rows
+        written are those of sas_parser.py --functions get_password_lines,find_date_lines
+example use: python audit_scan.py -i 'code_dir' -t 'sas' -o 'audit.csv'
+        where 'code_dir' is the directory tree of SAS programs, 'sas' the file type and 'audit.csv' the output
+        file (f_name, dir_path, func_descr, func_value like a detail file); the throughput (MB/s) is reported
+        at the end, '-b 256' reads batches of 256 MB
+"""
+
+import os
+import re
+import csv
+import time
+import argparse
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from tqdm import tqdm
+
+from crawler import crawl, DEFAULT_IO_WORKERS
+from result_writers import DETAIL_HEADER
+
+ENCODING = 'cp1252'
+DEFAULT_BATCH_MB = 64
+
+
+def _word_bytes():
+    """The bytes that decode to a word character (\\w of the decoded text)"""
+    word = set()
+    for value in range(256):
+        try:
+            char = bytes([value]).decode(ENCODING)
+        except UnicodeDecodeError:
+            continue
+        if re.match(r'\w', char):
+            word.add(value)
+    return frozenset(word)
+
+
+_WORD_BYTES = _word_bytes()
+
+# DATE_PATTERN (\b\d{4}-\d{2}-\d{2}\b) on the bytes: re finds the literal '-' of '-mm-dd' far faster than it finds
+# a leading digit, the year and the word boundaries (no word character of the decoded text before / after, as
+# the date starts and ends with a digit) are checked on each of these few candidates
+DATE_ANCHOR_BYTES = re.compile(rb'-\d{2}-\d{2}')
+
+# get_password_lines: 'password=' once the spaces are removed from the lower cased line (searched in the buffer
+# lower cased once, only ASCII letters can lower case to these) ...
+PASSWORD_BYTES = re.compile(rb'p *a *s *s *w *o *r *d *=')
+# ... unless the line holds the generic "&password"
+GENERIC_PASSWORD = b'"&password"'
+
+
+def iter_dates(buffer):
+    """Yield (offset, date) of each match of DATE_PATTERN in the decoded buffer, from the bytes"""
+    size = len(buffer)
+    for match in DATE_ANCHOR_BYTES.finditer(buffer):
+        start, end = match.start() - 4, match.end()
+        if (start >= 0 and buffer[start:start + 4].isdigit()
+                and (start == 0 or buffer[start - 1] not in _WORD_BYTES)
+                and (end == size or buffer[end] not in _WORD_BYTES)):
+            yield start, buffer[start:end].decode('ascii')
+
+
+# One batch of files read into a single buffer, file i is buffer[starts[i]:ends[i]] (followed by a '\n')
+Batch = namedtuple('Batch', 'paths buffer starts ends size')
+
+AuditReport = namedtuple('AuditReport', 'files bytes seconds scan_seconds password_lines date_lines')
+
+
+#-----------------------------------------------------------------------------
+# Reading the files in batches
+def iter_batches(entries, batch_bytes):
+    """Group the crawled files (see crawler.crawl) into lists of about batch_bytes"""
+    batch, size = [], 0
+    for entry in entries:
+        batch.append(entry)
+        size += entry.stat.st_size
+        if size >= batch_bytes:
+            yield batch
+            batch, size = [], 0
+    if batch:
+        yield batch
+
+
+def read_batch(entries):
+    """Read a batch of files into one buffer, each followed by a '\\n' so no match runs from one to the next
+
+    Line endings are normalized ('\\r\\n' and '\\r' to '\\n') as text mode reads them, cp1252 being a single
+    byte encoding the offsets in the buffer are also the offsets in the decoded text.
+    """
+    parts, starts, ends = [], [], []
+    position = size = 0
+    for entry in entries:
+        with open(entry.path, 'rb') as file:
+            raw = file.read()
+        size += len(raw)
+        raw = raw.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+        starts.append(position)
+        ends.append(position + len(raw))
+        parts.append(raw)
+        parts.append(b'\n')
+        position += len(raw) + 1
+    return Batch([entry.path for entry in entries], b''.join(parts), np.array(starts, dtype=np.int64),
+                 np.array(ends, dtype=np.int64), size)
+#-----------------------------------------------------------------------------
+
+
+#-----------------------------------------------------------------------------
+# Scanning a batch
+def scan_batch(batch):
+    """Run the date and credential patterns over a batch and map their hits to file and line
+
+    Returns:
+        tuple of form ([[(int, string)]], [[(int, [string])]]): per file of the batch, the results of
+            get_password_lines and of find_date_lines
+    """
+    buffer = batch.buffer
+    newlines = np.flatnonzero(np.frombuffer(buffer, dtype=np.uint8) == ord('\n'))
+    first_lines = np.searchsorted(newlines, batch.starts)  # index (in newlines) of the first line of each file
+
+    def locate(offsets):
+        """(file index, line index in the buffer, line number in the file) of each offset"""
+        offsets = np.asarray(offsets, dtype=np.int64)
+        files = np.searchsorted(batch.starts, offsets, side='right') - 1
+        lines = np.searchsorted(newlines, offsets)
+        return files, lines, lines - first_lines[files] + 1
+
+    def line_span(file, line):
+        start = newlines[line - 1] + 1 if line else 0
+        end = min(newlines[line] + 1, batch.ends[file])  # with its line ending, as iter_lines returns it
+        return int(start), int(end)
+
+    passwords = [[] for _ in batch.paths]
+    lowered = buffer.lower()
+    offsets = [match.start() for match in PASSWORD_BYTES.finditer(lowered)]
+    if offsets:
+        last = None
+        for file, line, line_no in zip(*locate(offsets)):
+            if line == last:
+                continue  # one row per line
+            last = line
+            start, end = line_span(file, line)
+            if lowered.find(GENERIC_PASSWORD, start, end) == -1:
+                passwords[file].append((int(line_no), buffer[start:end].decode(ENCODING, errors='replace')))
+
+    dates = [[] for _ in batch.paths]
+    matches = list(iter_dates(buffer))
+    if matches:
+        last = None
+        for (file, line, line_no), (_, date) in zip(zip(*locate([offset for offset, _ in matches])), matches):
+            if line == last:
+                dates[file][-1][1].append(date)
+            else:
+                dates[file].append((int(line_no), [date]))
+                last = line
+    return passwords, dates
+#-----------------------------------------------------------------------------
+
+
+def audit_scan(input_dir, output_file, file_type='sas', batch_mb=DEFAULT_BATCH_MB, io_workers=DEFAULT_IO_WORKERS):
+    """Scan every file of the type in the directory tree and write the results of get_password_lines and
+    find_date_lines for each, in the detail file format
+
+    Returns:
+        AuditReport: files and bytes scanned, elapsed time (all of it, and scanning only) and lines found
+    """
+    start = time.perf_counter()
+    files = scanned = scan_seconds = password_lines = date_lines = 0
+    batches = iter_batches(crawl(input_dir, file_type, io_workers), batch_mb * 1024 * 1024)
+    with open(output_file, 'w', newline='') as file, ThreadPoolExecutor(1) as reader, \
+            tqdm(desc="Scanning", unit="B", unit_scale=True) as progress:
+        writer = csv.writer(file)
+        writer.writerow(DETAIL_HEADER)
+        entries = next(batches, None)
+        pending = reader.submit(read_batch, entries) if entries else None
+        while pending is not None:
+            batch = pending.result()
+            # read the next batch while this one is scanned
+            entries = next(batches, None)
+            pending = reader.submit(read_batch, entries) if entries else None
+
+            scan_start = time.perf_counter()
+            passwords, dates = scan_batch(batch)
+            scan_seconds += time.perf_counter() - scan_start
+            for file_path, file_passwords, file_dates in zip(batch.paths, passwords, dates):
+                f_name, dir_path = os.path.basename(file_path), os.path.dirname(file_path)
+                writer.writerow([f_name, dir_path, "password", file_passwords])
+                writer.writerow([f_name, dir_path, "hardcoded_dates", file_dates])
+                password_lines += len(file_passwords)
+                date_lines += len(file_dates)
+            files += len(batch.paths)
+            scanned += batch.size
+            progress.update(batch.size)
+    return AuditReport(files, scanned, time.perf_counter() - start, scan_seconds, password_lines, date_lines)
+
+
+def format_report(report):
+    megabytes = report.bytes / (1024 * 1024)
+    return (f"{report.files} files, {megabytes:.1f} MB in {report.seconds:.2f} s "
+            f"({megabytes / max(report.seconds, 1e-9):.1f} MB/s, scanning alone "
+            f"{megabytes / max(report.scan_seconds, 1e-9):.1f} MB/s)\n"
+            f"{report.password_lines} password lines, {report.date_lines} lines with hardcoded dates")
+
+
+#================================================================
+# This is the entry point of the script
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Scan SAS programs for hardcoded dates and credentials.')
+    parser.add_argument('-i', '--input_dir', type=str, required=True, help='Input directory')
+    parser.add_argument('-t', '--file_type', type=str, default='sas', help='File type to be scanned (default sas)')
+    parser.add_argument('-o', '--output', type=str, required=True, help='Output csv file')
+    parser.add_argument('-b', '--batch_mb', type=int, default=DEFAULT_BATCH_MB,
+                        help=f'Size of the batches of files read at a time, in MB (default {DEFAULT_BATCH_MB})')
+    parser.add_argument('--io_workers', type=int, default=DEFAULT_IO_WORKERS,
+                        help=f'Number of threads listing directories and stat\'ing files (default {DEFAULT_IO_WORKERS})')
+    args = parser.parse_args()
+
+    print(format_report(audit_scan(args.input_dir, args.output, args.file_type, args.batch_mb, args.io_workers)))
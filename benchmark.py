@@ -0,0 +1,220 @@
+"""
+BENCHMARK
+file: benchmark.py
+purpose: time the parser on a synthetic (or real) SAS corpus and store the results as JSON, so a regression
+        can be spotted by comparing the results of two commits
+        measured: reading the files, each parse function in sas_parser.functions_to_apply, process_files end to
+        end, lexing with sas-lexer and sas_blueprint.generate_blueprint on the token streams
+        each is reported with its throughput (files/s, MB/s, tokens/s) and peak memory (tracemalloc, measured in
+        a second run so it doesn't slow down the timed one)
+example use: python benchmark.py -s small -o 'bench_small.json' -c 'bench_small_before.json'
+        where 'small' is the shape of the synthetic corpus (see synthetic_corpus.py), 'bench_small.json' is the
+        results file and 'bench_small_before.json' the results of an earlier run to compare with
+        use '-i code_dir' to benchmark an existing directory of SAS programs instead
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import datetime
+import tempfile
+import subprocess
+import tracemalloc
+
+import sas_parser
+from parse_functions import load_document
+from synthetic_corpus import generate_corpus, SHAPES
+
+
+def measure(func, *args, memory=True):
+    """Run func(*args) timed, then again under tracemalloc for its peak memory
+
+    Returns:
+        tuple of form (object, float, int): result of the (timed) run, seconds and peak bytes (None if not measured)
+    """
+    start = time.perf_counter()
+    result = func(*args)
+    seconds = time.perf_counter() - start
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            func(*args)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result, seconds, peak
+
+
+def report(name, seconds, peak, files, total_bytes, tokens=None):
+    """Build the result record of one benchmark"""
+    record = {
+        'name': name,
+        'seconds': round(seconds, 6),
+        'files': files,
+        'bytes': total_bytes,
+        'files_per_s': round(files / seconds, 2) if seconds else None,
+        'mb_per_s': round(total_bytes / (1024 * 1024) / seconds, 3) if seconds else None,
+        'peak_mb': round(peak / (1024 * 1024), 3) if peak is not None else None,
+    }
+    if tokens is not None:
+        record['tokens'] = tokens
+        record['tokens_per_s'] = round(tokens / seconds, 1) if seconds else None
+    print(f"{name:<40} {seconds:10.3f}s {record['files_per_s'] or 0:12.1f} files/s {record['mb_per_s'] or 0:10.2f} MB/s"
+          + (f" {record['tokens_per_s']:14.0f} tokens/s" if tokens is not None else "")
+          + (f" {record['peak_mb']:10.1f} MB peak" if peak is not None else ""))
+    return record
+
+
+def git_commit():
+    """Return the commit being benchmarked, if this is a git checkout"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+#-----------------------------------------------------------------------------
+# The benchmarks, each returns a list of result records
+def bench_parse_functions(paths, total_bytes, memory=True):
+    """Reading the files, then each parse function on its own (over documents read beforehand)"""
+    records = []
+    _, seconds, peak = measure(lambda: [load_document(path).close() for path in paths], memory=memory)
+    records.append(report('read files', seconds, peak, len(paths), total_bytes))
+
+    for func, needs_file_list in sas_parser.resolve_dispatch(sas_parser.functions_to_apply):
+        def run():
+            docs = [load_document(path) for path in paths]  # a fresh document, nothing cached from another run
+            start = time.perf_counter()
+            for doc in docs:
+                func(doc, paths) if needs_file_list else func(doc)
+            elapsed = time.perf_counter() - start
+            for doc in docs:
+                doc.close()
+            return elapsed
+        # time only the function itself, not reading the documents
+        seconds = run()
+        peak = None
+        if memory:
+            tracemalloc.start()
+            try:
+                run()
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        records.append(report(func.__name__, seconds, peak, len(paths), total_bytes))
+    return records
+
+
+def bench_process_files(input_dir, paths, total_bytes, workers=1, memory=True):
+    """process_files end to end (without the result cache, so every file is parsed)"""
+    records = []
+    for worker_count in sorted({1, workers}):
+        output_dir = tempfile.mkdtemp(prefix='sas_bench_out_')
+        try:
+            _, seconds, peak = measure(lambda: sas_parser.process_files(input_dir, output_dir, 'sas', workers=worker_count,
+                                                                        use_cache=False), memory=memory)
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        records.append(report(f'process_files (workers={worker_count})', seconds, peak, len(paths), total_bytes))
+    return records
+
+
+def bench_blueprint(paths, total_bytes, memory=True):
+    """Lexing with sas-lexer and sas_blueprint.generate_blueprint on the token streams"""
+    try:
+        from sas_lexer import lex_program_from_str
+        from sas_blueprint import generate_blueprint
+    except ImportError as error:  # sas-lexer not installed
+        print(f"blueprint benchmarks skipped: {error}")
+        return []
+
+    codes = [load_document(path).content for path in paths]
+    lexed, seconds, peak = measure(lambda: [lex_program_from_str(code)[0] for code in codes], memory=memory)
+    tokens = sum(len(code_tokens) for code_tokens in lexed)
+    records = [report('lex_program_from_str', seconds, peak, len(paths), total_bytes, tokens)]
+
+    _, seconds, peak = measure(lambda: [generate_blueprint(code_tokens, code)
+                                        for code_tokens, code in zip(lexed, codes)], memory=memory)
+    records.append(report('generate_blueprint', seconds, peak, len(paths), total_bytes, tokens))
+    return records
+#-----------------------------------------------------------------------------
+
+
+def compare(results, previous):
+    """Print the change in time of each benchmark against an earlier results file"""
+    before = {record['name']: record for record in previous['results']}
+    print(f"\ncompared with {previous.get('commit') or 'previous run'} ({previous.get('timestamp')}):")
+    for record in results['results']:
+        old = before.get(record['name'])
+        if old and old['seconds']:
+            change = (record['seconds'] - old['seconds']) / old['seconds'] * 100
+            print(f"{record['name']:<40} {old['seconds']:10.3f}s -> {record['seconds']:10.3f}s {change:+8.1f}%")
+
+
+def run_benchmarks(input_dir=None, shape='small', files=None, statements=None, seed=0, workers=1, memory=True):
+    """Generate the corpus (unless input_dir is given) and run every benchmark on it
+
+    Returns:
+        dict: the results, as stored in the JSON file
+    """
+    generated_dir = None
+    if input_dir is None:
+        generated_dir = input_dir = tempfile.mkdtemp(prefix='sas_bench_corpus_')
+        corpus = generate_corpus(input_dir, shape, files, statements, seed)
+        corpus.pop('paths')
+    else:
+        corpus = {'input_dir': input_dir}
+    try:
+        paths = [os.path.join(dirpath, file) for dirpath, _, dir_files in os.walk(input_dir)
+                 for file in dir_files if file.endswith('.sas')]
+        total_bytes = sum(os.path.getsize(path) for path in paths)
+        corpus.update({'files': len(paths), 'bytes': total_bytes})
+        print(f"corpus: {len(paths)} files, {total_bytes / (1024 * 1024):.1f} MB")
+
+        records = bench_parse_functions(paths, total_bytes, memory)
+        records += bench_process_files(input_dir, paths, total_bytes, workers, memory)
+        records += bench_blueprint(paths, total_bytes, memory)
+    finally:
+        if generated_dir:
+            shutil.rmtree(generated_dir, ignore_errors=True)
+
+    return {
+        'timestamp': datetime.datetime.now().isoformat(),
+        'commit': git_commit(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'corpus': corpus,
+        'results': records,
+    }
+
+
+#================================================================
+# This is the entry point of the script
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the SAS parser.')
+    parser.add_argument('-s', '--shape', type=str, default='small', choices=sorted(SHAPES),
+                        help='Shape of the synthetic corpus')
+    parser.add_argument('-n', '--files', type=int, help='Number of programs (default depends on the shape)')
+    parser.add_argument('--statements', type=int, help='Statements per program (default depends on the shape)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the synthetic corpus')
+    parser.add_argument('-i', '--input_dir', type=str, help='Benchmark this directory instead of a synthetic corpus')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Also time process_files with this many workers')
+    parser.add_argument('--no_memory', action='store_true', help='Skip the (slower) peak memory runs')
+    parser.add_argument('-o', '--output', type=str, help='JSON file the results are written to')
+    parser.add_argument('-c', '--compare', type=str, help='JSON results of an earlier run to compare with')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.input_dir, args.shape, args.files, args.statements, args.seed, args.workers,
+                             not args.no_memory)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file))
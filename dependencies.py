@@ -0,0 +1,428 @@
+"""
+DEPENDENCIES
+file: dependencies.py
+purpose: the code each program actually pulls in, through %include and through the macros it calls, so the
+        complexity and the migration plan of a program account for its dependencies
+        every program is lexed once (sas-lexer) for the macros it defines and calls, its %include targets, its
+        FILENAME filerefs and its %LET values; the %include paths are resolved with those macro variables (not
+        in single quotes, as SAS does) relative to the program, and matched against the programs of the corpus
+        a macro call is resolved to the program itself, a program it includes, the autocall member named after
+        the macro (name.sas) or another program defining it, in that order
+        the transitive closure of every program is computed once per strongly connected component (Tarjan),
+        in reverse topological order, each closure being the union (a bitset) of the closures it reaches
+        the symbols of each program are kept in an index file with the modification time and size of the
+        program, so a rerun only lexes the programs that changed
+example use: python dependencies.py -i 'code_dir' -t 'sas' -o 'dependencies.csv' -x 'dependencies.json' -w 8
+        where 'code_dir' is the directory tree of SAS programs, 'sas' the file type, 'dependencies.csv' the output
+        (one row per program with its closure size, lines and complexity score), 'dependencies.json' the index
+        (read first if it exists, then updated) and 8 the number of worker processes
+        add '--closure code_dir/prog.sas' to list the programs a program depends on
+"""
+
+import os
+import re
+import csv
+import json
+import argparse
+import multiprocessing
+
+import numpy as np
+from tqdm import tqdm
+
+from crawler import crawl
+from sas_blueprint import lex_and_blueprint
+
+INDEX_FORMAT_VERSION = 1
+
+# An item of a %include statement: a quoted path, or a fileref with an optional (member), the '/' of the options
+_INCLUDE_ITEM = re.compile(r"""'([^']*)'|"([^"]*)"|([A-Za-z_]\w*)\s*(?:\(\s*['"]?([^'")\s]+)['"]?\s*\))?|(/)""")
+# FILENAME fileref [device] 'path'
+_FILENAME_STATEMENT = re.compile(r"""^\s*([A-Za-z_]\w*)\s+(?:([A-Za-z]\w*)\s+)?['"]([^'"]*)['"]""")
+# %LET name = value
+_LET_STATEMENT = re.compile(r'^\s*([A-Za-z_]\w*)\s*=(.*)$', re.DOTALL)
+# &name or &name. in a path
+_MACRO_VARIABLE = re.compile(r'&(\w+)\.?')
+
+# FILENAME devices that don't name a file or directory
+_NON_FILE_DEVICES = {'PIPE', 'URL', 'FTP', 'EMAIL', 'TEMP', 'DUMMY', 'SOCKET', 'CATALOG', 'CLIPBRD', 'ZIP'}
+
+
+#-----------------------------------------------------------------------------
+# The symbols of one program
+def program_symbols(file_path, encoding='cp1252'):
+    """Lex a program for what it defines, calls and includes
+
+    Returns:
+        dict: 'macros' defined and macro 'calls' (upper case), 'includes' (['path', path, expand macro variables]
+            or ['fileref', fileref, member] items), 'filerefs' and 'lets' ({name: value}), 'lines' and
+            'complexity_score' (see sas_blueprint.generate_blueprint), or 'error' if the program couldn't be read
+    """
+    try:
+        with open(file_path, 'r', encoding=encoding) as file:
+            code = file.read()
+        tokens, _, blueprint = lex_and_blueprint(code)
+    except Exception as e:
+        return {'error': str(e)}
+
+    symbols = {'macros': [], 'calls': [], 'includes': [], 'filerefs': {}, 'lets': {},
+               'lines': blueprint['summary']['total_lines'],
+               'complexity_score': blueprint['summary']['complexity_score']}
+    kinds = [token.token_type.name for token in tokens]
+
+    def statement_text(k):
+        """Code from the end of token k to the next ';'"""
+        end = k + 1
+        while end < len(tokens) and kinds[end] != 'SEMI':
+            end += 1
+        return code[tokens[k].stop:tokens[end].start if end < len(tokens) else len(code)]
+
+    for k, kind in enumerate(kinds):
+        if kind == 'KWM_MACRO':
+            following = next((j for j in range(k + 1, len(tokens)) if kinds[j] != 'WS'), None)
+            if following is not None and kinds[following] == 'IDENTIFIER':
+                symbols['macros'].append(code[tokens[following].start:tokens[following].stop].upper())
+        elif kind == 'MACRO_IDENTIFIER':
+            symbols['calls'].append(code[tokens[k].start + 1:tokens[k].stop].upper())
+        elif kind == 'KWM_INCLUDE':
+            for match in _INCLUDE_ITEM.finditer(statement_text(k)):
+                single, double, fileref, member, options = match.groups()
+                if options:
+                    break
+                if fileref:
+                    symbols['includes'].append(['fileref', fileref.upper(), member])
+                else:
+                    # macro variables are resolved in double quotes only
+                    symbols['includes'].append(['path', single if single is not None else double, double is not None])
+        elif kind == 'KW_FILENAME':
+            match = _FILENAME_STATEMENT.match(statement_text(k))
+            if match and (match.group(2) or '').upper() not in _NON_FILE_DEVICES:
+                symbols['filerefs'][match.group(1).upper()] = match.group(3)
+        elif kind == 'KWM_LET':
+            match = _LET_STATEMENT.match(statement_text(k))
+            if match:
+                symbols['lets'][match.group(1).upper()] = match.group(2).strip()
+    symbols['macros'] = list(dict.fromkeys(symbols['macros']))
+    symbols['calls'] = list(dict.fromkeys(symbols['calls']))
+    return symbols
+
+
+def _symbols_task(file_path):
+    return file_path, program_symbols(file_path)
+
+
+def iter_program_symbols(files_to_process, workers=1):
+    """Lex the programs, serially or spread over a pool of worker processes
+
+    Yields:
+        tuple of form (string, dict): path and symbols of each program, in files_to_process order
+    """
+    if workers <= 1 or len(files_to_process) <= 1:
+        yield from map(_symbols_task, files_to_process)
+        return
+    chunksize = max(1, min(64, len(files_to_process) // (workers * 4)))
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap(_symbols_task, files_to_process, chunksize)
+#-----------------------------------------------------------------------------
+
+
+#-----------------------------------------------------------------------------
+# Closures
+def strongly_connected_components(edges):
+    """Tarjan's algorithm (iterative, so deep include chains don't hit the recursion limit)
+
+    Args:
+        edges ([[int]]): the nodes each node points to
+
+    Returns:
+        [[int]]: the components, each listed after every component it reaches (reverse topological order)
+    """
+    index = [None] * len(edges)
+    low = [0] * len(edges)
+    on_stack = [False] * len(edges)
+    stack, components = [], []
+    counter = 0
+    for root in range(len(edges)):
+        if index[root] is not None:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        work = [(root, iter(edges[root]))]
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if index[child] is None:
+                    index[child] = low[child] = counter
+                    counter += 1
+                    stack.append(child)
+                    on_stack[child] = True
+                    work.append((child, iter(edges[child])))
+                    break
+                if on_stack[child]:
+                    low[node] = min(low[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+    return components
+
+
+def transitive_closures(edges):
+    """Everything reachable from each node, as a bitset (int) that includes the node itself
+
+    The closure of a component is computed once, from the closures of the components it points to (which
+    come before it), and shared by all of its members.
+    """
+    component_of = [None] * len(edges)
+    closures = [0] * len(edges)
+    for number, members in enumerate(strongly_connected_components(edges)):
+        bits = 0
+        for member in members:
+            component_of[member] = number
+            bits |= 1 << member
+        for member in members:
+            for child in edges[member]:
+                if component_of[child] != number:
+                    bits |= closures[child]
+        for member in members:
+            closures[member] = bits
+    return closures
+
+
+def bitset_mask(bits, size):
+    """Boolean numpy mask of the members of a bitset"""
+    return np.unpackbits(np.frombuffer(bits.to_bytes((size + 7) // 8, 'little'), dtype=np.uint8),
+                         bitorder='little')[:size].astype(bool)
+#-----------------------------------------------------------------------------
+
+
+#-----------------------------------------------------------------------------
+# The dependency graph of a corpus
+class DependencyGraph:
+    """The programs of a corpus with the programs each depends on, directly and transitively
+
+    Args:
+        symbols ({string: dict}): program_symbols of every program, by path (in crawl order)
+    """
+
+    def __init__(self, symbols):
+        self.paths = list(symbols)
+        self.symbols = [symbols[path] for path in self.paths]
+        self._position = {self._key(path): number for number, path in enumerate(self.paths)}
+        self._by_name = {}      # lower case file name -> programs
+        self._autocall = {}     # macro name -> programs named after it
+        self._definers = {}     # macro name -> programs defining it
+        for number, path in enumerate(self.paths):
+            name = os.path.basename(path)
+            self._by_name.setdefault(name.lower(), []).append(number)
+            self._autocall.setdefault(os.path.splitext(name)[0].upper(), []).append(number)
+            for macro in self.symbols[number].get('macros', ()):
+                self._definers.setdefault(macro, []).append(number)
+        # %LET values that are the same wherever they are set, to resolve the paths of programs not setting them
+        values = {}
+        for program in self.symbols:
+            for name, value in program.get('lets', {}).items():
+                values.setdefault(name, set()).add(value)
+        self._global_lets = {name: value.pop() for name, value in values.items() if len(value) == 1}
+
+        self.unresolved = [[] for _ in self.paths]
+        self.includes = [self._resolve_includes(number) for number in range(len(self.paths))]
+        include_closures = transitive_closures(self.includes)
+        self.macro_providers = [self._resolve_calls(number, include_closures[number])
+                                for number in range(len(self.paths))]
+        self.edges = [sorted(set(included) | set(providers))
+                      for included, providers in zip(self.includes, self.macro_providers)]
+        self.closures = transitive_closures(self.edges)
+
+    @staticmethod
+    def _key(path):
+        return os.path.normpath(path.replace('\\', '/')).lower()
+
+    def _expand(self, number, text):
+        """Resolve the macro variables of a path with the %LET values of the program (or of the corpus)"""
+        lets = self.symbols[number].get('lets', {})
+        for _ in range(3):  # a value can hold further macro variables
+            if '&' not in text:
+                break
+            text = _MACRO_VARIABLE.sub(lambda match: lets.get(match.group(1).upper(),
+                                                              self._global_lets.get(match.group(1).upper(),
+                                                                                    match.group(0))), text)
+        return text
+
+    def find_program(self, number, path):
+        """The program a path refers to: the same path (relative to the including program) or else the program
+        of the same name whose path ends the most like it, None if there is none"""
+        path = path.replace('\\', '/')
+        if not os.path.isabs(path):
+            path = os.path.join(os.path.dirname(self.paths[number]), path)
+        found = self._position.get(self._key(path))
+        if found is not None:
+            return found
+        candidates = self._by_name.get(os.path.basename(path).lower())
+        if not candidates:
+            return None
+        parts = self._key(path).split(os.sep)
+
+        def common_suffix(candidate):
+            other = self._key(self.paths[candidate]).split(os.sep)
+            length = 0
+            while length < min(len(parts), len(other)) and parts[-1 - length] == other[-1 - length]:
+                length += 1
+            return length
+
+        return max(candidates, key=common_suffix)  # the first in crawl order on a tie
+
+    def _resolve_includes(self, number):
+        program = self.symbols[number]
+        targets = []
+        for kind, name, detail in program.get('includes', ()):
+            if kind == 'fileref':
+                fileref, member = name, detail
+                location = program.get('filerefs', {}).get(fileref)
+                if location is None:
+                    self.unresolved[number].append(f"%include {fileref}{f'({member})' if member else ''}")
+                    continue
+                location = self._expand(number, location)
+                path = os.path.join(location, member if member.lower().endswith('.sas') else f"{member}.sas") \
+                    if member else location
+            else:
+                path = self._expand(number, name) if detail else name
+            target = self.find_program(number, path) if '&' not in path else None
+            if target is None:
+                self.unresolved[number].append(f"%include {path}")
+            elif target != number:
+                targets.append(target)
+        return targets
+
+    def _resolve_calls(self, number, include_closure):
+        program = self.symbols[number]
+        defined = set(program.get('macros', ()))
+        directory = os.path.dirname(self.paths[number])
+        providers = []
+        for macro in program.get('calls', ()):
+            if macro in defined:
+                continue
+            definers = self._definers.get(macro, [])
+            if any(include_closure >> definer & 1 for definer in definers):
+                continue  # defined by a program it includes
+            candidates = self._autocall.get(macro) or definers
+            if not candidates:
+                self.unresolved[number].append(f"%{macro.lower()}")
+                continue
+            # the candidate in the same directory, else the first in crawl order
+            provider = next((candidate for candidate in candidates
+                             if os.path.dirname(self.paths[candidate]) == directory), candidates[0])
+            if provider != number:
+                providers.append(provider)
+        return providers
+
+    def dependencies(self, path):
+        """The programs a program depends on, directly or not"""
+        number = self.paths.index(path)
+        mask = bitset_mask(self.closures[number], len(self.paths))
+        mask[number] = False
+        return [self.paths[member] for member in np.flatnonzero(mask)]
+
+    def closure_totals(self, values):
+        """Per program, the sum of the values of the programs in its closure (itself included)
+
+        Args:
+            values (numpy array): one value per program
+        """
+        totals = np.zeros(len(self.paths), dtype=values.dtype)
+        computed = {}  # members of a component share their closure
+        for number, bits in enumerate(self.closures):
+            if bits not in computed:
+                computed[bits] = values[bitset_mask(bits, len(self.paths))].sum()
+            totals[number] = computed[bits]
+        return totals
+
+    def closure_sizes(self):
+        """Per program, the number of programs it depends on"""
+        return np.array([bits.bit_count() - 1 for bits in self.closures])
+#-----------------------------------------------------------------------------
+
+
+def build_dependencies(input_dir, file_type='sas', index_file=None, workers=1):
+    """Lex the programs of a directory tree (only those changed since the index file was written) and build
+    their dependency graph
+
+    Returns:
+        DependencyGraph: the graph
+    """
+    entries = list(crawl(input_dir, file_type))
+    index = {}
+    if index_file and os.path.exists(index_file):
+        with open(index_file) as file:
+            data = json.load(file)
+        if data.get('version') == INDEX_FORMAT_VERSION:
+            index = data['programs']
+    stamps = {entry.path: [entry.stat.st_mtime_ns, entry.stat.st_size] for entry in entries}
+    changed = [entry.path for entry in entries
+               if entry.path not in index or index[entry.path]['stamp'] != stamps[entry.path]]
+    for file_path, symbols in tqdm(iter_program_symbols(changed, workers), total=len(changed),
+                                   desc="Lexing programs", unit="file"):
+        index[file_path] = {'stamp': stamps[file_path], 'symbols': symbols}
+    if index_file:
+        with open(index_file, 'w') as file:
+            json.dump({'version': INDEX_FORMAT_VERSION,
+                       'programs': {path: index[path] for path in stamps}}, file, separators=(',', ':'))
+    return DependencyGraph({path: index[path]['symbols'] for path in stamps})
+
+
+DEPENDENCIES_HEADER = ["f_name", "dir_path", "lines", "complexity_score", "macros_defined", "macro_calls",
+                       "includes", "direct_dependencies", "closure_programs", "closure_lines",
+                       "closure_complexity_score", "unresolved"]
+
+
+def write_dependencies(graph, output_file):
+    """Write one row per program: its own size and score, and those of everything it pulls in"""
+    lines = np.array([program.get('lines', 0) for program in graph.symbols], dtype=np.int64)
+    scores = np.array([program.get('complexity_score', 0) for program in graph.symbols], dtype=np.int64)
+    closure_lines = graph.closure_totals(lines)
+    closure_scores = graph.closure_totals(scores)
+    sizes = graph.closure_sizes()
+    with open(output_file, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(DEPENDENCIES_HEADER)
+        for number, (path, program) in enumerate(zip(graph.paths, graph.symbols)):
+            writer.writerow([os.path.basename(path), os.path.dirname(path), lines[number], scores[number],
+                             len(program.get('macros', ())), len(program.get('calls', ())),
+                             len(program.get('includes', ())), len(graph.edges[number]), sizes[number],
+                             closure_lines[number], closure_scores[number],
+                             "; ".join(graph.unresolved[number] + ([program['error']] if 'error' in program else []))])
+
+
+#================================================================
+# This is the entry point of the script
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Resolve the %include and macro dependencies of SAS programs.')
+    parser.add_argument('-i', '--input_dir', type=str, required=True, help='Input directory')
+    parser.add_argument('-t', '--file_type', type=str, default='sas', help='File type to be processed (default sas)')
+    parser.add_argument('-o', '--output', type=str, help='Output csv file, one row per program')
+    parser.add_argument('-x', '--index', type=str, help='Index JSON file of the program symbols, updated incrementally')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of worker processes (default 1)')
+    parser.add_argument('--closure', type=str, action='append', default=[],
+                        help='List the programs this program depends on')
+    args = parser.parse_args()
+
+    dependency_graph = build_dependencies(args.input_dir, args.file_type, args.index, args.workers)
+    if args.output:
+        write_dependencies(dependency_graph, args.output)
+        print(f"{len(dependency_graph.paths)} programs written to {args.output}")
+    for program_path in args.closure:
+        dependencies = dependency_graph.dependencies(program_path)
+        print(f"\n{program_path} depends on {len(dependencies)} programs")
+        for dependency in dependencies:
+            print(f"  {dependency}")
@@ -0,0 +1,100 @@
+"""
+INSTRUMENTATION
+file: instrumentation.py
+purpose: timing of the parse functions, used by sas_parser.py --timings and --profile
+        with --timings every file gets a 'read' row (time to read it, bytes read), one row per parse function
+        run on it (time, size of the result as written to the detail file) and a 'shared' row (time to build the
+        lines, tokens etc. the functions share) in timings_yymmddhhmmss.csv, and the slowest functions / files
+        are reported at the end of the run
+        with --profile the whole run is profiled with cProfile (the main process only, so use it without workers)
+"""
+
+import csv
+import heapq
+import pstats
+import cProfile
+
+TIMINGS_HEADER = ["f_name", "dir_path", "function", "wall_s", "bytes_read", "result_size"]
+
+
+#-----------------------------------------------------------------------------
+# Writer of the timings_yymmddhhmmss.csv file, keeping the totals for the end of run report
+class TimingsRecorder:
+    """Write the timing rows of each file and keep what is needed for the slowest files / functions report,
+    so memory doesn't grow with the number of files
+
+    Args:
+        file_name (string): full path of the timings csv file
+        top_n (int): number of slowest files / function calls to report
+    """
+
+    def __init__(self, file_name, top_n=10):
+        self.top_n = top_n
+        self.function_totals = {}  # function -> [calls, total seconds, max seconds, total result size]
+        self.bytes_read = 0
+        self._slowest_files = []   # min heap of (seconds, file path), the top_n slowest files
+        self._slowest_calls = []   # min heap of (seconds, file path, function)
+        self._file = open(file_name, 'w', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(TIMINGS_HEADER)
+
+    def record(self, timing_rows):
+        """Record the timing rows of one file, as produced by sas_parser.parse_file"""
+        self._writer.writerows(timing_rows)
+        file_seconds = 0.0
+        for f_name, dir_path, function, seconds, bytes_read, result_size in timing_rows:
+            file_seconds += seconds
+            self.bytes_read += bytes_read
+            totals = self.function_totals.setdefault(function, [0, 0.0, 0.0, 0])
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] = max(totals[2], seconds)
+            totals[3] += result_size
+            self._push(self._slowest_calls, (seconds, f"{dir_path}/{f_name}", function))
+        if timing_rows:
+            f_name, dir_path = timing_rows[0][:2]
+            self._push(self._slowest_files, (file_seconds, f"{dir_path}/{f_name}"))
+
+    def _push(self, heap, item):
+        if len(heap) < self.top_n:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+
+    def report(self):
+        """Return the end of run report: time per function, slowest files and slowest function calls"""
+        total = sum(totals[1] for totals in self.function_totals.values())
+        lines = [f"Timings: {total:.3f}s in the parse functions, {self.bytes_read / (1024 * 1024):.1f} MB read",
+                 f"{'function':<28}{'calls':>10}{'total_s':>12}{'share':>8}{'mean_ms':>12}{'max_ms':>12}"]
+        for function, (calls, seconds, max_seconds, _) in sorted(self.function_totals.items(),
+                                                                 key=lambda item: item[1][1], reverse=True):
+            lines.append(f"{function:<28}{calls:>10}{seconds:>12.3f}{seconds / total if total else 0:>8.1%}"
+                         f"{seconds / calls * 1000:>12.3f}{max_seconds * 1000:>12.3f}")
+        lines.append(f"Top {self.top_n} slowest files:")
+        lines += [f"  {seconds:10.3f}s  {path}" for seconds, path in sorted(self._slowest_files, reverse=True)]
+        lines.append(f"Top {self.top_n} slowest function calls:")
+        lines += [f"  {seconds:10.3f}s  {function:<24} {path}"
+                  for seconds, path, function in sorted(self._slowest_calls, reverse=True)]
+        return "\n".join(lines)
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+#-----------------------------------------------------------------------------
+
+
+def run_profiled(profile_file_name, func, *args, **kwargs):
+    """Run func(*args, **kwargs) under cProfile, dump the stats to profile_file_name and print the top entries"""
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        profiler.dump_stats(profile_file_name)
+        print(f"cProfile stats written to {profile_file_name}")
+        pstats.Stats(profiler).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(25)
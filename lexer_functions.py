@@ -0,0 +1,199 @@
+"""
+LEXER FUNCTIONS
+file: lexer_functions.py
+purpose: token based versions of the parse functions in parse_functions.py, used by sas_parser.py -l (--lexer)
+        each file is tokenized once with sas-lexer and a single pass over the token stream finds the SQL, export,
+        _null_ data step, LIBNAME and hardcoded date results, so code that is commented out or inside a string
+        literal is no longer counted
+        the functions return the same result names and value shapes as their text based counterparts
+"""
+
+import bisect
+
+from sas_lexer.token_channel import TokenChannel
+from sas_lexer.token_type import TokenType
+
+from parse_functions import accepts_path, parse_function, DATE_PATTERN
+
+
+#-----------------------------------------------------------------------------
+# One pass over the token stream, shared by all of the token based functions
+def scan_tokens(doc):
+    """Find the SQL blocks, export / _null_ blocks, LIBNAME statements and hardcoded dates of a document
+
+    Args:
+        doc (SasDocument): the file to be parsed
+
+    Returns:
+        dict: 'sql_blocks' [(line, sql code)], 'export_count' int, 'null_ds_count' int,
+            'libname_lines' [line], 'date_lines' [(line, [dates])]
+    """
+    return doc.shared('token_scan', lambda: _scan_tokens(doc))
+
+
+def _scan_tokens(doc):
+    content = doc.content
+    sql_blocks = []
+    libname_lines = []
+    comment_spans = []
+    export_count = null_ds_count = 0
+
+    sql_line = None      # line of the PROC SQL being read
+    sql_body = None      # pieces of its code, once past the PROC SQL statement
+    in_export = in_null_ds = False
+    previous = TokenType.SEMI  # type of the previous code token, a file starts like a new statement
+
+    for token in doc.tokens:
+        if token.channel != TokenChannel.DEFAULT:
+            if token.channel == TokenChannel.COMMENT:
+                comment_spans.append((token.start, token.stop))
+            if sql_body and sql_body[-1] != ' ':
+                sql_body.append(' ')  # whitespace and comments collapse to a single space
+            continue
+
+        token_type = token.token_type
+        if previous == TokenType.KW_PROC:
+            proc_name = content[token.start:token.stop].upper()
+            if proc_name == 'SQL':
+                sql_line, sql_body = token.line, None
+            elif proc_name == 'EXPORT':
+                in_export = True
+        elif token_type == TokenType.KW_NULL_DATASET and previous == TokenType.KW_DATA:
+            in_null_ds = True
+        elif token_type == TokenType.KW_QUIT and sql_line is not None:
+            if sql_body is not None:
+                sql_blocks.append((sql_line, ''.join(sql_body).strip()))
+            sql_line = sql_body = None
+        elif token_type == TokenType.KW_RUN:
+            if in_export:
+                export_count += 1
+                in_export = False
+            if in_null_ds:
+                null_ds_count += 1
+                in_null_ds = False
+        elif token_type == TokenType.KW_LIBNAME and previous == TokenType.SEMI:
+            libname_lines.append(doc.lines[token.line - 1])
+
+        if sql_body is not None:
+            sql_body.append(content[token.start:token.stop])
+        elif sql_line is not None and token_type == TokenType.SEMI:
+            sql_body = []  # the end of the PROC SQL statement, the SQL code starts after it
+        previous = token_type
+
+    # hardcoded dates anywhere in the code, but not in comments
+    comment_starts = [start for start, _ in comment_spans]
+    date_lines = []
+    for match in DATE_PATTERN.finditer(content):
+        position = bisect.bisect_right(comment_starts, match.start()) - 1
+        if position >= 0 and match.start() < comment_spans[position][1]:
+            continue
+        line = doc.line_number(match.start())
+        if date_lines and date_lines[-1][0] == line:
+            date_lines[-1][1].append(match.group())
+        else:
+            date_lines.append((line, [match.group()]))
+
+    return {
+        'sql_blocks': sql_blocks,
+        'export_count': export_count,
+        'null_ds_count': null_ds_count,
+        'libname_lines': libname_lines,
+        'date_lines': date_lines,
+    }
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Define function to count the number of PROC SQL / QUIT blocks in the code
+@parse_function('sql_count', needs=('tokens',), cost=5, default=False, replaces='count_sql')
+@accepts_path
+def count_sql_tokens(doc):
+    """Count the number of SQL blocks, ignoring comments and string literals
+
+    Args:
+        doc (SasDocument): the file to be parsed (a full file path is also accepted)
+
+    Returns:
+        integer: count of the number of SQL blocks
+    """
+    return ("sql_count", [len(scan_tokens(doc)['sql_blocks'])])
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Define function to find the code of the PROC SQL / QUIT blocks
+@parse_function('sql_code', needs=('tokens',), cost=5, default=False, replaces='get_sql_code')
+@accepts_path
+def get_sql_code_tokens(doc):
+    """Return the line number and code of each SQL block, with comments removed and whitespace collapsed
+
+    Args:
+        doc (SasDocument): the file to be parsed (a full file path is also accepted)
+
+    Returns:
+        tuple of form (int, string): returns line number and sql code block pair
+    """
+    return ("sql_code", scan_tokens(doc)['sql_blocks'])
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Define function to find the lines of the LIBNAME statements
+@parse_function('libname', needs=('tokens',), cost=5, default=False, replaces='get_libname_lines')
+@accepts_path
+def get_libname_tokens(doc):
+    """Return the line of every LIBNAME statement (indented or not, but not in comments)
+
+    Args:
+        doc (SasDocument): the file to be parsed (a full file path is also accepted)
+
+    Returns:
+        string: list of the lines having a LIBNAME statement
+    """
+    return ("libname", scan_tokens(doc)['libname_lines'])
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Define function to count the number of PROC EXPORT / RUN blocks in the code
+@parse_function('export_count', needs=('tokens',), cost=5, default=False, replaces='count_exports')
+@accepts_path
+def count_exports_tokens(doc):
+    """Return the number of PROC EXPORT / RUN blocks, ignoring comments and string literals
+
+    Args:
+        doc (SasDocument): the file to be parsed (a full file path is also accepted)
+
+    Returns:
+        integer: count of proc export blocks
+    """
+    return ("export_count", [scan_tokens(doc)['export_count']])
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Define function to count the number of DATA _NULL_ / RUN blocks in the code
+@parse_function('null_ds_count', needs=('tokens',), cost=5, default=False, replaces='count_null_ds')
+@accepts_path
+def count_null_ds_tokens(doc):
+    """Return the number of DATA _NULL_ steps, ignoring comments and string literals
+
+    Args:
+        doc (SasDocument): the file to be parsed (a full file path is also accepted)
+
+    Returns:
+        integer: count of _null_ dataset blocks
+    """
+    return ("null_ds_count", [scan_tokens(doc)['null_ds_count']])
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Define function to find hardcoded dates in the code
+@parse_function('hardcoded_dates', needs=('tokens',), cost=5, default=False, replaces='find_date_lines')
+@accepts_path
+def find_date_tokens(doc):
+    """Find lines whose code (not comments) contains strings that 'look like' hardcoded dates of format yyyy-mm-dd
+
+    Args:
+        doc (SasDocument): the file to be parsed (a full file path is also accepted)
+
+    Returns:
+        tuple of form (int, string): returns line number and date string pair
+    """
+    return ("hardcoded_dates", scan_tokens(doc)['date_lines'])
+#-----------------------------------------------------------------------------
@@ -0,0 +1,280 @@
+"""
+LINEAGE
+file: lineage.py
+purpose: dataset / program lineage across a whole code base, joining the datasets each program creates and uses
+        (sas_blueprint.generate_blueprint) with the files it references (parse_functions.find_file_references)
+        programs and datasets are nodes with adjacency indexes in both directions, so the upstream producers of
+        a dataset or everything impacted by a change to a program are found with a breadth first search
+        the graph is saved as compact JSON (names listed once, edges as pairs of indexes) together with the
+        modification time and size of each program, so a rebuild only re-analyzes the programs that changed
+example use: python lineage.py -i 'code_dir' -t 'sas' -g 'lineage.json' -w 8 --upstream 'WORK.X'
+        where 'code_dir' is the directory tree of SAS programs, 'sas' the file type, 'lineage.json' the graph
+        (read first if it exists, then updated), 8 the number of worker processes, and 'WORK.X' a dataset whose
+        upstream programs and datasets are listed; '--impact code_dir/prog.sas' lists what depends on a program
+"""
+
+import os
+import json
+import argparse
+from collections import deque
+
+from parse_functions import load_document, find_file_references, FileReferenceMatcher
+from sas_blueprint import iter_blueprints
+from crawler import crawl
+
+LINEAGE_FORMAT_VERSION = 1
+
+
+def normalize_dataset(name):
+    """Upper case dataset name, with one-level names in the WORK library (so X and work.x are WORK.X)"""
+    name = name.strip().upper()
+    return name if '.' in name else f"WORK.{name}"
+
+
+#-----------------------------------------------------------------------------
+# The lineage graph
+class LineageGraph:
+    """Programs and datasets with their edges indexed in both directions
+
+    writes: program -> datasets it creates      producers: dataset -> programs creating it
+    reads: program -> datasets it uses          consumers: dataset -> programs using it
+    includes: program -> programs it references included_by: program -> programs referencing it
+    """
+
+    def __init__(self):
+        self.stamps = {}        # program -> (mtime_ns, size) of the file when it was analyzed
+        self.writes = {}
+        self.reads = {}
+        self.includes = {}
+        self.producers = {}
+        self.consumers = {}
+        self.included_by = {}
+
+    @property
+    def programs(self):
+        return self.stamps.keys()
+
+    @property
+    def datasets(self):
+        return self.producers.keys() | self.consumers.keys()
+
+    def update_program(self, program, created=(), used=(), includes=None, stamp=None):
+        """Replace the edges of one program (added if new)
+
+        Args:
+            program (string): path of the program
+            created ([string]): datasets the program creates
+            used ([string]): datasets the program uses
+            includes ([string]): programs it references, None keeps the current ones
+            stamp (tuple): (mtime_ns, size) of the program file
+        """
+        if includes is None:
+            includes = self.includes.get(program, ())
+        self._unlink(program, keep_included_by=True)
+        self.stamps[program] = stamp
+        self.writes[program] = {normalize_dataset(name) for name in created}
+        self.reads[program] = {normalize_dataset(name) for name in used}
+        self.includes[program] = {path for path in includes if path != program}
+        for dataset in self.writes[program]:
+            self.producers.setdefault(dataset, set()).add(program)
+        for dataset in self.reads[program]:
+            self.consumers.setdefault(dataset, set()).add(program)
+        for path in self.includes[program]:
+            self.included_by.setdefault(path, set()).add(program)
+
+    def remove_program(self, program):
+        """Remove a program and its edges"""
+        self._unlink(program)
+        self.stamps.pop(program, None)
+
+    def _unlink(self, program, keep_included_by=False):
+        """Remove the outgoing edges of a program from the reverse indexes"""
+        for forward, reverse in ((self.writes, self.producers), (self.reads, self.consumers),
+                                 (self.includes, self.included_by)):
+            for target in forward.pop(program, ()):
+                sources = reverse.get(target)
+                if sources is not None:
+                    sources.discard(program)
+                    if not sources:
+                        del reverse[target]
+        if not keep_included_by:
+            # references to a deleted program are dropped from the programs referencing it
+            for path in self.included_by.pop(program, ()):
+                self.includes.get(path, set()).discard(program)
+
+    def upstream(self, dataset=None, program=None):
+        """Everything a dataset (or a program) is built from: the programs producing it, the datasets those
+        programs use, their producers and so on, and the programs they reference
+
+        Returns:
+            tuple of form (set, set): the upstream programs and datasets
+        """
+        return self._walk(dataset, program, self.producers, self.reads, self.includes)
+
+    def impact(self, program=None, dataset=None):
+        """Everything impacted by a change to a program (or a dataset): the datasets it creates, the programs
+        using them, the datasets those create and so on, and the programs referencing any of them
+
+        Returns:
+            tuple of form (set, set): the impacted programs and datasets
+        """
+        return self._walk(dataset, program, self.consumers, self.writes, self.included_by)
+
+    def _walk(self, dataset, program, dataset_to_programs, program_to_datasets, program_to_programs):
+        """Breadth first search alternating dataset -> program and program -> dataset edges"""
+        programs, datasets = set(), set()
+        queue = deque()
+        if dataset is not None:
+            queue.append((False, normalize_dataset(dataset)))
+        if program is not None:
+            queue.append((True, program))
+        while queue:
+            is_program, node = queue.popleft()
+            if is_program:
+                for target in program_to_datasets.get(node, ()):
+                    if target not in datasets:
+                        datasets.add(target)
+                        queue.append((False, target))
+                for target in program_to_programs.get(node, ()):
+                    if target not in programs:
+                        programs.add(target)
+                        queue.append((True, target))
+            else:
+                for target in dataset_to_programs.get(node, ()):
+                    if target not in programs:
+                        programs.add(target)
+                        queue.append((True, target))
+        programs.discard(program)
+        if dataset is not None:
+            datasets.discard(normalize_dataset(dataset))
+        return programs, datasets
+
+    def to_dict(self):
+        """Compact form of the graph: every name listed once, edges as [program index, dataset / program index]"""
+        programs = sorted(self.stamps)
+        datasets = sorted(self.datasets)
+        program_index = {name: index for index, name in enumerate(programs)}
+        dataset_index = {name: index for index, name in enumerate(datasets)}
+
+        def edges(forward, index):
+            return [[program_index[program], index[target]] for program in programs
+                    for target in sorted(forward.get(program, ())) if target in index]
+
+        return {
+            'version': LINEAGE_FORMAT_VERSION,
+            'programs': programs,
+            'stamps': [self.stamps[program] for program in programs],
+            'datasets': datasets,
+            'writes': edges(self.writes, dataset_index),
+            'reads': edges(self.reads, dataset_index),
+            'includes': edges(self.includes, program_index),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get('version') != LINEAGE_FORMAT_VERSION:
+            raise ValueError(f"unsupported lineage format version {data.get('version')}")
+        graph = cls()
+        programs, datasets = data['programs'], data['datasets']
+        created, used, includes = ({program: [] for program in programs} for _ in range(3))
+        for program, dataset in data['writes']:
+            created[programs[program]].append(datasets[dataset])
+        for program, dataset in data['reads']:
+            used[programs[program]].append(datasets[dataset])
+        for program, target in data['includes']:
+            includes[programs[program]].append(programs[target])
+        for program, stamp in zip(programs, data['stamps']):
+            graph.update_program(program, created[program], used[program], includes[program],
+                                 tuple(stamp) if stamp is not None else None)
+        return graph
+
+    def save(self, file_name):
+        with open(file_name, 'w') as file:
+            json.dump(self.to_dict(), file, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, file_name):
+        with open(file_name) as file:
+            return cls.from_dict(json.load(file))
+#-----------------------------------------------------------------------------
+
+
+def build_lineage(input_dir, file_type='sas', graph=None, workers=1):
+    """Build the lineage graph of a directory tree, or bring an existing graph up to date
+
+    Only the programs that are new or whose modification time / size changed are lexed again. The file
+    references of every program are looked for again when programs were added or removed, as they are
+    matched against the list of all programs.
+
+    Args:
+        input_dir (string): directory tree of the programs
+        file_type (string): file extension of the programs
+        graph (LineageGraph): graph of an earlier build to update, a new one is built if None
+        workers (int): number of worker processes used to lex the programs
+
+    Returns:
+        LineageGraph: the graph (the one passed in, updated)
+    """
+    graph = graph if graph is not None else LineageGraph()
+    entries = list(crawl(input_dir, file_type))
+    files_to_process = [entry.path for entry in entries]
+    stamps = {entry.path: (entry.stat.st_mtime_ns, entry.stat.st_size) for entry in entries}
+
+    removed = [program for program in graph.programs if program not in stamps]
+    for program in removed:
+        graph.remove_program(program)
+    changed = [file_path for file_path in files_to_process if graph.stamps.get(file_path) != stamps[file_path]]
+    file_set_changed = bool(removed) or any(file_path not in graph.stamps for file_path in changed)
+
+    matcher = FileReferenceMatcher(files_to_process)
+
+    def references(file_path):
+        doc = load_document(file_path)
+        try:
+            return {path for _, path in find_file_references(doc, matcher)[1]}
+        finally:
+            doc.close()
+
+    for record in iter_blueprints(changed, workers):
+        file_path = os.path.join(record['dir_path'], record['f_name'])
+        flow = record['blueprint']['data_flow'] if 'blueprint' in record else {}
+        graph.update_program(file_path, flow.get('datasets_created', ()), flow.get('datasets_used', ()),
+                             references(file_path), stamps[file_path])
+    if file_set_changed:
+        changed_set = set(changed)
+        for file_path in files_to_process:
+            if file_path not in changed_set:
+                graph.update_program(file_path, graph.writes[file_path], graph.reads[file_path],
+                                     references(file_path), stamps[file_path])
+    return graph
+
+
+#================================================================
+# This is the entry point of the script
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build and query the dataset / program lineage of SAS programs.')
+    parser.add_argument('-i', '--input_dir', type=str, required=True, help='Input directory')
+    parser.add_argument('-t', '--file_type', type=str, default='sas', help='File type to be processed (default sas)')
+    parser.add_argument('-g', '--graph', type=str, required=True,
+                        help='Lineage graph JSON file, updated incrementally if it exists')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of worker processes (default 1)')
+    parser.add_argument('--upstream', type=str, action='append', default=[],
+                        help='List the upstream programs and datasets of this dataset')
+    parser.add_argument('--impact', type=str, action='append', default=[],
+                        help='List the programs and datasets impacted by a change to this program')
+    args = parser.parse_args()
+
+    lineage = LineageGraph.load(args.graph) if os.path.exists(args.graph) else None
+    lineage = build_lineage(args.input_dir, args.file_type, lineage, args.workers)
+    lineage.save(args.graph)
+    print(f"{len(lineage.programs)} programs, {len(lineage.datasets)} datasets in {args.graph}")
+
+    for title, queries, query in (("upstream of", args.upstream, lambda name: lineage.upstream(dataset=name)),
+                                  ("impacted by", args.impact, lambda name: lineage.impact(program=name))):
+        for name in queries:
+            programs, datasets = query(name)
+            print(f"\n{title} {name}: {len(programs)} programs, {len(datasets)} datasets")
+            for program in sorted(programs):
+                print(f"  program {program}")
+            for dataset in sorted(datasets):
+                print(f"  dataset {dataset}")
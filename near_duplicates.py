@@ -0,0 +1,361 @@
+"""
+NEAR DUPLICATES
+file: near_duplicates.py
+purpose: find the copy-pasted programs of a code base, so one representative per cluster of near-duplicates is
+        analyzed and translated instead of every copy
+        every program is lexed once (sas-lexer), its significant tokens (no whitespace or comments) are cut into
+        shingles of consecutive tokens and the set of shingles is summarized by a MinHash signature; the
+        signatures are split into bands hashed into LSH buckets, so only the programs sharing a bucket are
+        compared (sub-quadratic in the number of programs), and the pairs whose estimated Jaccard similarity
+        reaches the threshold are joined into clusters (union-find)
+        the representative of a cluster is the program agreeing the most with the others, the report gives the
+        programs, lines and tokens the other members save
+example use: python near_duplicates.py -i 'code_dir' -t 'sas' -o 'near_duplicates.csv' -w 8
+        where 'code_dir' is the directory tree of SAS programs, 'sas' the file type, 'near_duplicates.csv' the
+        output (one row per program: cluster, whether it is the representative, its similarity to it) and 8 the
+        number of worker processes; add '--normalize' to compare identifiers and literals by their kind only,
+        so copies with renamed data sets, variables or constants are found too
+"""
+
+import os
+import csv
+import zlib
+import functools
+import argparse
+import multiprocessing
+from collections import namedtuple
+
+import numpy as np
+import sas_lexer
+from tqdm import tqdm
+
+from crawler import crawl
+
+DEFAULT_SHINGLE = 5         # tokens per shingle
+DEFAULT_PERMUTATIONS = 128  # MinHash signature length
+DEFAULT_BANDS = 16          # LSH bands, of DEFAULT_PERMUTATIONS // DEFAULT_BANDS rows each
+DEFAULT_THRESHOLD = 0.8     # estimated Jaccard similarity of the shingle sets to join two programs
+# With 16 bands of 8 rows, a pair at 0.8 shares a bucket with a probability of 95%, at 0.9 of 99.99%
+
+# Token types whose text is replaced by the type with --normalize
+_NORMALIZED_SUFFIXES = ('_LITERAL',)
+_NORMALIZED_KINDS = {'IDENTIFIER', 'MACRO_STRING'}
+
+# The hash functions of the signature, h(x) = (a * x + b) mod 2^64 >> 32 (multiply-shift, a odd), the same in
+# every process
+_SEED = 20240611
+
+
+@functools.lru_cache(maxsize=None)
+def _hash_parameters(permutations):
+    rng = np.random.default_rng(_SEED)
+    a = rng.integers(1, 2 ** 63, size=permutations, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    b = rng.integers(0, 2 ** 63, size=permutations, dtype=np.uint64)
+    return a, b
+
+
+# The signature of one program, with its size
+ProgramSignature = namedtuple('ProgramSignature', 'lines tokens signature error')
+
+# Clusters of the corpus: per program its cluster number, whether it is the representative and its estimated
+# similarity to the representative
+Clusters = namedtuple('Clusters', 'cluster representative similarity')
+
+SavingsReport = namedtuple('SavingsReport', 'programs clusters duplicates programs_saved lines lines_saved '
+                                            'tokens tokens_saved')
+
+
+#-----------------------------------------------------------------------------
+# Signature of one program
+def token_ids(code, normalize=False):
+    """Lex the code, a 32 bit id (crc32 of the upper cased text) of each significant token
+
+    Returns:
+        array of uint64: the ids, in order
+    """
+    tokens, _, _ = sas_lexer.lex_program_from_str(code)
+    kinds = {}  # token type -> None (skipped), the id of its name (normalized) or False (its text)
+    ids = {}    # text -> id
+    found = []
+    for token in tokens:
+        kind = kinds.get(token.token_type, -1)
+        if kind == -1:
+            name = token.token_type.name
+            if token.channel.name != 'DEFAULT' or name == 'EOF':
+                kind = None
+            elif normalize and (name in _NORMALIZED_KINDS or name.endswith(_NORMALIZED_SUFFIXES)):
+                kind = zlib.crc32(name.encode())
+            else:
+                kind = False
+            kinds[token.token_type] = kind
+        if kind is None:
+            continue
+        if kind is False:
+            text = code[token.start:token.stop].upper()
+            kind = ids.get(text)
+            if kind is None:
+                kind = ids[text] = zlib.crc32(text.encode('utf-8', errors='replace'))
+        found.append(kind)
+    return np.array(found, dtype=np.uint64)
+
+
+def shingle_hashes(ids, shingle=DEFAULT_SHINGLE):
+    """64 bit hashes of the distinct shingles (runs of shingle consecutive ids), a single shingle of all the ids
+    if there are fewer"""
+    if not len(ids):
+        return ids
+    shingle = min(shingle, len(ids))
+    count = len(ids) - shingle + 1
+    hashes = np.zeros(count, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for offset in range(shingle):
+            hashes = hashes * np.uint64(0x100000001B3) + ids[offset:offset + count]
+        # finalizer of splitmix64, so every bit of the hash depends on every id
+        hashes ^= hashes >> np.uint64(30)
+        hashes *= np.uint64(0xBF58476D1CE4E5B9)
+        hashes ^= hashes >> np.uint64(27)
+        hashes *= np.uint64(0x94D049BB133111EB)
+        hashes ^= hashes >> np.uint64(31)
+    return np.unique(hashes)
+
+
+def minhash(hashes, permutations=DEFAULT_PERMUTATIONS, block=4096):
+    """The MinHash signature of a set of shingle hashes (None for an empty set)"""
+    if not len(hashes):
+        return None
+    a, b = _hash_parameters(permutations)
+    signature = np.full(permutations, 0xFFFFFFFF, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for start in range(0, len(hashes), block):  # bounded memory for the largest programs
+            values = (hashes[start:start + block, None] * a + b) >> np.uint64(32)
+            np.minimum(signature, values.min(axis=0), out=signature)
+    return signature.astype(np.uint32)
+
+
+def program_signature(file_path, shingle=DEFAULT_SHINGLE, permutations=DEFAULT_PERMUTATIONS, normalize=False,
+                      encoding='cp1252'):
+    """Lex a program and compute its signature
+
+    Returns:
+        ProgramSignature: lines, significant tokens and signature (None for a program without tokens) of the
+            program, or the error if it couldn't be read
+    """
+    try:
+        with open(file_path, 'r', encoding=encoding) as file:
+            code = file.read()
+        ids = token_ids(code, normalize)
+    except Exception as e:
+        return ProgramSignature(0, 0, None, str(e))
+    return ProgramSignature(code.count('\n') + 1, len(ids),
+                            minhash(shingle_hashes(ids, shingle), permutations), None)
+
+
+def _signature_task(task):
+    file_path, shingle, permutations, normalize = task
+    return program_signature(file_path, shingle, permutations, normalize)
+
+
+def iter_signatures(files_to_process, shingle=DEFAULT_SHINGLE, permutations=DEFAULT_PERMUTATIONS,
+                    normalize=False, workers=1):
+    """Compute the signatures, serially or spread over a pool of worker processes
+
+    Yields:
+        ProgramSignature: the signature of each program, in files_to_process order
+    """
+    tasks = [(file_path, shingle, permutations, normalize) for file_path in files_to_process]
+    if workers <= 1 or len(tasks) <= 1:
+        yield from map(_signature_task, tasks)
+        return
+    chunksize = max(1, min(64, len(tasks) // (workers * 4)))
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap(_signature_task, tasks, chunksize)
+#-----------------------------------------------------------------------------
+
+
+#-----------------------------------------------------------------------------
+# LSH index and clusters
+class UnionFind:
+    """Disjoint sets of the numbers 0 to size - 1"""
+
+    def __init__(self, size):
+        self.parent = list(range(size))
+
+    def find(self, item):
+        parent = self.parent
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]  # path halving
+            item = parent[item]
+        return item
+
+    def union(self, first, second):
+        first, second = self.find(first), self.find(second)
+        if first != second:
+            self.parent[max(first, second)] = min(first, second)  # the root is the first program in crawl order
+
+
+def iter_buckets(signatures, bands=DEFAULT_BANDS):
+    """Yield the LSH buckets holding more than one program, band by band
+
+    Args:
+        signatures (array): one MinHash signature per row
+        bands (int): number of bands, the signature length must be a multiple of it
+
+    Yields:
+        array: the row numbers of the programs of a bucket, in order
+    """
+    count, permutations = signatures.shape
+    if permutations % bands:
+        raise ValueError(f"The signature length ({permutations}) isn't a multiple of the bands ({bands})")
+    rows = permutations // bands
+    for band in range(bands):
+        keys = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows]).view(
+            np.dtype((np.void, rows * signatures.itemsize))).ravel()
+        _, bucket = np.unique(keys, return_inverse=True)
+        order = np.argsort(bucket, kind='stable')
+        starts = np.flatnonzero(np.diff(bucket[order], prepend=-1))
+        for start, end in zip(starts, np.append(starts[1:], count)):
+            if end - start > 1:
+                yield order[start:end]
+
+
+def cluster_signatures(signatures, threshold=DEFAULT_THRESHOLD, bands=DEFAULT_BANDS):
+    """Join the programs whose estimated similarity reaches the threshold, comparing only those sharing an LSH
+    bucket, and choose the representative of each cluster
+
+    Args:
+        signatures (array): one MinHash signature per row
+        threshold (float): estimated Jaccard similarity to join two programs
+        bands (int): number of LSH bands
+
+    Returns:
+        Clusters: per row its cluster (numbered from 0 in the order of their first program), whether it is
+            the representative of its cluster and its estimated similarity to it
+    """
+    count = len(signatures)
+    sets = UnionFind(count)
+    for members in iter_buckets(signatures, bands):
+        # one member per set, the programs already joined needn't be compared again
+        roots = {}
+        for member in members:
+            roots.setdefault(sets.find(member), member)
+        pending = np.array(list(roots.values()))
+        while len(pending) > 1:
+            similar = (signatures[pending[1:]] == signatures[pending[0]]).mean(axis=1) >= threshold
+            for member in pending[1:][similar]:
+                sets.union(pending[0], member)
+            pending = pending[1:][~similar]
+
+    roots = np.array([sets.find(item) for item in range(count)], dtype=np.int64)
+    _, cluster = np.unique(roots, return_inverse=True)  # roots are the first members, so in crawl order
+    cluster = cluster.reshape(count)
+    # the representative is the member agreeing the most with the others of its cluster: per signature position,
+    # the members of the cluster with its value, counted for all the clusters at once
+    agreement = np.zeros(count, dtype=np.int64)
+    for position in range(signatures.shape[1]):
+        keys = (cluster.astype(np.uint64) << np.uint64(32)) | signatures[:, position].astype(np.uint64)
+        _, values, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        agreement += counts[values.reshape(count)]
+    order = np.lexsort((np.arange(count), -agreement, cluster))  # by cluster, the most agreeing first
+    chosen = order[np.flatnonzero(np.diff(cluster[order], prepend=-1))]
+    representative = np.zeros(count, dtype=bool)
+    representative[chosen] = True
+    similarity = (signatures == signatures[chosen[cluster]]).mean(axis=1)
+    return Clusters(cluster, representative, similarity)
+#-----------------------------------------------------------------------------
+
+
+def savings_report(clusters, lines, tokens):
+    """What analyzing and translating only the representatives saves"""
+    lines, tokens = np.asarray(lines, dtype=np.int64), np.asarray(tokens, dtype=np.int64)
+    duplicated = np.bincount(clusters.cluster) > 1  # per cluster, whether it has more than one program
+    saved = ~clusters.representative
+    return SavingsReport(len(clusters.cluster), int(duplicated.sum()), int(duplicated[clusters.cluster].sum()),
+                         int(saved.sum()), int(lines.sum()), int(lines[saved].sum()), int(tokens.sum()),
+                         int(tokens[saved].sum()))
+
+
+def format_report(report):
+    def share(part, whole):
+        return f"{100 * part / whole:.1f}%" if whole else "0.0%"
+    return (f"{report.programs} programs, {report.duplicates} of them in {report.clusters} clusters of "
+            f"near-duplicates\n"
+            f"translating one representative per cluster saves {report.programs_saved} programs "
+            f"({share(report.programs_saved, report.programs)}), {report.lines_saved} lines "
+            f"({share(report.lines_saved, report.lines)}) and {report.tokens_saved} tokens "
+            f"({share(report.tokens_saved, report.tokens)})")
+
+
+NEAR_DUPLICATES_HEADER = ["f_name", "dir_path", "cluster", "cluster_size", "representative", "similarity",
+                          "lines", "tokens", "error"]
+
+
+def find_near_duplicates(input_dir, output_file=None, file_type='sas', threshold=DEFAULT_THRESHOLD,
+                         shingle=DEFAULT_SHINGLE, permutations=DEFAULT_PERMUTATIONS, bands=DEFAULT_BANDS,
+                         normalize=False, workers=1):
+    """Cluster the near-duplicate programs of a directory tree and write one row per program, by cluster
+
+    Programs without a signature (empty or unreadable) are each left in a cluster of their own.
+
+    Returns:
+        SavingsReport: the programs, lines and tokens the clusters save
+    """
+    files_to_process = [entry.path for entry in crawl(input_dir, file_type)]
+    found = list(tqdm(iter_signatures(files_to_process, shingle, permutations, normalize, workers),
+                      total=len(files_to_process), desc="Signing programs", unit="file"))
+    signed = [number for number, program in enumerate(found) if program.signature is not None]
+    signatures = np.array([found[number].signature for number in signed], dtype=np.uint32).reshape(
+        len(signed), permutations)
+    signed_clusters = cluster_signatures(signatures, threshold, bands)
+
+    # the unsigned programs, after the signed ones, in a cluster of their own
+    cluster = np.arange(len(found)) + len(signed)
+    representative = np.ones(len(found), dtype=bool)
+    similarity = np.ones(len(found))
+    cluster[signed] = signed_clusters.cluster
+    representative[signed] = signed_clusters.representative
+    similarity[signed] = signed_clusters.similarity
+    _, cluster = np.unique(cluster, return_inverse=True)
+    clusters = Clusters(cluster, representative, similarity)
+    lines = [program.lines for program in found]
+    tokens = [program.tokens for program in found]
+
+    if output_file:
+        sizes = np.bincount(cluster)
+        with open(output_file, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(NEAR_DUPLICATES_HEADER)
+            # by cluster, the representative first
+            for number in np.lexsort((~representative, cluster)):
+                file_path = files_to_process[number]
+                writer.writerow([os.path.basename(file_path), os.path.dirname(file_path), cluster[number],
+                                 sizes[cluster[number]], bool(representative[number]),
+                                 f"{similarity[number]:.3f}", lines[number], tokens[number],
+                                 found[number].error or ""])
+    return savings_report(clusters, lines, tokens)
+
+
+#================================================================
+# This is the entry point of the script
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Cluster the near-duplicate SAS programs of a directory tree.')
+    parser.add_argument('-i', '--input_dir', type=str, required=True, help='Input directory')
+    parser.add_argument('-t', '--file_type', type=str, default='sas', help='File type to be processed (default sas)')
+    parser.add_argument('-o', '--output', type=str, help='Output csv file, one row per program')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of worker processes (default 1)')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f'Similarity to join two programs (default {DEFAULT_THRESHOLD})')
+    parser.add_argument('--shingle', type=int, default=DEFAULT_SHINGLE,
+                        help=f'Tokens per shingle (default {DEFAULT_SHINGLE})')
+    parser.add_argument('--permutations', type=int, default=DEFAULT_PERMUTATIONS,
+                        help=f'MinHash signature length (default {DEFAULT_PERMUTATIONS})')
+    parser.add_argument('--bands', type=int, default=DEFAULT_BANDS,
+                        help=f'LSH bands, a divisor of the signature length (default {DEFAULT_BANDS})')
+    parser.add_argument('--normalize', action='store_true',
+                        help='Compare identifiers and literals by their kind only')
+    args = parser.parse_args()
+    if args.permutations % args.bands:
+        parser.error(f"--bands ({args.bands}) must divide --permutations ({args.permutations})")
+
+    print(format_report(find_near_duplicates(args.input_dir, args.output, args.file_type, args.threshold,
+                                             args.shingle, args.permutations, args.bands, args.normalize,
+                                             args.workers)))
@@ -1,60 +1,423 @@
 import re
+import io
+import bisect
+import collections
 import datetime
+import functools
+import importlib
+import mmap
 import os
+import time
+
+# Files larger than this (in bytes) are memory-mapped and scanned at the byte level instead of read into memory
+DEFAULT_MMAP_THRESHOLD = 64 * 1024 * 1024
+
+#-----------------------------------------------------------------------------
+# A SAS file read and decoded once, shared by all of the parse functions
+class SasDocument:
+    """In-memory view of a single SAS file. The file is read and decoded (cp1252) once, the
+    line list and line-offset index are built on first use and then reused by every parse function
+
+    Args:
+        file_path (string): full path to the file
+        content (string): decoded content of the file (newlines normalized, as text mode reads it), if None
+            the file is only read when the content is first used
+    """
+
+    mapped = False
+    encoding = 'cp1252'
+
+    def __init__(self, file_path, content=None):
+        self.file_path = file_path
+        self.content = content
+        self.derived = {}  # results shared by the parse functions (see shared), computed once per file
+        self.shared_seconds = 0.0  # time spent computing them
+        self._computing = 0
+
+    def shared(self, name, compute):
+        """Return the shared result name, computed by compute() on first use
+
+        The lines, tokens, block counts etc. (and the results other modules derive from the document) are
+        computed by whichever parse function asks first and reused by the others: the time it takes is added to
+        shared_seconds rather than charged to that function (results computed from others count once).
+        """
+        if name not in self.derived:
+            start = time.perf_counter()
+            self._computing += 1
+            try:
+                self.derived[name] = compute()
+            finally:
+                self._computing -= 1
+            if not self._computing:
+                self.shared_seconds += time.perf_counter() - start
+        return self.derived[name]
+
+    @classmethod
+    def from_file(cls, file_path, encoding='cp1252'):
+        """Read and decode the file once"""
+        with open(file_path, 'r', encoding=encoding) as file:
+            return cls(file_path, file.read())
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = self.shared('content', self._read_content)
+        return self._content
+
+    @content.setter
+    def content(self, value):
+        self._content = value
+
+    def _read_content(self):
+        with open(self.file_path, 'r', encoding=self.encoding) as file:
+            return file.read()
+
+    @property
+    def lines(self):
+        """Lines of the file including line endings, the same list readlines() returns"""
+        return self.shared('lines', lambda: io.StringIO(self.content).readlines())
+
+    @property
+    def stripped_lines(self):
+        """Lines of the file with leading / trailing whitespace removed"""
+        return self.shared('stripped_lines', lambda: [line.strip() for line in self.lines])
+
+    @property
+    def line_count(self):
+        return len(self.lines)
+
+    def iter_lines(self):
+        return iter(self.lines)
+
+    def iter_stripped_lines(self):
+        return iter(self.stripped_lines)
+
+    def close(self):
+        pass
+
+    @property
+    def line_offsets(self):
+        """Offset into content of the first character of each line"""
+        def compute():
+            offsets = []
+            position = 0
+            for line in self.lines:
+                offsets.append(position)
+                position += len(line)
+            return offsets
+        return self.shared('line_offsets', compute)
+
+    def line_number(self, offset):
+        """Return the (1 based) line number holding the character at offset in content"""
+        return bisect.bisect_right(self.line_offsets, offset)
+
+    @property
+    def tokens(self):
+        """sas-lexer tokens of the content (all channels), the file is lexed on first use only"""
+        def compute():
+            from sas_lexer import lex_program_from_str  # optional, only needed by the token based functions
+            return lex_program_from_str(self.content)[0]
+        return self.shared('tokens', compute)
+
+    @property
+    def block_counts(self):
+        """Counts of the proc sql / proc export / _null_ blocks, see count_blocks"""
+        return self.shared('block_counts', lambda: count_blocks(self.content))
+
+
+#-----------------------------------------------------------------------------
+# A very large SAS file, memory-mapped rather than read into memory
+class MappedSasDocument(SasDocument):
+    """Memory-mapped view of a SAS file too large to hold (several times over) in memory. The parse functions
+    with a byte level path (see the 'mapped' checks) scan the mapped buffer and decode only the lines they
+    return, so peak memory stays flat whatever the file size. Anything else (content, lines, tokens) is still
+    available but decodes the whole file on first use.
+
+    cp1252 is a single byte encoding that matches ASCII, so the ASCII patterns searched for match the same
+    bytes as they match characters; lines end at '\\n', '\\r\\n' or '\\r' as they do when read in text mode.
+
+    Args:
+        file_path (string): full path to the file
+    """
+
+    mapped = True
+
+    def __init__(self, file_path):
+        super().__init__(file_path, None)
+        self._file = open(file_path, 'rb')
+        self.buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = self.shared('content', lambda: self.decode(0, len(self.buffer)))
+        return self._content
+
+    @content.setter
+    def content(self, value):
+        self._content = value
+
+    def decode(self, start, end):
+        """Decode buffer[start:end], with line endings normalized to '\\n' as text mode reads them"""
+        return self.buffer[start:end].decode(self.encoding).replace('\r\n', '\n').replace('\r', '\n')
+
+    @property
+    def line_count(self):
+        def compute():
+            size = len(self.buffer)
+            count = LineCounter(self.buffer).advance(size)
+            if size and self.buffer[size - 1] not in b'\r\n':
+                count += 1  # last line without a line ending
+            return count
+        return self.shared('line_count', compute)
+
+    def line_span(self, offset):
+        """Return (start, end, next line start) of the line holding the byte at offset, end excludes the line ending"""
+        start = max(self.buffer.rfind(b'\n', 0, offset), self.buffer.rfind(b'\r', 0, offset)) + 1
+        line_break = _LINE_BREAK_BYTES.search(self.buffer, offset)
+        if line_break is None:
+            return start, len(self.buffer), len(self.buffer)
+        return start, line_break.start(), line_break.end()
+
+    def iter_lines(self):
+        """Yield the decoded lines one at a time"""
+        with open(self.file_path, 'r', encoding=self.encoding) as file:
+            yield from file
+
+    def iter_stripped_lines(self):
+        return (line.strip() for line in self.iter_lines())
+
+    @property
+    def lines(self):
+        return self.shared('lines', lambda: list(self.iter_lines()))
+
+    @property
+    def block_counts(self):
+        return self.shared('block_counts', lambda: count_blocks(self.buffer))
+
+    def close(self):
+        self.buffer.close()
+        self._file.close()
+
+
+_LINE_BREAK_BYTES = re.compile(rb'\r\n|\r|\n')
+
+
+class LineCounter:
+    """Count the line breaks of a buffer up to increasing offsets, reading it in blocks so memory stays flat
+
+    Args:
+        buffer (mmap or bytes): the buffer to count in
+        block_size (int): number of bytes counted at a time
+    """
+
+    def __init__(self, buffer, block_size=16 * 1024 * 1024):
+        self.buffer = buffer
+        self.block_size = block_size
+        self.position = 0
+        self.count = 0
+
+    def advance(self, offset):
+        """Return the number of line breaks ('\\n', '\\r\\n' or '\\r') before offset, offset never decreasing"""
+        buffer = self.buffer
+        for start in range(self.position, offset, self.block_size):
+            end = min(start + self.block_size, offset)
+            block = buffer[start:end]
+            self.count += block.count(b'\n') + block.count(b'\r') - block.count(b'\r\n')
+            if start and block[:1] == b'\n' and buffer[start - 1:start] == b'\r':
+                self.count -= 1  # a '\r\n' split over two blocks is a single line break
+        self.position = max(self.position, offset)
+        return self.count
+
+
+def load_document(file_path, mmap_threshold=DEFAULT_MMAP_THRESHOLD):
+    """Return the document for a file, memory-mapped if it is larger than mmap_threshold bytes"""
+    if mmap_threshold is not None and os.path.getsize(file_path) > mmap_threshold:
+        return MappedSasDocument(file_path)
+    return SasDocument.from_file(file_path)
+#-----------------------------------------------------------------------------
+
+
+# Strings that 'look like' hardcoded dates of format yyyy-mm-dd
+DATE_PATTERN = re.compile(r'\b\d{4}-\d{2}-\d{2}\b')
+
+# Single precompiled scanner for the delimiters of the blocks counted by count_sql, count_exports and count_null_ds
+# (the look-ahead on the first characters lets re skip most positions without trying every alternative)
+_BLOCK_DELIMITERS = re.compile("(?=[pqr_])(?:(proc sql)|(proc export)|(_null_)|(quit;)|(run;))", flags=re.IGNORECASE)
+_BLOCK_DELIMITERS_BYTES = re.compile(_BLOCK_DELIMITERS.pattern.encode(), flags=re.IGNORECASE)
+
+# group of _BLOCK_DELIMITERS: the block kind it opens, or the block kinds it closes
+_BLOCK_OPENED_BY = {1: 'sql', 2: 'export', 3: 'null_ds'}
+_BLOCK_CLOSED_BY = {4: ('sql',), 5: ('export', 'null_ds')}
+
+
+def count_blocks(content):
+    """Count the 'proc sql / quit;', 'proc export / run;' and '_null_ / run;' blocks in a single pass
+
+    Gives the same counts as re.findall("proc sql.*?quit;", ...) (and the export / _null_ equivalents) with
+    IGNORECASE | DOTALL, but in linear time: an unterminated block no longer makes the lazy match rescan to the
+    end of the file from every later opening delimiter.
+
+    Args:
+        content (string or bytes like): the text to be scanned, or the (memory-mapped) bytes of a cp1252 file
+
+    Returns:
+        dict: block kind ('sql', 'export', 'null_ds') to the number of blocks
+    """
+    counts = dict.fromkeys(_BLOCK_OPENED_BY.values(), 0)
+    is_open = dict.fromkeys(_BLOCK_OPENED_BY.values(), False)
+    delimiters = _BLOCK_DELIMITERS if isinstance(content, str) else _BLOCK_DELIMITERS_BYTES
+    for match in delimiters.finditer(content):
+        group = match.lastindex
+        if group in _BLOCK_CLOSED_BY:
+            for kind in _BLOCK_CLOSED_BY[group]:
+                if is_open[kind]:  # the first closing delimiter after the opening one ends the block
+                    counts[kind] += 1
+                    is_open[kind] = False
+        else:  # opening delimiters inside an open block are part of the block
+            is_open[_BLOCK_OPENED_BY[group]] = True
+    return counts
+
+
+def as_document(source):
+    """Return source as a SasDocument, reading the file if source is a file path"""
+    if isinstance(source, SasDocument):
+        return source
+    return load_document(source)
+
+
+def accepts_path(func):
+    """Adapter so a parse function written against a SasDocument can still be called with a file path"""
+    @functools.wraps(func)
+    def wrapper(source, *args):
+        return func(as_document(source), *args)
+    return wrapper
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Registry of the parse functions, in the order they are declared, which is the order their results are written
+PARSE_FUNCTIONS = {}
+
+# What a parse function can need from a file:
+#   'path'   only the file path (the file is not read)
+#   'text'   the decoded content
+#   'lines'  the lines of the content
+#   'tokens' the sas-lexer tokens of the content
+#   'corpus' the list of all files evaluated, passed as a second argument
+PARSE_FUNCTION_NEEDS = ('path', 'text', 'lines', 'tokens', 'corpus')
+
+# Modules declaring more parse functions, imported only when one of their functions is asked for
+# (some need optional packages)
+PARSE_FUNCTION_MODULES = ['lexer_functions', 'sql_structure']
+
+ParseFunctionInfo = collections.namedtuple('ParseFunctionInfo', 'name metric needs version cost default replaces')
+
+
+def parse_function(metric, needs=('text',), version=1, cost=1, default=True, replaces=None):
+    """Declare a parse function and add it to PARSE_FUNCTIONS, under its function name
+
+    Args:
+        metric (string): name of the result it returns (func_descr in the detail file)
+        needs ((string)): what it needs from the file, see PARSE_FUNCTION_NEEDS
+        version (int): bump to invalidate the results cached for it (see result_cache.py)
+        cost (int): rough relative cost per file (1 = a single pass over the content)
+        default (bool): run by default, False if it has to be asked for by name
+        replaces (string): the text based function it stands in for in sas_parser.py -l (--lexer) runs
+    """
+    unknown = set(needs) - set(PARSE_FUNCTION_NEEDS)
+    if unknown:
+        raise ValueError(f"unknown parse function needs: {sorted(unknown)}")
+
+    def register(func):
+        func.parse_info = ParseFunctionInfo(func.__name__, metric, tuple(needs), version, cost, default, replaces)
+        PARSE_FUNCTIONS[func.__name__] = func
+        return func
+    return register
+
+
+def load_parse_functions(optional=True):
+    """Import the modules of PARSE_FUNCTION_MODULES, so their functions are registered too
+
+    Args:
+        optional (bool): skip the modules whose packages are not installed instead of raising ImportError
+    """
+    for module_name in PARSE_FUNCTION_MODULES:
+        try:
+            importlib.import_module(module_name)
+        except ImportError:
+            if not optional:
+                raise
+    return PARSE_FUNCTIONS
+
+
+def needs_of(func):
+    """What a parse function needs (see PARSE_FUNCTION_NEEDS), worked out from its signature if it isn't declared"""
+    info = getattr(func, 'parse_info', None)
+    if info is not None:
+        return info.needs
+    import inspect
+    return ('text', 'corpus') if len(inspect.signature(func).parameters) == 2 else ('text',)
+#-----------------------------------------------------------------------------
 
 #-----------------------------------------------------------------------------
 # This function is designed to extract basic information about the file, such as its creation and modification dates
-def get_file_info(file_path):
-    return 'file_info', [{'create_dt': datetime.datetime.fromtimestamp(os.path.getctime(file_path)).isoformat(),
-                          'modified_dt': datetime.datetime.fromtimestamp(os.path.getmtime(file_path)).isoformat(),}]
+@parse_function('file_info', needs=('path',), default=False)
+@accepts_path
+def get_file_info(doc):
+    stat = os.stat(doc.file_path)  # one stat for both dates
+    return 'file_info', [{'create_dt': datetime.datetime.fromtimestamp(stat.st_ctime).isoformat(),
+                          'modified_dt': datetime.datetime.fromtimestamp(stat.st_mtime).isoformat(),}]
 #-----------------------------------------------------------------------------
 
 #-----------------------------------------------------------------------------
 # Define function to count the number of lines in a file
-def count_lines(file_path):
+@parse_function('line_count', needs=('lines',))
+@accepts_path
+def count_lines(doc):
     """Count the number of lines in a file
 
     Args:
-        file_path (string): full path to the file
+        doc (SasDocument): the file to be parsed (a full file path is also accepted)
 
     Returns:
         integer: the number of lines in the file
     """
-    with open(file_path, 'r', encoding='cp1252') as file:  # Open the file
-        lines = file.readlines()  # Read all lines into a list
-    return ("line_count", [len(lines)])  # Return the number of lines
+    return ("line_count", [doc.line_count])  # Return the number of lines
 #-----------------------------------------------------------------------------
 
 #-----------------------------------------------------------------------------
 # Define function to count the number of 'proc sql / quit;' pairs
-def count_sql(file_path):
+@parse_function('sql_count')
+@accepts_path
+def count_sql(doc):
     """Count the number of SQL statements
 
     Args:
-        file_path (string): full path to the file
+        doc (SasDocument): the file to be parsed (a full file path is also accepted)
 
     Returns:
         integer: count of the number of SQL statements
     """
-    with open(file_path, 'r', encoding='cp1252') as file:  # Open the file
-        content = file.read()  # Read the entire file into a string
-    return ("sql_count", [len(re.findall("proc sql.*?quit;", content, flags=re.IGNORECASE | re.DOTALL))])
+    return ("sql_count", [doc.block_counts['sql']])
 #-----------------------------------------------------------------------------
 
 #-----------------------------------------------------------------------------
 # Define function to find SQL blocks
-def get_sql_code(file_path):
+@parse_function('sql_code', needs=('lines',))
+@accepts_path
+def get_sql_code(doc):
     """This function parses a text file looking for SQL blocks (defined by proc sql / quit; pair) and returns the line number and corresponding SQL code
 
     Args:
-        file_path (string): full file path to be parsed
+        doc (SasDocument): the file to be parsed (a full file path is also accepted)
 
     Returns:
         tuple of form (int, string): returns line number and sql code block pair
     """
+    if doc.mapped:
+        return ("sql_code", _get_sql_code_mapped(doc))
     sql_blocks = []
-    with open(file_path, 'r', encoding='cp1252') as file:
-        lines = [line.strip() for line in file.readlines()]
+    lines = doc.stripped_lines
     # We initialize block and start_line to None as we haven't found a block yet
     block = None
     start_line = None
@@ -72,43 +435,82 @@ def get_sql_code(file_path):
             else:
                 block.append(line)
     return ("sql_code", sql_blocks)
+
+
+_SQL_LINE_BYTES = re.compile(rb'proc sql|quit;', flags=re.IGNORECASE)
+
+
+def _get_sql_code_mapped(doc):
+    # Same as get_sql_code, but only the lines holding 'proc sql' / 'quit;' and the code of the blocks are decoded
+    sql_blocks = []
+    line_counter = LineCounter(doc.buffer)
+    block_start = None  # (line number, offset of the line after the 'proc sql' line)
+    position = 0
+    while True:
+        match = _SQL_LINE_BYTES.search(doc.buffer, position)
+        if match is None:
+            break
+        start, end, next_start = doc.line_span(match.start())
+        line = doc.decode(start, end).lower()
+        if 'proc sql' in line:
+            block_start = (line_counter.advance(start) + 1, next_start)
+        elif block_start is not None and 'quit;' in line:
+            block_lines = doc.decode(block_start[1], start).split('\n')[:-1]
+            sql_blocks.append((block_start[0], ' '.join(block_line.strip() for block_line in block_lines)))
+            block_start = None
+        position = max(next_start, end + 1)
+    return sql_blocks
 #-----------------------------------------------------------------------------
 
 #-----------------------------------------------------------------------------
 # Define function to find lines starting with 'LIBNAME'
-def get_libname_lines(file_path):
+@parse_function('libname', needs=('lines',))
+@accepts_path
+def get_libname_lines(doc):
     """Return any line in the file with a LIBNAME function
 
     Args:
-        file_path (string): full file path to be parsed
+        doc (SasDocument): the file to be parsed (a full file path is also accepted)
 
     Returns:
         string: list of the lines having a LIBNAME function
     """
+    if doc.mapped:
+        return ("libname", _get_libname_lines_mapped(doc))
     libname_lines = []
-    with open(file_path, 'r', encoding='cp1252') as file:  # Open the file
-        lines = file.readlines()  # Read all lines into a list
-    for line in lines:  # For each line
+    for line in doc.lines:  # For each line
         if line.lower().startswith('libname'):  # If it starts with 'libname' (case insensitive)
             libname_lines.append(line)  # Add it to the list
     return ("libname", libname_lines)  # Return the list of matching lines
+
+
+_LIBNAME_LINE_BYTES = re.compile(rb'(?:\A|(?<=[\r\n]))libname', flags=re.IGNORECASE)
+
+
+def _get_libname_lines_mapped(doc):
+    # Same as get_libname_lines, only the matching lines are decoded
+    libname_lines = []
+    for match in _LIBNAME_LINE_BYTES.finditer(doc.buffer):
+        start, _, next_start = doc.line_span(match.start())
+        libname_lines.append(doc.decode(start, next_start))
+    return libname_lines
 #-----------------------------------------------------------------------------
 
 #-----------------------------------------------------------------------------
 # Define function to find lines containing 'password'
-def get_password_lines(file_path):
+@parse_function('password', needs=('lines',), default=False)
+@accepts_path
+def get_password_lines(doc):
     """Return any line in the file with a reference to 'password' (but doesn't have the generic &password)
 
     Args:
-        file_path (string): full file path to be parsed
+        doc (SasDocument): the file to be parsed (a full file path is also accepted)
 
     Returns:
         tuple of form (int, string): returns line number and the password statement
     """
     password_lines = []
-    with open(file_path, 'r', encoding='cp1252') as file:  # Open the file
-        lines = file.readlines()  # Read all lines into a list
-    for i, line in enumerate(lines):
+    for i, line in enumerate(doc.iter_lines()):
         if (line.lower().replace(" ","").find('password=') != -1) and (line.lower().find('"&password"') == -1):  # If it contains 'password' (case insensitive)
             password_lines.append((i + 1, line))  # Add it to the list
     return ("password", password_lines)  # Return the list of matching lines
@@ -118,79 +520,182 @@ def get_password_lines(file_path):
 
 #-----------------------------------------------------------------------------
 # Define function to count the number of 'proc export / run;' pairs
-def count_exports(file_path):
+@parse_function('export_count')
+@accepts_path
+def count_exports(doc):
     """Return the number of 'proc export / run;' pairs
 
     Args:
-        file_path (string): full file path to be parsed
+        doc (SasDocument): the file to be parsed (a full file path is also accepted)
 
     Returns:
         integer: count of proc export blocks
     """
-    with open(file_path, 'r', encoding='cp1252') as file:  # Open the file
-        content = file.read()  # Read the entire file into a string
-    return ("export_count", [len(re.findall("proc export.*?run;", content, flags=re.IGNORECASE | re.DOTALL))])
+    return ("export_count", [doc.block_counts['export']])
 #-----------------------------------------------------------------------------
 
 #-----------------------------------------------------------------------------
 # Define function to count the number of '_null_ / run;' pairs
-def count_null_ds(file_path):
+@parse_function('null_ds_count')
+@accepts_path
+def count_null_ds(doc):
     """Return the number of of _null_ dataset blocks in the given file
 
     Args:
-        file_path (string): full file path to be parsed
+        doc (SasDocument): the file to be parsed (a full file path is also accepted)
 
     Returns:
         integer: count of _null_ dataset blocks
     """
-    with open(file_path, 'r', encoding='cp1252') as file:  # Open the file
-        content = file.read()  # Read the entire file into a string
-    return ("null_ds_count", [len(re.findall("_null_.*?run;", content, flags=re.IGNORECASE | re.DOTALL))])
+    return ("null_ds_count", [doc.block_counts['null_ds']])
 #-----------------------------------------------------------------------------
 
 #-----------------------------------------------------------------------------
 # Define function to find lines with hardcoded dates
-def find_date_lines(file_path):
+@parse_function('hardcoded_dates', needs=('lines',))
+@accepts_path
+def find_date_lines(doc):
     """Find lines containing strings that 'look like' hardcoded dates of format yyyy-mm-dd
 
     Args:
-        file_path (string): full file path to be parsed
+        doc (SasDocument): the file to be parsed (a full file path is also accepted)
 
     Returns:
         tuple of form (int, string): returns line number and date string pair
     """
+    if doc.mapped:
+        return ("hardcoded_dates", _find_date_lines_mapped(doc))
     date_lines = []
-    with open(file_path, 'r', encoding='cp1252') as file:
-        lines = file.readlines()
-    for i, line in enumerate(lines):
+    for i, line in enumerate(doc.lines):
         # Find any date in the format yyyy-mm-dd
-        matches = re.findall(r'\b\d{4}-\d{2}-\d{2}\b', line)
+        matches = DATE_PATTERN.findall(line)
         if matches:
             # If a date is found, add the line number (i+1) and the dates to the list
             date_lines.append((i+1, matches))
     return ("hardcoded_dates", date_lines)
+
+
+# Byte level pre-filter for DATE_PATTERN, the lines it finds are decoded and matched with DATE_PATTERN itself
+_DATE_CANDIDATE_BYTES = re.compile(rb'\d{4}-\d{2}-\d{2}')
+
+
+def _find_date_lines_mapped(doc):
+    # Same as find_date_lines, only the lines holding something that looks like a date are decoded
+    date_lines = []
+    line_counter = LineCounter(doc.buffer)
+    position = 0
+    while True:
+        match = _DATE_CANDIDATE_BYTES.search(doc.buffer, position)
+        if match is None:
+            break
+        start, end, next_start = doc.line_span(match.start())
+        matches = DATE_PATTERN.findall(doc.decode(start, end))
+        if matches:
+            date_lines.append((line_counter.advance(start) + 1, matches))
+        position = max(next_start, end + 1)
+    return date_lines
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Multi-pattern matcher for the file references, built once per run and shared by every file
+class FileReferenceMatcher:
+    """Aho-Corasick automaton over all of the file paths of a run, so each line is scanned once
+    whatever the number of files (rather than once per file)
+
+    Args:
+        file_list ([string]): list of strings representing all of the files to be checked against
+    """
+
+    def __init__(self, file_list):
+        self.patterns = [sub.replace('\\', '/') for sub in file_list]   # fix path issue with windows
+        self._goto = [{}]     # per state, character -> next state
+        self._fail = [0]      # per state, the longest proper suffix that is also a state
+        self._output = [[]]   # per state, indices of the patterns ending at this state
+        self._always = []     # indices of empty patterns, which are in every line
+
+        for index, pattern in enumerate(self.patterns):
+            if not pattern:
+                self._always.append(index)
+                continue
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = next_state
+            self._output[state].append(index)
+
+        # breadth first, so the failure state of every shallower state is already known
+        queue = collections.deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+        # cheap pre-filter: a line can only hold a reference if it holds the tail of one of the paths
+        # (e.g. '.sas'), which is a fast substring test for the lines of code that don't
+        tails = {pattern[-3:] for pattern in self.patterns if pattern}
+        self._tails = tails if not self._always and min(map(len, tails), default=0) == 3 and len(tails) <= 8 else None
+
+    def find(self, line):
+        """Return the sorted indices (into patterns) of every file path contained in line"""
+        if self._tails is not None and not any(tail in line for tail in self._tails):
+            return []
+        goto, fail, output = self._goto, self._fail, self._output
+        found = set(self._always)
+        state = 0
+        for char in line:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found.update(output[state])
+        return sorted(found)
+
+
+_matcher_cache = {}
+
+
+def get_file_reference_matcher(file_list):
+    """Return the FileReferenceMatcher for file_list, building it only the first time the same list is seen"""
+    if isinstance(file_list, FileReferenceMatcher):
+        return file_list
+    cached = _matcher_cache.get('last')
+    if cached is None or cached[0] is not file_list:
+        cached = (file_list, FileReferenceMatcher(file_list))
+        _matcher_cache['last'] = cached
+    return cached[1]
 #-----------------------------------------------------------------------------
 
 #-----------------------------------------------------------------------------
 # Define function to find references to other files
-def find_file_references(file_path, file_list):
+@parse_function('file_ref', needs=('lines', 'corpus'), cost=2)
+@accepts_path
+def find_file_references(doc, file_list):
     """Find lines containing a file reference - from the file_list, which is a list of all files evaluated
 
     Args:
-        file_path (string): full file path to be parsed
+        doc (SasDocument): the file to be parsed (a full file path is also accepted)
         file_list ([string]): list of strings representing all of the files to be checked against
+            (or a FileReferenceMatcher already built from it)
 
     Returns:
         tuple of form (int, string): returns line number and date (yyyy-mm-dd) found in the file_path
     """
     file_references = []
-    file_list = [sub.replace('\\', '/') for sub in file_list]   # fix path issue with windows
-    with open(file_path, 'r', encoding='cp1252') as file:
-        lines = [line.strip() for line in file.readlines()]
-    for i, line in enumerate(lines):
-        for referenced_file in file_list:
+    matcher = get_file_reference_matcher(file_list)
+    for i, line in enumerate(doc.iter_stripped_lines()):
+        for index in matcher.find(line):
             # If the line contains the filename, add it to the list of references
-            if referenced_file in line:
-                file_references.append((i + 1, referenced_file))
+            file_references.append((i + 1, matcher.patterns[index]))
     return ("file_ref", file_references)
 #-----------------------------------------------------------------------------
\ No newline at end of file
@@ -0,0 +1,230 @@
+"""
+PORTFOLIO
+file: portfolio.py
+purpose: score and plan the migration of a whole portfolio of SAS programs from their blueprints (sas_blueprint.py),
+        without lexing anything again
+        the detailed_counts and complexity_flags of every blueprint are read once into a feature frame (one row
+        per program, one numeric column per feature); a weight profile is a vector over those columns, so the
+        scores of all the programs under any number of profiles are one matrix product, and changing the
+        weights re-scores the whole portfolio at once
+        the 'default' profile has the weights and priority thresholds of generate_blueprint and gives back its
+        complexity_score and translation_priority; other profiles (a JSON file) override some of them
+        the programs are ranked by score and cut into migration waves of about the same effort, each with its
+        aggregate effort estimate
+example use: python portfolio.py -i 'blueprints.jsonl' -o 'portfolio.csv' -s 'waves.csv' -n 4
+        where 'blueprints.jsonl' is the output of sas_blueprint.py, 'portfolio.csv' the ranked programs (score,
+        priority, effort, wave), 'waves.csv' the effort of each wave and 4 the number of waves
+        add '-p profiles.json -P name' to score with a profile of the file, e.g.
+        {"macro_heavy": {"weights": {"macro_definitions": 8, "macro_calls": 3}, "thresholds": {"High": 40}}}
+"""
+
+import json
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from sas_blueprint import read_blueprints
+
+# Feature columns of the feature frame, and where each comes from in a blueprint
+FEATURE_SOURCES = {
+    "data_steps": ("detailed_counts", "DATA Steps"),
+    "proc_blocks": ("detailed_counts", "PROC Blocks"),
+    "proc_sql_blocks": ("detailed_counts", "PROC SQL Blocks"),
+    "macro_definitions": ("detailed_counts", "Macro Definitions"),
+    "macro_calls": ("detailed_counts", "Macro Calls"),
+    "has_retain": ("complexity_flags", "has_retain_statement"),
+    "has_lag": ("complexity_flags", "has_lag_function"),
+    "has_merge": ("complexity_flags", "has_merge_statement"),
+    "has_arrays": ("complexity_flags", "has_array_declarations"),
+    "pointer_controls": ("complexity_flags", "pointer_controls_count"),
+    "line_hold_single": ("complexity_flags", "has_line_hold_single"),
+    "line_hold_double": ("complexity_flags", "has_line_hold_double"),
+    "platform_concerns": ("complexity_flags", "platform_concerns"),  # a list, its length
+    "has_proc_import": ("detailed_counts", "PROC Types Found"),      # a list, whether IMPORT is in it
+    "total_lines": ("summary", "total_lines"),
+    "total_tokens": ("summary", "total_tokens"),
+}
+FEATURE_COLUMNS = list(FEATURE_SOURCES)
+
+# The weights and thresholds of generate_blueprint (sas_blueprint.py), effort in hours: base_hours per program,
+# hours_per_point of score and hours_per_kloc (thousand lines), starting points to calibrate on a first wave
+DEFAULT_PROFILE = {
+    "weights": {"data_steps": 1, "proc_blocks": 1, "proc_sql_blocks": 2, "macro_definitions": 5, "macro_calls": 2,
+                "has_retain": 5, "has_lag": 5, "has_merge": 3, "has_arrays": 3, "pointer_controls": 2,
+                "line_hold_single": 8, "line_hold_double": 10, "platform_concerns": 3, "has_proc_import": 10},
+    "thresholds": {"High": 25, "Medium": 15},  # priority if the score is above, 'Low' otherwise
+    "effort": {"base_hours": 1.0, "hours_per_point": 0.5, "hours_per_kloc": 4.0},
+}
+PRIORITIES = ["Low", "Medium", "High"]
+
+PORTFOLIO_COLUMNS = ["rank", "wave", "f_name", "dir_path", "score", "priority", "effort_hours", "total_lines"]
+WAVE_COLUMNS = ["wave", "programs", "total_lines", "score", "effort_hours", "cumulative_hours"] + PRIORITIES
+
+
+#-----------------------------------------------------------------------------
+# Feature frame
+def feature_frame(records):
+    """One row per blueprinted program (the records of read_blueprints), f_name, dir_path and the features
+
+    Records without a blueprint (files that couldn't be read or analyzed) are left out.
+
+    Returns:
+        DataFrame: f_name, dir_path and FEATURE_COLUMNS (integers, the flags 0 or 1)
+    """
+    columns = {column: [] for column in ["f_name", "dir_path"] + FEATURE_COLUMNS}
+    for record in records:
+        blueprint = record.get("blueprint")
+        if blueprint is None:
+            continue
+        columns["f_name"].append(record["f_name"])
+        columns["dir_path"].append(record["dir_path"])
+        for column, (section, key) in FEATURE_SOURCES.items():
+            value = blueprint[section][key]
+            if column == "has_proc_import":
+                value = "IMPORT" in value
+            elif isinstance(value, list):
+                value = len(value)
+            columns[column].append(value)
+    frame = pd.DataFrame(columns)
+    frame[FEATURE_COLUMNS] = frame[FEATURE_COLUMNS].astype(np.int64)
+    return frame
+#-----------------------------------------------------------------------------
+
+
+#-----------------------------------------------------------------------------
+# Weight profiles
+def make_profile(overrides=None):
+    """The default profile with the weights, thresholds and effort settings of overrides replacing its own"""
+    profile = {part: dict(values) for part, values in DEFAULT_PROFILE.items()}
+    for part, values in (overrides or {}).items():
+        if part not in profile:
+            raise ValueError(f"Unknown profile part '{part}', expected one of {', '.join(profile)}")
+        unknown = set(values) - set(FEATURE_COLUMNS if part == "weights" else profile[part])
+        if unknown:
+            raise ValueError(f"Unknown {part} in profile: {', '.join(sorted(unknown))}")
+        profile[part].update(values)
+    return profile
+
+
+def load_profiles(file_path=None):
+    """The 'default' profile and the profiles of a JSON file ({name: overrides of the default profile})"""
+    profiles = {"default": make_profile()}
+    if file_path:
+        with open(file_path, encoding='utf-8') as file:
+            for name, overrides in json.load(file).items():
+                profiles[name] = make_profile(overrides)
+    return profiles
+
+
+def weight_matrix(profiles):
+    """The weights of the profiles, one column per profile, one row per feature (0 when not weighted)"""
+    return pd.DataFrame({name: [profile["weights"].get(column, 0) for column in FEATURE_COLUMNS]
+                         for name, profile in profiles.items()}, index=FEATURE_COLUMNS, dtype=np.float64)
+#-----------------------------------------------------------------------------
+
+
+#-----------------------------------------------------------------------------
+# Scoring
+def score_portfolio(features, profiles):
+    """Score every program under every profile, as one matrix product
+
+    Args:
+        features (DataFrame): the feature frame (see feature_frame)
+        profiles (dict): name -> profile (see make_profile)
+
+    Returns:
+        DataFrame: one score column per profile, aligned with features
+    """
+    weights = weight_matrix(profiles)
+    scores = features[FEATURE_COLUMNS].to_numpy(dtype=np.float64) @ weights.to_numpy()
+    return pd.DataFrame(scores, index=features.index, columns=weights.columns)
+
+
+def priorities(scores, thresholds):
+    """The translation priority of each score: 'High' above thresholds['High'], 'Medium' above
+    thresholds['Medium'], 'Low' otherwise"""
+    scores = np.asarray(scores)
+    labels = np.select([scores > thresholds["High"], scores > thresholds["Medium"]], ["High", "Medium"], "Low")
+    return pd.Categorical(labels, categories=PRIORITIES, ordered=True)
+
+
+def effort_hours(scores, total_lines, effort):
+    """Estimated hours to migrate each program, from its score and size"""
+    return (effort["base_hours"] + effort["hours_per_point"] * np.asarray(scores, dtype=np.float64)
+            + effort["hours_per_kloc"] * np.asarray(total_lines, dtype=np.float64) / 1000)
+#-----------------------------------------------------------------------------
+
+
+#-----------------------------------------------------------------------------
+# Migration waves
+def plan_waves(features, profile, waves=4, wave_hours=None, hardest_first=False):
+    """Rank the programs by score and cut the ranking into waves of about the same effort
+
+    Args:
+        features (DataFrame): the feature frame (see feature_frame)
+        profile (dict): the weight profile (see make_profile)
+        waves (int): number of waves, used when wave_hours isn't given
+        wave_hours (float): effort of a wave in hours, the number of waves then follows from it
+        hardest_first (bool): rank the highest scores first instead of the straightforward programs
+
+    Returns:
+        DataFrame: PORTFOLIO_COLUMNS, in rank order; a program goes into the wave its effort starts in
+    """
+    plan = features[["f_name", "dir_path", "total_lines"]].copy()
+    plan["score"] = score_portfolio(features, {"profile": profile})["profile"].to_numpy()
+    plan["priority"] = priorities(plan["score"], profile["thresholds"])
+    plan["effort_hours"] = effort_hours(plan["score"], plan["total_lines"], profile["effort"])
+    # stable sort, programs of the same score stay in the blueprint (crawl) order
+    plan = plan.sort_values("score", ascending=not hardest_first, kind="stable").reset_index(drop=True)
+    plan["rank"] = np.arange(1, len(plan) + 1)
+    started = plan["effort_hours"].cumsum().to_numpy() - plan["effort_hours"].to_numpy()
+    if wave_hours is None:
+        wave_hours = plan["effort_hours"].sum() / max(1, waves)
+    plan["wave"] = (started // wave_hours).astype(np.int64) + 1 if wave_hours > 0 else 1
+    return plan[PORTFOLIO_COLUMNS]
+
+
+def wave_summary(plan):
+    """Programs, lines, score and effort of each wave, with the running effort and the programs per priority"""
+    summary = plan.groupby("wave").agg(programs=("f_name", "size"), total_lines=("total_lines", "sum"),
+                                       score=("score", "sum"), effort_hours=("effort_hours", "sum"))
+    summary["cumulative_hours"] = summary["effort_hours"].cumsum()
+    by_priority = pd.crosstab(plan["wave"], plan["priority"]).reindex(columns=PRIORITIES, fill_value=0)
+    return summary.join(by_priority).reset_index()[WAVE_COLUMNS]
+#-----------------------------------------------------------------------------
+
+
+#================================================================
+# This is the entry point of the script
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Score SAS programs and plan their migration from their blueprints.')
+    parser.add_argument('-i', '--input', type=str, required=True, help='Blueprints JSON Lines file (sas_blueprint.py)')
+    parser.add_argument('-o', '--output', type=str, help='Output csv file, the ranked programs')
+    parser.add_argument('-s', '--waves_output', type=str, help='Output csv file, the effort of each wave')
+    parser.add_argument('-p', '--profiles', type=str, help='JSON file of weight profiles')
+    parser.add_argument('-P', '--profile', type=str, default='default', help='Profile to score with (default default)')
+    parser.add_argument('-n', '--waves', type=int, default=4, help='Number of migration waves (default 4)')
+    parser.add_argument('--wave_hours', type=float, help='Effort of a wave in hours, instead of a number of waves')
+    parser.add_argument('--hardest_first', action='store_true', help='Rank the highest scores first')
+    args = parser.parse_args()
+
+    weight_profiles = load_profiles(args.profiles)
+    if args.profile not in weight_profiles:
+        parser.error(f"unknown profile '{args.profile}', the profiles are {', '.join(weight_profiles)}")
+    portfolio = feature_frame(read_blueprints(args.input))
+    migration_plan = plan_waves(portfolio, weight_profiles[args.profile], args.waves, args.wave_hours,
+                                args.hardest_first)
+    waves_frame = wave_summary(migration_plan)
+    if args.output:
+        migration_plan.to_csv(args.output, index=False)
+    if args.waves_output:
+        waves_frame.to_csv(args.waves_output, index=False)
+
+    all_scores = score_portfolio(portfolio, weight_profiles)
+    print(f"{len(portfolio)} programs, priorities per profile:")
+    print(pd.DataFrame({name: pd.Series(priorities(all_scores[name], profile["thresholds"])).value_counts()
+                        for name, profile in weight_profiles.items()}).reindex(PRIORITIES).fillna(0).astype(int)
+          .to_string())
+    print(f"\nMigration waves ({args.profile} profile):")
+    print(waves_frame.to_string(index=False, float_format=lambda value: f"{value:.1f}"))
@@ -0,0 +1,154 @@
+"""
+RESULT CACHE
+file: result_cache.py
+purpose: persistent cache of parse function results, so a re-run of sas_parser.py only parses the files
+        (and runs the functions) whose inputs changed since the last run
+        a file is unchanged when its mtime and size match the cached values or, failing that, its content hash does
+        (a new file isn't hashed, so a cold run reads every file once; its hash is taken the first time its mtime
+        or size change, when its results are recomputed, and from then on a file touched but not edited keeps them)
+        a cached result is valid when it was produced by the same version of the parse function (a hash of the
+        module the function is defined in and of parse_functions.py, whose SasDocument and helpers every parse
+        function relies on, so any edit to either invalidates it) and, for the functions that are given the list
+        of all files, from the same list of files
+"""
+
+import os
+import ast
+import sqlite3
+import hashlib
+import inspect
+import functools
+
+import parse_functions
+
+CACHE_FILE_NAME = "parse_cache.sqlite"
+
+
+@functools.lru_cache(maxsize=None)
+def source_hash(source_file):
+    """Return the sha1 of a source file, read once per run"""
+    with open(source_file, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+def function_version(func):
+    """Return a version string for a parse function, which changes whenever the module defining it or
+    parse_functions.py (SasDocument and the helpers every parse function relies on) changes, or the version
+    declared with parse_functions.parse_function is bumped"""
+    module_hash = source_hash(inspect.getsourcefile(inspect.unwrap(func)))
+    shared_hash = source_hash(inspect.getsourcefile(parse_functions))
+    info = getattr(func, 'parse_info', None)
+    declared = f":{info.version}" if info is not None else ""
+    return hashlib.sha1(f"{shared_hash}:{module_hash}:{func.__qualname__}{declared}".encode()).hexdigest()[:16]
+
+
+def file_hash(file_path):
+    """Return the sha1 of the content of a file, read in blocks"""
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+#-----------------------------------------------------------------------------
+# SQLite backed cache of the detail rows of each (file, parse function)
+class ResultCache:
+    """Cache of parse results stored in a SQLite file in the output directory
+
+    Args:
+        db_path (string): full path of the SQLite cache file
+        dispatch ([(function, bool)]): parse functions of the run, as returned by sas_parser.resolve_dispatch
+        corpus ([string]): all of the files evaluated in the run
+        full (bool): discard everything cached and rebuild
+    """
+
+    def __init__(self, db_path, dispatch, corpus, full=False):
+        self.connection = sqlite3.connect(db_path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, sha1 TEXT);
+            CREATE TABLE IF NOT EXISTS results (
+                path TEXT, func_name TEXT, func_version TEXT, input_key TEXT,
+                result_name TEXT, result_value TEXT,
+                PRIMARY KEY (path, func_name));
+        """)
+        if full:
+            self.connection.executescript("DELETE FROM results; DELETE FROM files;")
+        self.connection.commit()
+
+        corpus_key = hashlib.sha1("\n".join(corpus).encode('utf-8', 'surrogateescape')).hexdigest()
+        # what a cached row must match to be reused, per position in dispatch
+        self.expected = [(func.__qualname__, function_version(func), corpus_key if needs_file_list else '')
+                         for func, needs_file_list in dispatch]
+
+    def missing_functions(self, file_path, stat=None):
+        """Return the positions (in dispatch) of the functions that have to be run on the file
+
+        A changed file drops all of its cached results. stat is the os.stat of the file if already known.
+        """
+        if stat is None:
+            stat = os.stat(file_path)
+        row = self.connection.execute("SELECT mtime_ns, size, sha1 FROM files WHERE path = ?",
+                                      (file_path,)).fetchone()
+        if row is None:
+            # a new file is parsed in full anyway, it isn't read a second time just to hash it: its content hash
+            # is only taken the first time its mtime or size changes
+            self.connection.execute("DELETE FROM results WHERE path = ?", (file_path,))
+            self.connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, NULL)",
+                                    (file_path, stat.st_mtime_ns, stat.st_size))
+        elif (row[0], row[1]) != (stat.st_mtime_ns, stat.st_size):
+            digest = file_hash(file_path)
+            if row[2] != digest:
+                self.connection.execute("DELETE FROM results WHERE path = ?", (file_path,))
+            self.connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                                    (file_path, stat.st_mtime_ns, stat.st_size, digest))
+
+        cached = {func_name: (func_version, input_key) for func_name, func_version, input_key in
+                  self.connection.execute("SELECT func_name, func_version, input_key FROM results WHERE path = ?",
+                                          (file_path,))}
+        return [index for index, (func_name, func_version, input_key) in enumerate(self.expected)
+                if cached.get(func_name) != (func_version, input_key)]
+
+    def merge_rows(self, file_path, missing, fresh_rows):
+        """Store the freshly computed rows of a file and return all of its rows in dispatch order
+
+        Args:
+            file_path (string): full path to the file
+            missing ([int]): positions of the functions that were run, as returned by missing_functions
+            fresh_rows (list): the rows produced by those functions, in the same order
+
+        Returns:
+            list: one [f_name, dir_path, func_descr, func_value] row per parse function
+        """
+        rows = [None] * len(self.expected)
+        for index, row in zip(missing, fresh_rows):
+            rows[index] = row
+            func_name, func_version, input_key = self.expected[index]
+            self.connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                                    (file_path, func_name, func_version, input_key, row[2], repr(row[3])))
+
+        if len(missing) < len(self.expected):
+            cached = {func_name: (result_name, result_value) for func_name, result_name, result_value in
+                      self.connection.execute("SELECT func_name, result_name, result_value FROM results "
+                                              "WHERE path = ?", (file_path,))}
+            f_name, dir_path = os.path.basename(file_path), os.path.dirname(file_path)
+            for index, (func_name, _, _) in enumerate(self.expected):
+                if rows[index] is None:
+                    result_name, result_value = cached[func_name]
+                    rows[index] = [f_name, dir_path, result_name, ast.literal_eval(result_value)]
+        return rows
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+#-----------------------------------------------------------------------------
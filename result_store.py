@@ -0,0 +1,266 @@
+"""
+RESULT STORE
+file: result_store.py
+purpose: SQLite store of the results of sas_parser.py runs (sas_parser.py --store), so several runs (e.g. nightly)
+        live in one database and can be queried and compared with index lookups instead of scanning csv files
+        the three tables of the sas_parser.py todo, plus the runs:
+            runs        one row per run (run_id is the yymmddhhmmss of its output files)
+            files       the header: one row per file evaluated by a run (name, directory, dates, size)
+            metrics     the cross table: one row per (file, metric) with its numeric value, if it has a single
+                        one, and the number of values
+            metric_values  the detail: every value of a metric (line number, numeric or text value, see
+                        result_writers.iter_findings), so a metric can hold any number of values
+example use: python result_store.py -d 'results/results.sqlite' --metric sql_count --min 5 --changed
+        lists the files of the latest run with more than 5 PROC SQL blocks that changed since the run before;
+        '--runs' lists the runs and '--compare 20230527120000 20230528120000 --metric sql_count' the files whose
+        sql_count differs between two runs
+"""
+
+import os
+import sqlite3
+import argparse
+import datetime
+from itertools import groupby
+
+from result_writers import iter_findings, read_detail_rows
+
+STORE_FILE_NAME = "results.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    started_at TEXT,
+    input_dir TEXT,
+    file_type TEXT,
+    functions TEXT);
+CREATE TABLE IF NOT EXISTS files (
+    file_id INTEGER PRIMARY KEY,
+    run_id TEXT NOT NULL REFERENCES runs(run_id),
+    f_name TEXT NOT NULL,
+    dir_path TEXT NOT NULL,
+    create_dt TEXT,
+    modified_dt TEXT,
+    size INTEGER,
+    UNIQUE (run_id, dir_path, f_name));
+CREATE INDEX IF NOT EXISTS files_path ON files (dir_path, f_name, run_id);
+CREATE TABLE IF NOT EXISTS metrics (
+    metric_id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL REFERENCES files(file_id),
+    run_id TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    num_value REAL,
+    value_count INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS metrics_run_metric ON metrics (run_id, metric, num_value);
+CREATE INDEX IF NOT EXISTS metrics_file ON metrics (file_id, metric);
+CREATE TABLE IF NOT EXISTS metric_values (
+    metric_id INTEGER NOT NULL REFERENCES metrics(metric_id),
+    line_no INTEGER,
+    num_value REAL,
+    text_value TEXT);
+CREATE INDEX IF NOT EXISTS metric_values_metric ON metric_values (metric_id);
+"""
+
+COMPARISONS = {'>': '>', '>=': '>=', '<': '<', '<=': '<=', '=': '=', '!=': '!='}
+
+
+#-----------------------------------------------------------------------------
+# The result store
+class ResultStore:
+    """Results of any number of runs in one SQLite database
+
+    Files are added in transactions of commit_every files, each with bulk inserts of its metrics and values.
+
+    Args:
+        db_path (string): full path of the SQLite database, created if it doesn't exist
+        commit_every (int): files added per transaction
+    """
+
+    def __init__(self, db_path, commit_every=500):
+        self.db = sqlite3.connect(db_path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self.commit_every = commit_every
+        self._files_since_commit = 0
+
+    def start_run(self, run_id, input_dir=None, file_type=None, functions=()):
+        """Register a run, a resumed run keeps its files already stored"""
+        self.db.execute("INSERT OR IGNORE INTO runs VALUES (?, ?, ?, ?, ?)",
+                        (run_id, datetime.datetime.now().isoformat(), input_dir, file_type, ",".join(functions)))
+        self.db.commit()
+
+    def stored_files(self, run_id):
+        """(f_name, dir_path) of the files already stored for a run"""
+        return set(self.db.execute("SELECT f_name, dir_path FROM files WHERE run_id = ?", (run_id,)))
+
+    def add_file(self, run_id, summary_row, rows, size=None):
+        """Store the results of one file, replacing any stored for it in the same run
+
+        Args:
+            run_id (string): the run
+            summary_row (list): [f_name, dir_path, create_dt, modified_dt] as in the summary file
+            rows ([list]): its [f_name, dir_path, func_descr, func_value] detail rows
+            size (int): size of the file in bytes
+        """
+        f_name, dir_path, create_dt, modified_dt = summary_row
+        self._delete_file(run_id, f_name, dir_path)
+        file_id = self.db.execute("INSERT INTO files (run_id, f_name, dir_path, create_dt, modified_dt, size) "
+                                  "VALUES (?, ?, ?, ?, ?, ?)",
+                                  (run_id, f_name, dir_path, create_dt, modified_dt, size)).lastrowid
+        values = []
+        for row in rows:
+            findings = list(iter_findings([row]))
+            single = findings[0][4] if len(findings) == 1 else None
+            metric_id = self.db.execute("INSERT INTO metrics (file_id, run_id, metric, num_value, value_count) "
+                                        "VALUES (?, ?, ?, ?, ?)",
+                                        (file_id, run_id, row[2], single, len(findings))).lastrowid
+            values.extend((metric_id, line_no, num_value, text_value)
+                          for _, _, _, line_no, num_value, text_value in findings)
+        self.db.executemany("INSERT INTO metric_values VALUES (?, ?, ?, ?)", values)
+        self._files_since_commit += 1
+        if self._files_since_commit >= self.commit_every:
+            self.commit()
+
+    def _delete_file(self, run_id, f_name, dir_path):
+        for (file_id,) in self.db.execute("SELECT file_id FROM files WHERE run_id = ? AND dir_path = ? AND f_name = ?",
+                                          (run_id, dir_path, f_name)).fetchall():
+            self.db.execute("DELETE FROM metric_values WHERE metric_id IN "
+                            "(SELECT metric_id FROM metrics WHERE file_id = ?)", (file_id,))
+            self.db.execute("DELETE FROM metrics WHERE file_id = ?", (file_id,))
+            self.db.execute("DELETE FROM files WHERE file_id = ?", (file_id,))
+
+    def add_detail_file(self, run_id, detail_file_name, summary_rows, only=None):
+        """Store the results of the files of a detail csv file (e.g. those done before a run was resumed)
+
+        Args:
+            run_id (string): the run
+            detail_file_name (string): full path of the detail csv file
+            summary_rows ([list]): the summary rows of the run
+            only (set): (f_name, dir_path) of the files to store, all of them if None
+        """
+        summaries = {(row[0], row[1]): row for row in summary_rows}
+        for key, rows in groupby(read_detail_rows(detail_file_name), key=lambda row: (row[0], row[1])):
+            if key in summaries and (only is None or key in only):
+                file_path = os.path.join(key[1], key[0])
+                self.add_file(run_id, summaries[key], list(rows),
+                              os.path.getsize(file_path) if os.path.exists(file_path) else None)
+
+    def commit(self):
+        self.db.commit()
+        self._files_since_commit = 0
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    #-------------------------------------------------------------------------
+    # Queries
+    def runs(self):
+        """[(run_id, started_at, input_dir, number of files)], oldest first"""
+        return self.db.execute("SELECT r.run_id, r.started_at, r.input_dir, "
+                               "(SELECT COUNT(*) FROM files f WHERE f.run_id = r.run_id) "
+                               "FROM runs r ORDER BY r.run_id").fetchall()
+
+    def latest_run(self):
+        row = self.db.execute("SELECT MAX(run_id) FROM runs").fetchone()
+        return row[0] if row else None
+
+    def previous_run(self, run_id):
+        row = self.db.execute("SELECT MAX(run_id) FROM runs WHERE run_id < ?", (run_id,)).fetchone()
+        return row[0] if row else None
+
+    def files_where(self, run_id, metric, op='>', value=0, changed_only=False, previous_run_id=None):
+        """Files of a run whose metric compares to value, optionally only those new or changed (different
+        modified date or size) since the previous run
+
+        Returns:
+            [(f_name, dir_path, num_value)]
+        """
+        if op not in COMPARISONS:
+            raise ValueError(f"unknown comparison {op}")
+        query = ("SELECT f.f_name, f.dir_path, m.num_value FROM metrics m JOIN files f ON f.file_id = m.file_id "
+                 f"WHERE m.run_id = ? AND m.metric = ? AND m.num_value {COMPARISONS[op]} ?")
+        params = [run_id, metric, value]
+        if changed_only:
+            query += (" AND NOT EXISTS (SELECT 1 FROM files p WHERE p.run_id = ? AND p.dir_path = f.dir_path "
+                      "AND p.f_name = f.f_name AND p.modified_dt IS f.modified_dt AND p.size IS f.size)")
+            params.append(previous_run_id if previous_run_id is not None else self.previous_run(run_id))
+        return self.db.execute(query + " ORDER BY f.dir_path, f.f_name", params).fetchall()
+
+    def changed_files(self, run_id, previous_run_id=None):
+        """Files of a run that are new or changed since the previous run: [(f_name, dir_path, status)]"""
+        if previous_run_id is None:
+            previous_run_id = self.previous_run(run_id)
+        return self.db.execute(
+            "SELECT f.f_name, f.dir_path, CASE WHEN p.file_id IS NULL THEN 'new' ELSE 'changed' END "
+            "FROM files f LEFT JOIN files p ON p.run_id = ? AND p.dir_path = f.dir_path AND p.f_name = f.f_name "
+            "WHERE f.run_id = ? AND (p.file_id IS NULL OR p.modified_dt IS NOT f.modified_dt OR p.size IS NOT f.size) "
+            "ORDER BY f.dir_path, f.f_name", (previous_run_id, run_id)).fetchall()
+
+    def compare_runs(self, run_a, run_b, metric):
+        """Files whose metric differs between two runs (or that are only in one of them)
+
+        Returns:
+            [(f_name, dir_path, value in run_a, value in run_b)]
+        """
+        return self.db.execute(
+            "WITH a AS (SELECT f.f_name, f.dir_path, m.num_value, m.value_count FROM files f "
+            "           JOIN metrics m ON m.file_id = f.file_id WHERE m.run_id = ? AND m.metric = ?), "
+            "     b AS (SELECT f.f_name, f.dir_path, m.num_value, m.value_count FROM files f "
+            "           JOIN metrics m ON m.file_id = f.file_id WHERE m.run_id = ? AND m.metric = ?) "
+            "SELECT a.f_name, a.dir_path, COALESCE(a.num_value, a.value_count), "
+            "       COALESCE(b.num_value, b.value_count) "
+            "FROM a LEFT JOIN b ON b.dir_path = a.dir_path AND b.f_name = a.f_name "
+            "WHERE b.f_name IS NULL OR COALESCE(a.num_value, a.value_count) != COALESCE(b.num_value, b.value_count) "
+            "UNION ALL "
+            "SELECT b.f_name, b.dir_path, NULL, COALESCE(b.num_value, b.value_count) "
+            "FROM b LEFT JOIN a ON a.dir_path = b.dir_path AND a.f_name = b.f_name WHERE a.f_name IS NULL "
+            "ORDER BY 2, 1", (run_a, metric, run_b, metric)).fetchall()
+
+    def metric_values(self, run_id, f_name, dir_path, metric):
+        """Every value of a metric of a file: [(line_no, num_value, text_value)]"""
+        return self.db.execute(
+            "SELECT v.line_no, v.num_value, v.text_value FROM files f "
+            "JOIN metrics m ON m.file_id = f.file_id AND m.metric = ? "
+            "JOIN metric_values v ON v.metric_id = m.metric_id "
+            "WHERE f.run_id = ? AND f.dir_path = ? AND f.f_name = ? ORDER BY v.rowid",
+            (metric, run_id, dir_path, f_name)).fetchall()
+#-----------------------------------------------------------------------------
+
+
+#================================================================
+# This is the entry point of the script
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Query the results stored by sas_parser.py --store.')
+    parser.add_argument('-d', '--db', type=str, required=True, help=f'Result store ({STORE_FILE_NAME} in the output directory)')
+    parser.add_argument('--runs', action='store_true', help='List the runs')
+    parser.add_argument('--run', type=str, help='Run to query (default the latest)')
+    parser.add_argument('--metric', type=str, help='Metric to filter or compare on, e.g. sql_count')
+    parser.add_argument('--min', type=float, default=0, help='List the files whose metric is above this value')
+    parser.add_argument('--changed', action='store_true', help='Only the files new or changed since the run before')
+    parser.add_argument('--compare', type=str, nargs=2, metavar=('RUN_A', 'RUN_B'),
+                        help='List the files whose metric differs between two runs')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        parser.error(f"{args.db} not found")
+    with ResultStore(args.db) as store:
+        run_id = args.run or store.latest_run()
+        if args.runs:
+            for run in store.runs():
+                print(*run, sep='\t')
+        if args.compare and args.metric:
+            for row in store.compare_runs(*args.compare, args.metric):
+                print(*row, sep='\t')
+        elif args.metric:
+            for row in store.files_where(run_id, args.metric, '>', args.min, args.changed):
+                print(*row, sep='\t')
+        elif args.changed:
+            for row in store.changed_files(run_id):
+                print(*row, sep='\t')
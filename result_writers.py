@@ -0,0 +1,292 @@
+"""
+RESULT WRITERS
+file: result_writers.py
+purpose: writers for the output files of sas_parser.py
+        the detail file is written incrementally as each file finishes, so memory stays bounded by a single
+        file's results and a crashed run can be resumed from the last completely written file
+        the file_refs file holds the cross-file reference graph built from the find_file_references results
+        the findings file (optional, Parquet or Arrow IPC, needs pyarrow) holds the detail results normalized
+        into typed columns, one row per finding, so they load with a vectorized read
+"""
+
+import os
+import ast
+import csv
+import locale
+
+DETAIL_HEADER = ["f_name", "dir_path", "func_descr", "func_value"]
+REFERENCE_HEADER = ["f_name", "dir_path", "referenced_file", "ref_count", "first_line"]
+FINDINGS_COLUMNS = ["f_name", "dir_path", "metric", "line_no", "num_value", "text_value"]
+COLUMNAR_FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+
+
+#-----------------------------------------------------------------------------
+# Streaming writer for the detail_yymmddhhmmss.csv file
+class DetailWriter:
+    """Append the detail rows of each parsed file to the detail csv as soon as the file is finished
+
+    Args:
+        file_name (string): full path of the detail csv file
+        rows_per_file (int): number of rows every file produces (one per parse function)
+        flush_every (int): flush the file to disk after this many files
+        resume (bool): keep the completely written files of an existing detail file and append after them
+    """
+
+    def __init__(self, file_name, rows_per_file, flush_every=100, resume=False):
+        self.file_name = file_name
+        self.rows_per_file = rows_per_file
+        self.flush_every = flush_every
+        self.completed = set()  # (f_name, dir_path) of the files already in the detail file
+        self._files_since_flush = 0
+
+        if resume and os.path.exists(file_name):
+            good_offset, self.completed = scan_detail_file(file_name, rows_per_file)
+            if good_offset:
+                # drop whatever was half written by the interrupted run and carry on after the last good file
+                with open(file_name, 'r+b') as file:
+                    file.truncate(good_offset)
+                self._file = open(file_name, 'a', newline='')
+                self._writer = csv.writer(self._file)
+                return
+            self.completed = set()
+
+        self._file = open(file_name, 'w', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(DETAIL_HEADER)
+
+    def is_completed(self, file_path):
+        """Return True if the results for file_path were already written by the run being resumed"""
+        return (os.path.basename(file_path), os.path.dirname(file_path)) in self.completed
+
+    def write_file_rows(self, rows):
+        """Write all of the rows of one parsed file"""
+        self._writer.writerows(rows)
+        self._files_since_flush += 1
+        if self._files_since_flush >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._files_since_flush = 0
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def scan_detail_file(file_name, rows_per_file):
+    """Find the files completely written to an existing detail file
+
+    Rows are written file by file, so the rows of a file are consecutive and only the last group can
+    be incomplete (or a partially written line) after a crash.
+
+    Args:
+        file_name (string): full path of the detail csv file
+        rows_per_file (int): number of rows every file produces
+
+    Returns:
+        tuple of form (int, set): byte offset just after the last complete file (0 if there is no valid
+            header) and the set of (f_name, dir_path) of the complete files
+    """
+    encoding = locale.getpreferredencoding(False)  # what open() used to write the file
+    completed = set()
+    good_offset = 0
+    offset = 0
+    group_key = None
+    group_count = 0
+    with open(file_name, 'rb') as file:
+        for raw_line in file:
+            if not raw_line.endswith(b'\n'):
+                break  # partially written last line
+            row = next(csv.reader([raw_line.decode(encoding)]), [])
+            if offset == 0:
+                if row != DETAIL_HEADER:
+                    return 0, completed
+                offset = good_offset = len(raw_line)
+                continue
+            key = tuple(row[:2])
+            if key != group_key:
+                if group_key is not None:
+                    if group_count != rows_per_file:
+                        group_key = None  # an incomplete file followed by more rows, keep nothing after it
+                        break
+                    completed.add(group_key)
+                    good_offset = offset
+                group_key, group_count = key, 0
+            group_count += 1
+            offset += len(raw_line)
+    if group_key is not None and group_count == rows_per_file:
+        completed.add(group_key)
+        good_offset = offset
+    return good_offset, completed
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Writer for the cross-file reference graph, file_refs_yymmddhhmmss.csv
+class ReferenceGraphWriter:
+    """Write the edges of the cross-file reference graph found by find_file_references, one row per
+    (referencing file, referenced file) pair with the number of references and the first line referencing it
+
+    Args:
+        file_name (string): full path of the reference graph csv file
+        completed (set): when resuming, the (f_name, dir_path) of the files already written, whose edges are kept
+    """
+
+    def __init__(self, file_name, completed=None):
+        kept = []
+        if completed and os.path.exists(file_name):
+            with open(file_name, 'r', newline='') as file:
+                kept = [row for row in csv.reader(file) if tuple(row[:2]) in completed]
+        self._file = open(file_name, 'w', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(REFERENCE_HEADER)
+        self._writer.writerows(kept)
+
+    def write_file_rows(self, rows):
+        """Write the edges of one parsed file, given all of its detail rows"""
+        for f_name, dir_path, func_descr, func_value in rows:
+            if func_descr != "file_ref":
+                continue
+            edges = {}  # referenced file -> [count, first line], in order of first reference
+            for line_no, referenced_file in func_value:
+                edge = edges.setdefault(referenced_file, [0, line_no])
+                edge[0] += 1
+            self._writer.writerows([f_name, dir_path, referenced_file, count, first_line]
+                                   for referenced_file, (count, first_line) in edges.items())
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Normalized, columnar version of the detail results, findings_yymmddhhmmss.parquet / .arrow
+def iter_findings(rows):
+    """Normalize detail rows into findings, one per value found
+
+    A count ([12]) is a finding with a num_value, a (line, value) pair one with a line_no, a (line, [values])
+    pair one finding per value on that line, text a text_value, and a dict one finding per key (metric.key),
+    per value of the key on the line for a (line, dict) pair.
+
+    Args:
+        rows ([list]): [f_name, dir_path, func_descr, func_value] detail rows
+
+    Yields:
+        tuple: (f_name, dir_path, metric, line_no, num_value, text_value), None where not applicable
+    """
+    for f_name, dir_path, metric, values in rows:
+        for value in values:
+            if isinstance(value, dict):
+                for key, item in value.items():
+                    yield (f_name, dir_path, f"{metric}.{key}", None) + _typed_value(item)
+            elif isinstance(value, (tuple, list)) and len(value) == 2 and isinstance(value[0], int):
+                line_no, items = value
+                if isinstance(items, dict):
+                    for key, item in items.items():
+                        for element in (item if isinstance(item, (tuple, list)) else [item]):
+                            yield (f_name, dir_path, f"{metric}.{key}", line_no) + _typed_value(element)
+                    continue
+                for item in (items if isinstance(items, (tuple, list)) else [items]):
+                    yield (f_name, dir_path, metric, line_no) + _typed_value(item)
+            else:
+                yield (f_name, dir_path, metric, None) + _typed_value(value)
+
+
+def _typed_value(value):
+    """(num_value, text_value) of a single value"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value, None
+    return None, value if isinstance(value, str) else repr(value)
+
+
+def read_detail_rows(file_name):
+    """Read the rows of a detail csv file back, with the func_value reprs evaluated"""
+    with open(file_name, 'r', newline='') as file:
+        reader = csv.reader(file)
+        if next(reader, None) != DETAIL_HEADER:
+            return
+        for f_name, dir_path, func_descr, func_value in reader:
+            yield [f_name, dir_path, func_descr, ast.literal_eval(func_value)]
+
+
+class FindingsWriter:
+    """Write the findings of each parsed file (see iter_findings) to a Parquet or Arrow IPC file, in batches
+
+    Args:
+        file_name (string): full path of the findings file, Arrow IPC if it ends in '.arrow', Parquet otherwise
+        batch_rows (int): findings buffered before a batch (Parquet row group) is written
+        rows (iterable): detail rows to start with, e.g. those kept from the run being resumed
+    """
+
+    def __init__(self, file_name, batch_rows=100000, rows=()):
+        import pyarrow  # optional dependency, only needed for the columnar output
+        self._pa = pyarrow
+        self.schema = pyarrow.schema([("f_name", pyarrow.string()), ("dir_path", pyarrow.string()),
+                                      ("metric", pyarrow.string()), ("line_no", pyarrow.int64()),
+                                      ("num_value", pyarrow.float64()), ("text_value", pyarrow.string())])
+        if file_name.endswith(COLUMNAR_FORMATS['arrow']):
+            import pyarrow.ipc
+            self._writer = pyarrow.ipc.new_file(file_name, self.schema)
+        else:
+            import pyarrow.parquet
+            self._writer = pyarrow.parquet.ParquetWriter(file_name, self.schema)
+        self.batch_rows = batch_rows
+        self._columns = [[] for _ in FINDINGS_COLUMNS]
+        self._closed = False
+        self.write_file_rows(rows)
+
+    def write_file_rows(self, rows):
+        """Write the findings of the detail rows (those of one parsed file, or all those of a resumed run), a
+        batch being written as soon as batch_rows findings are buffered so memory stays bounded either way"""
+        columns = self._columns
+        for finding in iter_findings(rows):
+            for column, value in zip(columns, finding):
+                column.append(value)
+            if len(columns[0]) >= self.batch_rows:
+                self.flush()
+                columns = self._columns
+
+    def flush(self):
+        if self._columns[0]:
+            self._writer.write_batch(self._pa.record_batch(self._columns, schema=self.schema))
+            self._columns = [[] for _ in FINDINGS_COLUMNS]
+
+    def close(self):
+        if not self._closed:
+            self.flush()
+            self._writer.close()
+            self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def write_summary_table(file_name, rows):
+    """Write the summary rows ([f_name, dir_path, create_dt, modified_dt]) as a Parquet or Arrow IPC file,
+    with the dates as timestamps"""
+    import pandas as pd
+    summary = pd.DataFrame(rows, columns=["f_name", "dir_path", "create_dt", "modified_dt"])
+    for column in ("create_dt", "modified_dt"):
+        summary[column] = pd.to_datetime(summary[column])
+    if file_name.endswith(COLUMNAR_FORMATS['arrow']):
+        summary.to_feather(file_name)
+    else:
+        summary.to_parquet(file_name, index=False)
+#-----------------------------------------------------------------------------
@@ -0,0 +1,432 @@
+"""
+SAS BLUEPRINT
+file: sas_blueprint.py
+purpose: lexing (sas-lexer) and the analysis blueprint of SAS programs, without Streamlit, so it can be imported
+        by app.py, benchmark.py or any batch job, and run from the command line to blueprint a whole code base
+        (e.g. in CI) with the app only rendering the precomputed results
+        the output is one record per program, as JSON Lines (the full blueprint, which app.py can load) or CSV
+        (the summary fields)
+example use: python sas_blueprint.py -i 'code_dir' -t 'sas' -o 'blueprints.jsonl' -w 8
+        where 'code_dir' is the directory tree of SAS programs, 'sas' the file type, 'blueprints.jsonl' the output
+        file (a '.csv' name writes CSV instead) and 8 the number of worker processes
+"""
+
+import os
+import csv
+import json
+import hashlib
+import argparse
+import multiprocessing
+
+import sas_lexer
+from tqdm import tqdm
+
+SKIPPED_TOKEN_KINDS = {'WS', 'COMMENT'}  # token types the blueprint analysis skips
+IDENTIFIER_TOKEN_KINDS = {'IDENT', 'IDENTIFIER'}  # token types accepted as dataset names
+
+def generate_blueprint(tokens, raw_sas_code):
+    """
+    Analyze SAS tokens to create a translation blueprint.
+    Production version - clean, focused, reliable.
+    Single forward pass over the significant tokens, linear in the number of tokens.
+    """
+    # Initialize counters and trackers
+    analysis = {
+        "data_steps": 0,
+        "proc_blocks": 0,
+        "proc_sql_blocks": 0,
+        "macro_definitions": 0,
+        "macro_calls": 0,
+        "proc_types": set(),
+        "datasets_created": set(),
+        "datasets_used": set(),
+        "has_retain": False,
+        "has_lag": False,
+        "has_merge": False,
+        "has_arrays": False,
+        "in_data_step": False,
+        "in_proc_block": False,
+        "current_proc": None,
+        "pointer_controls": 0,      # Count of @n pointers
+        "line_hold_single": False,  # Single @ at end of INPUT
+        "line_hold_double": False,  # Double @@ at end of INPUT
+        "platform_concerns": [],    # List of platform-specific issues found
+        "has_proc_import": False,
+    }
+    
+    # Compact arrays of the significant tokens (everything but whitespace), built in one pass so every
+    # detection below is a single forward pass with O(1) look-ahead:
+    # the uppercase text, whether it is an identifier and the position in the full token list
+    texts, is_ident, positions = [], [], []
+    kind_flags = {}  # token type -> (skipped, identifier), worked out once per type
+    for position, token in enumerate(tokens):
+        flags = kind_flags.get(token.token_type)
+        if flags is None:
+            kind = token.token_type.name
+            flags = kind_flags[token.token_type] = (kind in SKIPPED_TOKEN_KINDS, kind in IDENTIFIER_TOKEN_KINDS)
+        if flags[0]:
+            continue
+        texts.append(raw_sas_code[token.start:token.stop].upper())
+        is_ident.append(flags[1])
+        positions.append(position)
+    count = len(texts)
+
+    # Helper: text of the token right after significant token k (which may be whitespace), as the
+    # DATA / @ / CALL checks look at the very next token
+    def next_token_text(k):
+        if k + 1 < count and positions[k + 1] == positions[k] + 1:
+            return texts[k + 1]
+        if positions[k] + 1 < len(tokens):
+            token = tokens[positions[k] + 1]
+            return raw_sas_code[token.start:token.stop].upper()
+        return None
+
+    # Helper: original (not uppercased) dataset name starting at significant token k, including the
+    # member name of a two-level LIBREF.MEMBER name
+    def dataset_name(k):
+        token = tokens[positions[k]]
+        if (k + 2 < count and texts[k + 1] == '.' and is_ident[k + 2]
+                and positions[k + 2] == positions[k] + 2):
+            return raw_sas_code[token.start:tokens[positions[k + 2]].stop]
+        return raw_sas_code[token.start:token.stop]
+
+    k = 0
+    while k < count:
+        token_text = texts[k]
+        
+        # --- DETECT PROC SORT PARAMETERS ---
+        if analysis["current_proc"] == 'SORT' and token_text in ('DATA', 'OUT'):
+            # '=' after DATA/OUT, then the dataset name
+            if k + 2 < count and texts[k + 1] == '=' and is_ident[k + 2]:
+                if token_text == 'DATA':
+                    analysis["datasets_used"].add(dataset_name(k + 2))
+                else:
+                    analysis["datasets_created"].add(dataset_name(k + 2))
+        
+        # --- DETECT DATA STEPS ---
+        elif token_text == 'DATA' and not analysis["in_data_step"]:
+            # Check it's not part of a function or PROC parameter
+            next_text = next_token_text(k)
+            if next_text and next_text not in ('_NULL_', 'STEP', '=') and not next_text.startswith('('):
+                analysis["data_steps"] += 1
+                analysis["in_data_step"] = True
+                
+                # Capture dataset name
+                if k + 1 < count and is_ident[k + 1]:
+                    analysis["datasets_created"].add(dataset_name(k + 1))
+        
+        # --- DETECT PROC BLOCKS ---
+        elif token_text == 'PROC':
+            # Procedure name
+            if k + 1 < count:
+                proc_name = texts[k + 1]
+                if proc_name and proc_name.isalpha():
+                    analysis["proc_types"].add(proc_name)
+                    analysis["proc_blocks"] += 1
+                    analysis["in_proc_block"] = True
+                    analysis["current_proc"] = proc_name
+
+                    # Special flag for high-complexity procedures
+                    if proc_name == 'IMPORT':
+                        analysis["has_proc_import"] = True
+
+                    if proc_name == 'SQL':
+                        analysis["proc_sql_blocks"] += 1
+        
+        # --- DETECT SET/MERGE REFERENCES ---
+        elif token_text in ('SET', 'MERGE', 'UPDATE', 'MODIFY') and analysis["in_data_step"]:
+            # Dataset name after the keyword
+            if k + 1 < count and is_ident[k + 1]:
+                analysis["datasets_used"].add(dataset_name(k + 1))
+        
+        # --- DETECT MACROS ---
+        elif token_text.startswith('%'):
+            if token_text == '%MACRO':
+                analysis["macro_definitions"] += 1
+            else:
+                analysis["macro_calls"] += 1
+        
+        # --- DETECT COMPLEXITY PATTERNS ---
+        elif token_text == 'RETAIN':
+            analysis["has_retain"] = True
+        elif token_text in ('LAG', 'LAG1', 'LAG2'):
+            analysis["has_lag"] = True
+        elif token_text == 'MERGE':
+            analysis["has_merge"] = True
+        elif token_text == 'ARRAY':
+            analysis["has_arrays"] = True
+
+        # --- DETECT @ PATTERNS ---
+        elif token_text == '@':
+            # Check what type of @ this is
+            # Look ahead to see if it's @@ or @n
+            next_text = next_token_text(k)
+            
+            # Case 1: @@ (double line hold)
+            if next_text == '@':
+                analysis["line_hold_double"] = True
+                k += 1  # Skip the second @
+            
+            # Case 2: @n (pointer control with number)
+            elif next_text and next_text.isdigit():
+                analysis["pointer_controls"] += 1
+                k += 1  # Skip the number
+            
+            # Case 3: Single @ (could be line hold, need more context)
+            else:
+                # We'll determine if it's line hold later based on position
+                pass
+        
+        # --- DETECT PLATFORM CONCERNS ---
+        # X command (immediate host execution)
+        elif token_text == 'X':
+            analysis["platform_concerns"].append("X command (host-specific execution)")
+        
+        # FILENAME/LIBNAME (often OS-specific paths)
+        elif token_text in ('FILENAME', 'LIBNAME'):
+            analysis["platform_concerns"].append(f"{token_text} statement (check path portability)")
+        
+        # CALL SYSTEM (function-based execution)
+        elif token_text == 'CALL' and positions[k] + 1 < len(tokens):
+            if next_token_text(k) == 'SYSTEM':
+                analysis["platform_concerns"].append("CALL SYSTEM() (host command execution)")
+        
+        # --- DETECT BLOCK ENDINGS ---
+        elif token_text in ('RUN', 'QUIT', 'DATALINES'):
+            analysis["in_data_step"] = False
+            analysis["in_proc_block"] = False
+            analysis["current_proc"] = None
+        
+        k += 1
+    
+    # --- CALCULATE COMPLEXITY SCORE ---
+    complexity_score = (
+        analysis["data_steps"] * 1 +
+        analysis["proc_blocks"] * 1 +
+        analysis["proc_sql_blocks"] * 2 +
+        analysis["macro_definitions"] * 5 +
+        analysis["macro_calls"] * 2 +
+        (5 if analysis["has_retain"] else 0) +
+        (5 if analysis["has_lag"] else 0) +
+        (3 if analysis["has_merge"] else 0) +
+        (3 if analysis["has_arrays"] else 0) +
+        (analysis["pointer_controls"] * 2) +       # @n pointers add some complexity
+        (10 if analysis["line_hold_double"] else 0) + # @@ is high complexity
+        (8 if analysis["line_hold_single"] else 0) +  # @ is high complexity
+        (len(analysis["platform_concerns"]) * 3)   # Each platform concern adds risk
+        + (10 if analysis["has_proc_import"] else 0)
+    )
+    
+    # Determine priority
+    if complexity_score > 25:
+        priority = "High"
+        confidence = "Manual review strongly recommended"
+    elif complexity_score > 15:
+        priority = "Medium"
+        confidence = "Mixed automation with oversight"
+    else:
+        priority = "Low"
+        confidence = "Good candidate for automated translation"
+    
+    # Generate recommendations
+    recommendations = []
+    if analysis["macro_definitions"] > 0:
+        recommendations.append("**Manual review required for custom macro definitions.**")
+    if analysis["proc_sql_blocks"] > 0:
+        recommendations.append(f"**Verify logic of {analysis['proc_sql_blocks']} PROC SQL block(s).**")
+    if analysis["has_retain"]:
+        recommendations.append("**RETAIN statements require stateful translation logic.**")
+    if analysis["has_lag"]:
+        recommendations.append("**LAG functions need special handling for row context.**")
+    if not recommendations:
+        recommendations.append("**Code structure appears straightforward for automated translation.**")
+    if analysis["pointer_controls"] > 0:
+        recommendations.append(f"**Column pointer controls (@) detected: {analysis['pointer_controls']} instance(s). Requires careful input parsing translation.**")
+    
+    if analysis["line_hold_single"]:
+        recommendations.append("**Single trailing @ detected: Line hold requires stateful INPUT buffer management.**")
+    
+    if analysis["line_hold_double"]:
+        recommendations.append("**Double trailing @@ detected: Complex line hold across multiple records.**")
+    
+    # NEW: Platform concerns
+    if analysis["platform_concerns"]:
+        unique_concerns = list(set(analysis["platform_concerns"]))
+        concerns_text = ", ".join(sorted(unique_concerns))
+        recommendations.append(f"**Platform-specific code: {concerns_text}. Review for portability.**")
+
+    if analysis["has_proc_import"]:
+        recommendations.append("**PROC IMPORT detected: Requires manual mapping to pandas.read_csv()/read_excel() with specific parameter analysis.**")
+
+    # --- STRUCTURE FINAL BLUEPRINT ---
+    blueprint = {
+        "summary": {
+            "translation_priority": priority,
+            "confidence_assessment": confidence,
+            "complexity_score": complexity_score,
+            "total_lines": raw_sas_code.count('\n') + 1,
+            "total_tokens": len(tokens)
+        },
+        "detailed_counts": {
+            "DATA Steps": analysis["data_steps"],
+            "PROC Blocks": analysis["proc_blocks"],
+            "PROC SQL Blocks": analysis["proc_sql_blocks"],
+            "Macro Definitions": analysis["macro_definitions"],
+            "Macro Calls": analysis["macro_calls"],
+            "PROC Types Found": list(sorted(analysis["proc_types"]))
+        },
+        "data_flow": {
+            "datasets_created": list(sorted(analysis["datasets_created"])),
+            "datasets_used": list(sorted(analysis["datasets_used"]))
+        },
+        "complexity_flags": {
+            "has_retain_statement": analysis["has_retain"],
+            "has_lag_function": analysis["has_lag"],
+            "has_merge_statement": analysis["has_merge"],
+            "has_array_declarations": analysis["has_arrays"],
+            "pointer_controls_count": analysis["pointer_controls"],
+            "has_line_hold_single": analysis["line_hold_single"],
+            "has_line_hold_double": analysis["line_hold_double"],
+            "platform_concerns": analysis["platform_concerns"]
+        },  
+        "recommendations": recommendations
+    }
+    return blueprint
+
+
+def lex_and_blueprint(raw_sas_code):
+    """Lex the code with sas-lexer and generate its blueprint
+
+    Returns:
+        tuple of form (list, int, dict): the tokens, the number of lexing warnings and the blueprint
+    """
+    tokens, errors, _ = sas_lexer.lex_program_from_str(raw_sas_code)  # We ignore the 3rd bytes item
+    return tokens, len(errors), generate_blueprint(tokens, raw_sas_code)
+
+
+# Summary fields of a blueprint, the CSV columns (after f_name, dir_path, sha256, error)
+SUMMARY_FIELDS = ["translation_priority", "complexity_score", "total_lines", "total_tokens", "data_steps",
+                  "proc_blocks", "proc_sql_blocks", "macro_definitions", "macro_calls", "lexing_warnings"]
+CSV_HEADER = ["f_name", "dir_path", "sha256", "error"] + SUMMARY_FIELDS
+
+
+def summarize_blueprint(blueprint, lexing_warnings):
+    """Flatten the headline numbers of a blueprint into a dict of SUMMARY_FIELDS"""
+    summary = blueprint["summary"]
+    counts = blueprint["detailed_counts"]
+    return {
+        "translation_priority": summary["translation_priority"],
+        "complexity_score": summary["complexity_score"],
+        "total_lines": summary["total_lines"],
+        "total_tokens": summary["total_tokens"],
+        "data_steps": counts["DATA Steps"],
+        "proc_blocks": counts["PROC Blocks"],
+        "proc_sql_blocks": counts["PROC SQL Blocks"],
+        "macro_definitions": counts["Macro Definitions"],
+        "macro_calls": counts["Macro Calls"],
+        "lexing_warnings": lexing_warnings,
+    }
+
+
+def summarize_code(raw_sas_bytes, encoding='utf-8'):
+    """Blueprint a program given as bytes and keep only its summary, the tokens never leave the process
+    (a module level function of plain arguments, so it can run in a process pool)
+
+    Returns:
+        dict: the SUMMARY_FIELDS of the program (see summarize_blueprint)
+    """
+    _, lexing_warnings, blueprint = lex_and_blueprint(raw_sas_bytes.decode(encoding))
+    return summarize_blueprint(blueprint, lexing_warnings)
+
+
+def blueprint_file(file_path, encoding='cp1252'):
+    """Blueprint one program file
+
+    Args:
+        file_path (string): full path to the file
+        encoding (string): encoding of the file
+
+    Returns:
+        dict: 'f_name', 'dir_path', 'sha256' of the file, 'lexing_warnings' and 'blueprint',
+            or 'error' (the message) instead of the last two if the file couldn't be read or analyzed
+    """
+    record = {"f_name": os.path.basename(file_path), "dir_path": os.path.dirname(file_path), "sha256": None}
+    try:
+        with open(file_path, 'rb') as file:
+            raw_sas_bytes = file.read()
+        record["sha256"] = hashlib.sha256(raw_sas_bytes).hexdigest()
+        _, lexing_warnings, blueprint = lex_and_blueprint(raw_sas_bytes.decode(encoding))
+        record["lexing_warnings"] = lexing_warnings
+        record["blueprint"] = blueprint
+    except Exception as e:
+        record["error"] = str(e)
+    return record
+
+
+def iter_blueprints(files_to_process, workers=1, chunksize=None):
+    """Blueprint the files, serially or spread over a pool of worker processes
+
+    Yields:
+        dict: the record of each file (see blueprint_file), always in files_to_process order
+    """
+    if workers <= 1 or len(files_to_process) <= 1:
+        yield from map(blueprint_file, files_to_process)
+        return
+    if chunksize is None:
+        chunksize = max(1, min(64, len(files_to_process) // (workers * 4)))
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap(blueprint_file, files_to_process, chunksize)
+
+
+def read_blueprints(file):
+    """Read the records of a JSON Lines file written by write_blueprints (a path or an open text / binary file)"""
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, encoding='utf-8') as opened:
+            return read_blueprints(opened)
+    return [json.loads(line) for line in file if line.strip()]
+
+
+def write_blueprints(input_dir, output_file, file_type='sas', workers=1):
+    """Blueprint every file of the type in the directory tree, writing each record as soon as it is ready
+
+    Args:
+        input_dir (string): directory tree of the programs
+        output_file (string): output file, CSV if its name ends in '.csv', JSON Lines otherwise
+        file_type (string): file extension of the programs
+        workers (int): number of worker processes, 1 runs in this process
+
+    Returns:
+        int: number of files blueprinted
+    """
+    files_to_process = [os.path.join(dirpath, file)
+                        for dirpath, dirnames, files in os.walk(input_dir)
+                        for file in files if file.endswith(f".{file_type}")]
+    as_csv = output_file.lower().endswith('.csv')
+    with open(output_file, 'w', newline='' if as_csv else None, encoding='utf-8') as file:
+        writer = csv.writer(file) if as_csv else None
+        if writer:
+            writer.writerow(CSV_HEADER)
+        for record in tqdm(iter_blueprints(files_to_process, workers), total=len(files_to_process),
+                           desc="Blueprinting files", unit="file"):
+            if writer:
+                summary = summarize_blueprint(record["blueprint"], record["lexing_warnings"]) \
+                    if "blueprint" in record else {}
+                writer.writerow([record["f_name"], record["dir_path"], record["sha256"], record.get("error", "")]
+                                + [summary.get(field, "") for field in SUMMARY_FIELDS])
+            else:
+                file.write(json.dumps(record) + "\n")
+    return len(files_to_process)
+
+
+#================================================================
+# This is the entry point of the script
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Blueprint the SAS programs of a directory tree.')
+    parser.add_argument('-i', '--input_dir', type=str, required=True, help='Input directory')
+    parser.add_argument('-t', '--file_type', type=str, default='sas', help='File type to be processed (default sas)')
+    parser.add_argument('-o', '--output', type=str, required=True,
+                        help='Output file, JSON Lines or CSV (if the name ends in .csv)')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of worker processes (default 1)')
+    args = parser.parse_args()
+
+    write_blueprints(args.input_dir, args.output, args.file_type, args.workers)
@@ -8,95 +8,446 @@ purpose: python script (main function) to execute one or more parse functions on
         this creates 2 files, a summary_yymmddhhmmss.csv file and a summary_yymmddhhmmss.csv file
         the summary file contains the list of file names, directories and date attributes (create, modified) evaluated
         the detail file contains the results of each parse function performed on each file in the summary
+        when find_file_references is applied, a file_refs_yymmddhhmmss.csv file holds the cross-file reference
+        graph, one row per (file, referenced file) edge
 example use: python sas_parser.py -i 'test_data' -t 'sas' -o 'results'
         where 'test_data' is the directory of text data to be parsed, 'sas' is the file type (.sas.) and
         'results' is the directory the summary and details will be saved.
+        add '-w 8' to spread the files over 8 worker processes, the output is identical to the serial run
+        add '-r 20230527120000' to resume an interrupted run, the files already in its detail file are skipped
+        results are cached in parse_cache.sqlite in the output directory (see result_cache.py) so a re-run only
+        parses the files that changed, add '--full' to ignore the cache and rebuild it
+        add '-l' to tokenize each file once with sas-lexer and use the token based parse functions
+        (lexer_functions.py), which don't count code in comments or string literals
+        files over 64 MB ('--mmap_threshold') are memory-mapped and scanned at the byte level, so memory stays
+        flat however large the file
+        add '--timings' to write the time each parse function takes on each file to timings_yymmddhhmmss.csv and
+        report the slowest ones ('--top 20' to list more), '--profile' to profile the run with cProfile
+        (see instrumentation.py)
+        add '--columnar parquet' (or 'arrow') to also write the summary and the detail results normalized to one
+        typed row per finding (findings_yymmddhhmmss.parquet), for a vectorized read with pandas / pyarrow
+        add '--store' to also keep the results of every run in results.sqlite in the output directory, to query
+        and compare runs (see result_store.py)
+        the files are found by a crawl (see crawler.py) listing the directories and stat'ing the files on
+        '--io_workers' threads, and parsed as they are found unless find_file_references needs all of them first
+        add '--functions get_sql_structure' to list the tables read, written and created and the columns joined
+        on by each SQL statement (see sql_structure.py)
 
 notes: the parsing / evaluation functions are in the parse_functions.py file 
+        each file is read and decoded once into a SasDocument (see parse_functions.py) that is shared by
+        all of the parse functions applied to it
 todo: 
-        creating a third table, where the first table remains the header, the second table is the cross table to 
-        the header table and to the detail table so as to accommodate multiple values for a single metric
-
-        function that returns key elements of a SQL statement (e.g. table names, column names)
-
-        If performance becomes and issue, then don't keep opening the file, but instead pass the contents 
-        of the file to the parse functions. 
 
 """
 
 import os
 import re
+import time
 import argparse
 import datetime
 import csv
-import inspect
+import multiprocessing
+import queue
+import collections
+import importlib.util
 from tqdm import tqdm
-from parse_functions import *   # import all the parse functions 
+from parse_functions import (PARSE_FUNCTIONS, DEFAULT_MMAP_THRESHOLD, SasDocument, load_document, load_parse_functions,
+                             needs_of, find_file_references)
+from result_writers import (DetailWriter, ReferenceGraphWriter, FindingsWriter, COLUMNAR_FORMATS, read_detail_rows,
+                            write_summary_table)
+from result_cache import ResultCache, CACHE_FILE_NAME
+from result_store import ResultStore, STORE_FILE_NAME
+from instrumentation import TimingsRecorder, run_profiled
+from crawler import crawl, DEFAULT_IO_WORKERS
+
+# Files handed to a worker at a time when the files are parsed as they are found (their number isn't known yet)
+STREAM_CHUNKSIZE = 8
+
+def select_functions(functions=None, skip=None, lexer=False):
+    """Pick the parse functions of a run from the registry (see parse_functions.parse_function)
+
+    Args:
+        functions ([string]): function or metric names of the functions to run, the default ones if None
+        skip ([string]): function or metric names of the functions not to run
+        lexer (bool): run the token based functions (lexer_functions.py) in place of the text based ones they replace
+
+    Returns:
+        [function]: the selected functions, in the order their results are written
+    """
+    names = list(functions or []) + list(skip or [])
+    if lexer or any(name not in PARSE_FUNCTIONS for name in names):
+        load_parse_functions(optional=not lexer)  # the functions of the optional modules are only loaded if needed
+
+    def resolve(names):
+        selected = set()
+        for name in names:
+            if name in PARSE_FUNCTIONS:
+                selected.add(name)
+                continue
+            # a metric name stands for the text based function returning it
+            matches = {func_name for func_name, func in PARSE_FUNCTIONS.items()
+                       if func.parse_info.metric == name and func.parse_info.replaces is None}
+            if not matches:
+                raise ValueError(f"unknown parse function: {name}")
+            selected |= matches
+        return selected
+
+    chosen = resolve(functions) if functions else {name for name, func in PARSE_FUNCTIONS.items()
+                                                   if func.parse_info.default}
+    chosen -= resolve(skip or [])
+    if lexer:
+        replacements = {func.parse_info.replaces: name for name, func in PARSE_FUNCTIONS.items()
+                        if func.parse_info.replaces}
+        chosen = {replacements.get(name, name) for name in chosen}
+
+    # in declaration order, a token based function taking the place of the one it replaces
+    order = {name: position for position, name in enumerate(PARSE_FUNCTIONS)}
+    return sorted((PARSE_FUNCTIONS[name] for name in chosen),
+                  key=lambda func: order[func.parse_info.replaces or func.__name__])
+
+
+# The parse functions run on every file by default, in the order their results are written
+functions_to_apply = select_functions()
+
+
+def lexer_functions_to_apply():
+    """The token based equivalents of functions_to_apply (see lexer_functions.py), imported only when asked
+    for as they need sas-lexer"""
+    return select_functions(lexer=True)
+
+
+def resolve_dispatch(functions):
+    """Work out once per run which parse functions also need the list of all files being processed
+
+    Args:
+        functions ([function]): parse functions to apply
+
+    Returns:
+        [(function, bool)]: each function paired with whether it takes the file list as a second argument
+    """
+    return [(func, 'corpus' in needs_of(func)) for func in functions]
+
+
+def parse_file(file_path, dispatch, files_to_process, only=None, mmap_threshold=DEFAULT_MMAP_THRESHOLD,
+               timings=None):
+    """Read a file once and run every parse function over the shared document
+
+    Args:
+        file_path (string): full path to the file
+        dispatch ([(function, bool)]): parse functions as returned by resolve_dispatch
+        files_to_process ([string]): all of the files evaluated in this run
+        only ([int]): positions in dispatch of the functions to run, all of them if None
+        mmap_threshold (int): files larger than this many bytes are memory-mapped instead of read into memory
+        timings (list): if given, one [f_name, dir_path, function, wall_s, bytes_read, result_size] row is
+            appended to it for reading the file ('read', 0 bytes if nothing needs its content), for each parse
+            function run and for the results of the document they share ('shared': lines, tokens, block
+            counts..., see SasDocument.shared), which are not charged to the function computing them first
+
+    Returns:
+        list: one [f_name, dir_path, func_descr, func_value] row per parse function run
+    """
+    f_name, dir_path = os.path.basename(file_path), os.path.dirname(file_path)
+    selected = dispatch if only is None else [dispatch[index] for index in only]
+    if timings is not None:
+        start = time.perf_counter()
+    if any(need not in ('path', 'corpus') for func, _ in selected for need in needs_of(func)):
+        doc = load_document(file_path, mmap_threshold)
+        bytes_read = os.path.getsize(file_path) if timings is not None else 0
+    else:
+        doc = SasDocument(file_path)  # nothing needs the content, the file isn't read
+        bytes_read = 0
+    if timings is not None:
+        timings.append([f_name, dir_path, 'read', time.perf_counter() - start, bytes_read, 0])
+    rows = []
+    try:
+        for func, needs_file_list in selected:
+            if timings is not None:
+                start, shared_start = time.perf_counter(), doc.shared_seconds
+            if needs_file_list:
+                result_name, result_value = func(doc, files_to_process)
+            else:
+                result_name, result_value = func(doc)
+            if timings is not None:
+                seconds = time.perf_counter() - start - (doc.shared_seconds - shared_start)
+                timings.append([f_name, dir_path, func.__name__, seconds, 0, len(str(result_value))])
+            rows.append([f_name, dir_path, result_name, result_value])
+        if timings is not None:
+            timings.append([f_name, dir_path, 'shared', doc.shared_seconds, 0, 0])
+    finally:
+        doc.close()
+    return rows
+
+
+# Per process state for the worker pool, set once by _init_worker rather than pickled with every file
+_worker_state = {}
+
+
+def _init_worker(dispatch, files_to_process, mmap_threshold, timed):
+    _worker_state['dispatch'] = dispatch
+    _worker_state['files_to_process'] = files_to_process
+    _worker_state['mmap_threshold'] = mmap_threshold
+    _worker_state['timed'] = timed
 
 
-def process_files(input_dir, output_dir, file_type):
-    # List to store results of functions
-    results = []
+def _parse_file_in_worker(task):
+    file_path, only = task
+    timings = [] if _worker_state['timed'] else None
+    rows = parse_file(file_path, _worker_state['dispatch'], _worker_state['files_to_process'], only,
+                      _worker_state['mmap_threshold'], timings)
+    return rows, timings
 
-    # Get the current date and time to append to the output file names
-    now = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+
+def iter_parse_results(files_to_process, dispatch, workers=1, chunksize=None, corpus=None, only=None,
+                       mmap_threshold=DEFAULT_MMAP_THRESHOLD, timed=False):
+    """Parse the files, serially or spread over a pool of worker processes
+
+    Args:
+        files_to_process ([string]): full paths of the files to parse
+        dispatch ([(function, bool)]): parse functions as returned by resolve_dispatch
+        workers (int): number of worker processes, 1 parses in this process
+        chunksize (int): files handed to a worker at a time, by default sized from the number of files
+        corpus ([string]): all of the files evaluated in the run, defaults to files_to_process
+        only ([[int]]): per file, the positions in dispatch of the functions to run (default all of them)
+        mmap_threshold (int): files larger than this many bytes are memory-mapped instead of read into memory
+        timed (bool): also time reading each file and each parse function (see parse_file)
+
+    Yields:
+        tuple of form (list, list): the result rows of each file and its timing rows (None unless timed),
+            always in files_to_process order
+    """
+    if corpus is None:
+        corpus = files_to_process
+    if chunksize is None:
+        # small enough chunks to keep every worker busy to the end, large enough to keep the IPC cheap
+        chunksize = max(1, min(64, len(files_to_process) // (workers * 4)))
+    tasks = zip(files_to_process, only if only is not None else [None] * len(files_to_process))
+    yield from iter_parse_tasks(tasks, dispatch, workers if len(files_to_process) > 1 else 1, chunksize, corpus,
+                                mmap_threshold, timed)
+
+
+def iter_parse_tasks(tasks, dispatch, workers=1, chunksize=1, corpus=(), mmap_threshold=DEFAULT_MMAP_THRESHOLD,
+                     timed=False):
+    """Parse a stream of files, serially or spread over a pool of worker processes (see iter_parse_results)
+
+    Args:
+        tasks (iterable): (file path, positions in dispatch of the functions to run or None for all) pairs,
+            consumed as the files are parsed so they can still be coming in (from a crawl) while parsing
+        corpus ([string]): all of the files evaluated in the run, only needed by the functions taking it
+
+    Yields:
+        tuple of form (list, list): the result rows of each file and its timing rows, in tasks order
+    """
+    if workers <= 1:
+        for file_path, file_only in tasks:
+            timings = [] if timed else None
+            yield parse_file(file_path, dispatch, corpus, file_only, mmap_threshold, timings), timings
+        return
+
+    with multiprocessing.Pool(workers, initializer=_init_worker,
+                              initargs=(dispatch, corpus, mmap_threshold, timed)) as pool:
+        # imap (not imap_unordered) so the output is byte-identical to the serial run
+        yield from pool.imap(_parse_file_in_worker, tasks, chunksize)
+
+
+def summary_row(entry):
+    """The summary row of a crawled file (see crawler.FileEntry), from the stat taken by the crawl"""
+    return [os.path.basename(entry.path), os.path.dirname(entry.path),
+            datetime.datetime.fromtimestamp(entry.stat.st_ctime).isoformat(),
+            datetime.datetime.fromtimestamp(entry.stat.st_mtime).isoformat()]
+
+
+def process_files(input_dir, output_dir, file_type, functions=None, workers=1, resume=None, flush_every=100,
+                  use_cache=True, full=False, mmap_threshold=DEFAULT_MMAP_THRESHOLD, timings=False, top_n=10,
+                  columnar=None, store=False, io_workers=DEFAULT_IO_WORKERS):
+    # Get the current date and time to append to the output file names, or reuse the run being resumed
+    now = resume if resume else datetime.datetime.now().strftime('%Y%m%d%H%M%S')
 
     # File names for the output files
     summary_file_name = os.path.join(output_dir, f"summary_{now}.csv")
     detail_file_name = os.path.join(output_dir, f"detail_{now}.csv")
+    file_refs_file_name = os.path.join(output_dir, f"file_refs_{now}.csv")
+    timings_file_name = os.path.join(output_dir, f"timings_{now}.csv")
+
+    dispatch = resolve_dispatch(functions if functions is not None else functions_to_apply)
 
-    # Find all files of the specified type in the input directory
-    files_to_process = [os.path.join(dirpath, file)
-                        for dirpath, dirnames, files in os.walk(input_dir)
-                        for file in files if file.endswith(f".{file_type}")]
-
-    # Write the file summary
-    with open(summary_file_name, 'w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(["f_name", "dir_path", "create_dt", "modified_dt"])
-        for file_path in files_to_process:
-            writer.writerow([os.path.basename(file_path), os.path.dirname(file_path),
-                            datetime.datetime.fromtimestamp(os.path.getctime(file_path)).isoformat(),
-                            datetime.datetime.fromtimestamp(os.path.getmtime(file_path)).isoformat()])
-
-    # Run the functions on each file
-    for file_path in tqdm(files_to_process, desc="Processing files", unit="file"):
-        for func in functions_to_apply:
-            num_args = len(inspect.signature(func).parameters)
-            if num_args == 1:
-                result_name, result_value = func(file_path)
-            elif num_args == 2:
-                result_name, result_value = func(file_path, files_to_process)
-            results.append([os.path.basename(file_path), os.path.dirname(file_path), result_name, result_value])
-
-    # Write the detailed results
-    with open(detail_file_name, 'w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(["f_name", "dir_path", "func_descr", "func_value"])
-        for result in results:
-            writer.writerow(result)
+    # Find all files of the specified type in the input directory (see crawler.py). They are parsed as they
+    # are found, unless a function needs the list of all of the files (find_file_references) before it can run
+    entries = crawl(input_dir, file_type, io_workers)
+    if any(needs_file_list for _, needs_file_list in dispatch):
+        entries = list(entries)
+        files_to_process = [entry.path for entry in entries]
+        chunksize = max(1, min(64, len(entries) // (max(1, workers) * 4)))
+    else:
+        files_to_process = []
+        chunksize = STREAM_CHUNKSIZE
+    # files parsed ahead of the one whose results are written next
+    window = 2 * workers * chunksize if workers > 1 else 1
+
+    # Run the functions on each file, reading each file only once, and write the file summary and the detailed
+    # results as each file finishes so only one file's results are held in memory
+    with DetailWriter(detail_file_name, len(dispatch), flush_every, resume=bool(resume)) as detail_writer, \
+            open(summary_file_name, 'w', newline='') as summary_file:
+        summary_writer = csv.writer(summary_file)
+        summary_writer.writerow(["f_name", "dir_path", "create_dt", "modified_dt"])
+        summary_rows = []
+
+        # The cross-file references are also written as a graph (edge list) of their own
+        graph_writer = ReferenceGraphWriter(file_refs_file_name, detail_writer.completed) \
+            if find_file_references in [func for func, _ in dispatch] else None
+
+        # The normalized findings, rebuilt from the detail file for the files done by the run being resumed
+        findings_writer = FindingsWriter(os.path.join(output_dir, f"findings_{now}{COLUMNAR_FORMATS[columnar]}"),
+                                         rows=read_detail_rows(detail_file_name) if detail_writer.completed else ()) \
+            if columnar else None
+
+        # The results of every run in one SQLite store (the files done before a resume are added at the end)
+        result_store = ResultStore(os.path.join(output_dir, STORE_FILE_NAME)) if store else None
+        if result_store:
+            result_store.start_run(now, input_dir, file_type, [func.__name__ for func, _ in dispatch])
+
+        # Only parse the files (and run the functions) whose cached results are out of date
+        cache = ResultCache(os.path.join(output_dir, CACHE_FILE_NAME), dispatch, files_to_process, full) \
+            if use_cache else None
+
+        # Files whose results all come from the cache are not parsed, so they have no timings
+        recorder = TimingsRecorder(timings_file_name, top_n) if timings else None
+
+        # The files to parse are queued for the parse stage as they are found, their results are written in the
+        # order the files were found
+        tasks = queue.Queue()
+        fresh_results = iter_parse_tasks(iter(tasks.get, None), dispatch, workers, chunksize, files_to_process,
+                                         mmap_threshold, timings)
+        planned = collections.deque()  # (entry, summary row, positions of the functions to run) of the files to write
+        queued = 0                      # files of planned that are parsed
+        progress = tqdm(total=len(entries) if files_to_process else None, desc="Processing files", unit="file")
+
+        def write_next():
+            nonlocal queued
+            entry, row, file_missing = planned.popleft()
+            rows, file_timings = ([], None)
+            if file_missing:
+                rows, file_timings = next(fresh_results)
+                queued -= 1
+            if recorder and file_timings:
+                recorder.record(file_timings)
+            if cache:
+                rows = cache.merge_rows(entry.path, file_missing, rows)
+                if progress.n % flush_every == flush_every - 1:
+                    cache.commit()
+            detail_writer.write_file_rows(rows)
+            if graph_writer:
+                graph_writer.write_file_rows(rows)
+            if findings_writer:
+                findings_writer.write_file_rows(rows)
+            if result_store:
+                result_store.add_file(now, row, rows, entry.stat.st_size)
+            progress.update()
+
+        try:
+            for entry in entries:
+                row = summary_row(entry)
+                summary_rows.append(row)
+                summary_writer.writerow(row)
+                if detail_writer.is_completed(entry.path):  # done by the run being resumed
+                    progress.update()
+                    continue
+                file_missing = cache.missing_functions(entry.path, entry.stat) if cache \
+                    else list(range(len(dispatch)))
+                planned.append((entry, row, file_missing))
+                if file_missing:
+                    tasks.put((entry.path, file_missing))
+                    queued += 1
+                # a file being parsed is only waited for once enough files are queued behind it to keep the
+                # workers busy (and fill its chunk)
+                while planned and (not planned[0][2] or queued >= window):
+                    write_next()
+            tasks.put(None)
+            progress.total = len(summary_rows)
+            progress.refresh()
+            while planned:
+                write_next()
+        finally:
+            tasks.put(None)
+            fresh_results.close()
+            progress.close()
+
+        if columnar:
+            write_summary_table(os.path.join(output_dir, f"summary_{now}{COLUMNAR_FORMATS[columnar]}"), summary_rows)
+        if cache:
+            cache.close()
+        if graph_writer:
+            graph_writer.close()
+        if findings_writer:
+            findings_writer.close()
+        if result_store:
+            if detail_writer.completed:
+                result_store.add_detail_file(now, detail_file_name, summary_rows,
+                                             detail_writer.completed - result_store.stored_files(now))
+            result_store.close()
+        if recorder:
+            recorder.close()
+            print(recorder.report())
 
 #================================================================
 # This is the entry point of the script
 if __name__ == "__main__":
     # Set up command line argument parsing
     parser = argparse.ArgumentParser(description='Process some files.')
-    parser.add_argument('-i', '--input_dir', type=str, required=True, help='Input directory')
-    parser.add_argument('-t', '--file_type', type=str, required=True, help='File type to be processed')
-    parser.add_argument('-o', '--output_dir', type=str, required=True, help='Output directory')
+    parser.add_argument('-i', '--input_dir', type=str, help='Input directory')
+    parser.add_argument('-t', '--file_type', type=str, help='File type to be processed')
+    parser.add_argument('-o', '--output_dir', type=str, help='Output directory')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of worker processes (default 1)')
+    parser.add_argument('--io_workers', type=int, default=DEFAULT_IO_WORKERS,
+                        help=f'Number of threads listing directories and stat\'ing files (default {DEFAULT_IO_WORKERS})')
+    parser.add_argument('-r', '--resume', type=str, help='Timestamp (yymmddhhmmss) of an interrupted run to resume')
+    parser.add_argument('--full', action='store_true', help='Ignore the result cache and re-parse every file')
+    parser.add_argument('-l', '--lexer', action='store_true',
+                        help='Tokenize each file with sas-lexer and run the token based parse functions')
+    parser.add_argument('--functions', type=str,
+                        help='Comma separated parse functions (or metric names) to run instead of the default ones')
+    parser.add_argument('--skip', type=str, help='Comma separated parse functions (or metric names) not to run')
+    parser.add_argument('--list_functions', action='store_true', help='List the parse functions and exit')
+    parser.add_argument('--mmap_threshold', type=float, default=DEFAULT_MMAP_THRESHOLD / (1024 * 1024),
+                        help='Memory-map files larger than this many MB instead of reading them into memory (default 64)')
+    parser.add_argument('--timings', action='store_true',
+                        help='Time each parse function on each file (timings_yymmddhhmmss.csv) and report the slowest')
+    parser.add_argument('--top', type=int, default=10, help='Number of slowest files / functions reported (default 10)')
+    parser.add_argument('--columnar', type=str, choices=sorted(COLUMNAR_FORMATS),
+                        help='Also write the summary and the normalized findings as Parquet or Arrow IPC files')
+    parser.add_argument('--store', action='store_true',
+                        help=f'Also keep the results of the run in {STORE_FILE_NAME} in the output directory')
+    parser.add_argument('--profile', action='store_true',
+                        help='Profile the run with cProfile (main process only, best used without workers)')
     
     # Parse command line arguments
     args = parser.parse_args()
     
-    functions_to_apply = [
-        count_lines, 
-        count_sql, 
-        get_sql_code, 
-        get_libname_lines, 
-        count_exports, 
-        count_null_ds, 
-        find_date_lines,
-        find_file_references]  
-    
+    if args.list_functions:
+        load_parse_functions()
+        print(f"{'function':<24}{'metric':<18}{'needs':<16}{'version':>8}{'cost':>6}  default")
+        for name, func in PARSE_FUNCTIONS.items():
+            info = func.parse_info
+            print(f"{name:<24}{info.metric:<18}{','.join(info.needs):<16}{info.version:>8}{info.cost:>6}  "
+                  f"{'yes' if info.default else 'no'}{f' (-l in place of {info.replaces})' if info.replaces else ''}")
+        parser.exit()
+    if not (args.input_dir and args.file_type and args.output_dir):
+        parser.error("the following arguments are required: -i/--input_dir, -t/--file_type, -o/--output_dir")
+    if args.columnar and importlib.util.find_spec('pyarrow') is None:
+        parser.error(f"--columnar {args.columnar} needs the pyarrow package (pip install pyarrow)")
+
     # Call the main function with the parsed arguments
-    process_files(args.input_dir, args.output_dir, args.file_type)
\ No newline at end of file
+    try:
+        functions = select_functions(args.functions.split(',') if args.functions else None,
+                                     args.skip.split(',') if args.skip else None, args.lexer)
+    except ValueError as error:
+        parser.error(str(error))
+    run_args = (args.input_dir, args.output_dir, args.file_type, functions)
+    run_kwargs = dict(workers=args.workers, resume=args.resume, full=args.full,
+                      mmap_threshold=int(args.mmap_threshold * 1024 * 1024), timings=args.timings, top_n=args.top,
+                      columnar=args.columnar, store=args.store, io_workers=args.io_workers)
+    if args.profile:
+        profile_file_name = os.path.join(args.output_dir,
+                                         f"profile_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.prof")
+        run_profiled(profile_file_name, process_files, *run_args, **run_kwargs)
+    else:
+        process_files(*run_args, **run_kwargs)
\ No newline at end of file
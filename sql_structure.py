@@ -0,0 +1,310 @@
+"""
+SQL STRUCTURE
+file: sql_structure.py
+purpose: key elements of the SQL statements of the PROC SQL blocks (the sas_parser.py todo): for each statement
+        the tables it reads, the tables it writes, the tables / views it creates and the columns it joins on
+        each block is tokenized once by a single precompiled scanner, the tokens are produced one at a time and
+        every statement is analyzed as soon as its ';' is read, so besides the code of the block only the tokens
+        of one statement are held in memory at a time
+        get_sql_structure is a parse function (sas_parser.py --functions get_sql_structure), and run as a script
+        the statements of a whole directory tree are streamed to a csv file, one row per element found
+example use: python sql_structure.py -i 'code_dir' -t 'sas' -o 'sql_structure.csv'
+        where 'code_dir' is the directory tree of SAS programs, 'sas' the file type and 'sql_structure.csv' the
+        output file (f_name, dir_path, line_no, statement, element, name)
+"""
+
+import os
+import re
+import csv
+import itertools
+import argparse
+from collections import namedtuple
+
+from tqdm import tqdm
+
+from parse_functions import accepts_path, parse_function, load_document
+
+# One analyzed statement: its line, first keyword and the (upper case, de-duplicated) names found in it
+SqlStatement = namedtuple('SqlStatement', 'line statement reads writes creates join_columns')
+
+STRUCTURE_ELEMENTS = ('reads', 'writes', 'creates', 'join_columns')
+
+# Single precompiled scanner for (upper cased) SQL code: each match is the whitespace and comments skipped and
+# the token after them, a name (possibly two-level, with macro references), string literal, number or character
+_SQL_TOKEN = re.compile(r"""
+    ((?:\s+|/\*.*?(?:\*/|\Z))*)
+    ([A-Z_&%][\w&%]*(?:\.[A-Z_&%][\w&%]*)*\.?
+     |'(?:[^']|'')*'?|"(?:[^"]|"")*"?
+     |\d+(?:\.\d*)?(?:E[-+]?\d+)?
+     |.)
+""", re.VERBOSE | re.DOTALL)
+
+_NAME_START = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZ_&%')
+
+# Words that end a list of tables or can't be a table name / alias
+_KEYWORDS = frozenset("""
+    SELECT FROM WHERE GROUP ORDER HAVING BY ON JOIN INNER LEFT RIGHT FULL OUTER CROSS NATURAL UNION EXCEPT
+    INTERSECT AS SET VALUES USING LIMIT WHEN THEN ELSE END CASE AND OR NOT IN IS NULL INTO ALL DISTINCT CORR
+    CALCULATED EXISTS BETWEEN LIKE ESCAPE CONTAINS CONNECTION
+""".split())
+
+# Statements writing to the table named after their first keywords
+_WRITE_TARGETS = {'INSERT': ('INTO',), 'UPDATE': (), 'DELETE': ('FROM',), 'ALTER': ('TABLE',)}
+
+
+def _is_table(text):
+    """True if the token can be a table name or alias"""
+    return text[0] in _NAME_START and text not in _KEYWORDS
+
+
+#-----------------------------------------------------------------------------
+# Finding and tokenizing the PROC SQL blocks
+def iter_sql_blocks(lines):
+    """Yield the code of each PROC SQL block, from just after the PROC SQL statement to its QUIT;
+    (as with get_sql_code, a block without a QUIT; is not returned)
+
+    Args:
+        lines (iterable): the lines of the file, including line endings
+
+    Yields:
+        tuple of form (string, int): the code of the block and the (1 based) number of the line it starts on
+    """
+    state = 'outside'  # 'outside' a block, in the PROC SQL statement 'options' or in the block 'body'
+    for line_no, line in enumerate(lines, 1):
+        lower = line.lower()
+        position = 0
+        while True:
+            if state == 'outside':
+                found = lower.find('proc sql', position)
+                if found < 0:
+                    break
+                state, position = 'options', found + len('proc sql')
+            elif state == 'options':
+                found = lower.find(';', position)
+                if found < 0:
+                    break
+                state, position = 'body', found + 1
+                pieces, first_line = [], line_no
+            else:
+                found = lower.find('quit;', position)
+                if found < 0:
+                    pieces.append(line[position:])
+                    break
+                pieces.append(line[position:found])
+                yield ''.join(pieces), first_line
+                state, position = 'outside', found + len('quit;')
+
+
+def iter_sql_tokens(code, first_line=1):
+    """Yield the tokens of SQL code, upper cased, without whitespace and comments
+
+    Yields:
+        tuple of form (int, string): line number and token
+    """
+    line = first_line
+    for match in _SQL_TOKEN.finditer(code.upper()):
+        skipped, token = match.groups()
+        if '\n' in skipped:
+            line += skipped.count('\n')
+        yield line, token
+        if token[0] in '\'"':
+            line += token.count('\n')
+#-----------------------------------------------------------------------------
+
+
+#-----------------------------------------------------------------------------
+# Analysis of one statement
+def _unique(names):
+    return list(dict.fromkeys(names))
+
+
+def analyze_statement(tokens):
+    """Find the tables read, written and created and the columns joined on by one SQL statement
+
+    Args:
+        tokens ([string]): the (upper case) tokens of the statement, without its ';'
+
+    Returns:
+        tuple: (statement, reads, writes, creates, join_columns), statement being its first keyword
+    """
+    count = len(tokens)
+    statement = tokens[0]
+    reads, writes, creates, compared = [], [], [], []
+    aliases = {}  # alias (or member name) -> table
+    skip = None   # position of the FROM of DELETE FROM, which names the table written
+
+    # --- TABLES WRITTEN / CREATED ---
+    if statement == 'CREATE':
+        position = 1
+        while position < count and tokens[position] not in ('TABLE', 'VIEW', 'INDEX'):
+            position += 1
+        if position + 1 < count and tokens[position] != 'INDEX' and _is_table(tokens[position + 1]):
+            creates.append(tokens[position + 1])
+            writes.append(tokens[position + 1])
+    elif statement == 'DROP':
+        writes.extend(token for token in tokens[2:] if _is_table(token))
+    elif statement in _WRITE_TARGETS:
+        position = 1
+        for keyword in _WRITE_TARGETS[statement]:
+            if position < count and tokens[position] == keyword:
+                position += 1
+        if position < count and _is_table(tokens[position]):
+            writes.append(tokens[position])
+            aliases[tokens[position].rsplit('.', 1)[-1]] = tokens[position]
+            if statement == 'DELETE':
+                skip = position - 1
+
+    # --- TABLES READ, JOIN CONDITIONS ---
+    in_condition = False  # in an ON or WHERE clause
+    position = 0
+    while position < count:
+        token = tokens[position]
+        if (token == 'FROM' or token == 'JOIN') and position != skip:
+            position = _read_tables(tokens, position + 1, token == 'FROM', reads, aliases)
+            in_condition = False
+            continue
+        if token == 'ON' or token == 'WHERE':
+            in_condition = True
+        elif token in ('GROUP', 'ORDER', 'HAVING', 'UNION', 'EXCEPT', 'INTERSECT', 'SELECT'):
+            in_condition = False
+        elif token == '=' and in_condition and 0 < position < count - 1:
+            left, right = tokens[position - 1], tokens[position + 1]
+            if ('.' in left and '.' in right and left[0] in _NAME_START and right[0] in _NAME_START
+                    and left.rsplit('.', 1)[0] != right.rsplit('.', 1)[0]):  # columns of two different tables
+                compared.extend((left, right))
+        position += 1
+
+    join_columns = []
+    for column in compared:
+        qualifier, name = column.rsplit('.', 1)
+        join_columns.append(f"{aliases.get(qualifier, qualifier)}.{name}")
+    return statement, _unique(reads), _unique(writes), _unique(creates), _unique(join_columns)
+
+
+def _read_tables(tokens, position, allow_list, reads, aliases):
+    """Read the table (or comma separated tables after FROM) starting at position, with their aliases
+
+    Returns:
+        int: position of the first token after the tables
+    """
+    count = len(tokens)
+    while position < count:
+        table = tokens[position]
+        if not _is_table(table):
+            return position  # a subquery, pass-through (CONNECTION TO) or the end of the clause
+        reads.append(table)
+        aliases[table.rsplit('.', 1)[-1]] = table
+        position += 1
+        if position < count and tokens[position] == '(':
+            position = _skip_parentheses(tokens, position)  # data set options
+        if position < count and tokens[position] == 'AS':
+            position += 1
+        if position < count and _is_table(tokens[position]):
+            aliases[tokens[position]] = table
+            position += 1
+        if not (allow_list and position < count and tokens[position] == ','):
+            return position
+        position += 1
+    return position
+
+
+def _skip_parentheses(tokens, position):
+    depth = 0
+    while position < len(tokens):
+        if tokens[position] == '(':
+            depth += 1
+        elif tokens[position] == ')':
+            depth -= 1
+            if depth == 0:
+                return position + 1
+        position += 1
+    return position
+#-----------------------------------------------------------------------------
+
+
+def iter_sql_statements(lines):
+    """Yield the structure of each SQL statement of the PROC SQL blocks, one statement at a time
+
+    Only statements that read, write or create a table (or join columns) are yielded.
+
+    Args:
+        lines (iterable): the lines of the file, including line endings
+
+    Yields:
+        SqlStatement: line number, first keyword and the names found
+    """
+    for code, first_line in iter_sql_blocks(lines):
+        statement, line = [], None
+        # the ';' closing the block's last statement may be missing before QUIT;
+        for token_line, token in itertools.chain(iter_sql_tokens(code, first_line), [(None, ';')]):
+            if token != ';':
+                if not statement:
+                    line = token_line
+                statement.append(token)
+                continue
+            if statement and statement[0][0] in _NAME_START:
+                found = SqlStatement(line, *analyze_statement(statement))
+                if found.reads or found.writes or found.creates or found.join_columns:
+                    yield found
+            statement = []
+
+
+#-----------------------------------------------------------------------------
+# Define function to find the key elements of the SQL statements
+@parse_function('sql_structure', needs=('lines',), cost=2, default=False)
+@accepts_path
+def get_sql_structure(doc):
+    """Return the tables read, written and created and the columns joined on by each SQL statement
+
+    Args:
+        doc (SasDocument): the file to be parsed (a full file path is also accepted)
+
+    Returns:
+        tuple of form (int, dict): line number of the statement and its statement (first keyword), reads,
+            writes, creates and join_columns
+    """
+    return ("sql_structure", [(found.line, {'statement': found.statement, 'reads': found.reads,
+                                            'writes': found.writes, 'creates': found.creates,
+                                            'join_columns': found.join_columns})
+                              for found in iter_sql_statements(doc.iter_lines())])
+#-----------------------------------------------------------------------------
+
+
+def write_sql_structure(input_dir, output_file, file_type='sas'):
+    """Stream the structure of the SQL statements of every file of the type in the directory tree to a csv file,
+    one row per element (table read / written / created, join column) found
+
+    Returns:
+        int: number of statements written
+    """
+    files_to_process = [os.path.join(dirpath, file)
+                        for dirpath, dirnames, files in os.walk(input_dir)
+                        for file in files if file.endswith(f".{file_type}")]
+    statements = 0
+    with open(output_file, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["f_name", "dir_path", "line_no", "statement", "element", "name"])
+        for file_path in tqdm(files_to_process, desc="Extracting SQL structure", unit="file"):
+            f_name, dir_path = os.path.basename(file_path), os.path.dirname(file_path)
+            doc = load_document(file_path)
+            try:
+                for found in iter_sql_statements(doc.iter_lines()):
+                    statements += 1
+                    writer.writerows([f_name, dir_path, found.line, found.statement, element, name]
+                                     for element in STRUCTURE_ELEMENTS for name in getattr(found, element))
+            finally:
+                doc.close()
+    return statements
+
+
+#================================================================
+# This is the entry point of the script
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Extract the tables and join columns of the SQL in SAS programs.')
+    parser.add_argument('-i', '--input_dir', type=str, required=True, help='Input directory')
+    parser.add_argument('-t', '--file_type', type=str, default='sas', help='File type to be processed (default sas)')
+    parser.add_argument('-o', '--output', type=str, required=True, help='Output csv file')
+    args = parser.parse_args()
+
+    count = write_sql_structure(args.input_dir, args.output, args.file_type)
+    print(f"{count} SQL statements written to {args.output}")
@@ -0,0 +1,160 @@
+"""
+SYNTHETIC CORPUS
+file: synthetic_corpus.py
+purpose: generate a synthetic SAS code base of a configurable size and shape, to benchmark the parser with
+        (see benchmark.py) without needing access to real SAS programs
+example use: python synthetic_corpus.py -o 'bench_corpus' -s small -n 5000
+        where 'bench_corpus' is the directory the programs are written to, 'small' is the shape of the corpus
+        (see SHAPES) and 5000 overrides the number of programs of the shape
+"""
+
+import os
+import random
+import argparse
+
+# Shape of a corpus: number of programs, statements per program and the relative weight of each kind of statement
+SHAPES = {
+    # many small programs
+    'small': {'files': 2000, 'statements': 40,
+              'weights': {'data': 4, 'sql': 2, 'export': 1, 'null': 1, 'libname': 1, 'date': 1, 'include': 1,
+                          'macro': 1, 'comment': 2}},
+    # few very large (auto-generated like) programs
+    'huge': {'files': 3, 'statements': 200000,
+             'weights': {'data': 4, 'sql': 2, 'export': 1, 'null': 1, 'libname': 1, 'date': 1, 'include': 1,
+                         'macro': 1, 'comment': 2}},
+    # programs that are mostly PROC SQL
+    'sql': {'files': 500, 'statements': 100,
+            'weights': {'data': 1, 'sql': 10, 'libname': 1, 'date': 1, 'comment': 1}},
+    # programs that reference many of the other programs
+    'refs': {'files': 2000, 'statements': 60,
+             'weights': {'data': 2, 'sql': 1, 'include': 8, 'comment': 1}},
+    # blocks that are never closed, the worst case for the block matching
+    'unterminated': {'files': 50, 'statements': 2000,
+                     'weights': {'data': 1, 'open_sql': 6, 'open_export': 2, 'open_null': 2, 'comment': 1}},
+}
+
+
+#-----------------------------------------------------------------------------
+# Statement templates, each returns the SAS code of one statement / block
+def _data_step(rng, context):
+    name = f"work.ds_{rng.randrange(1000)}"
+    source = f"src.tbl_{rng.randrange(1000)}"
+    options = rng.choice(["", "  retain total 0;\n", "  prev = lag(amount);\n", "  array a{3} x1-x3;\n"])
+    return f"data {name};\n  set {source};\n{options}  amount = amount * 1.1;\nrun;\n"
+
+
+def _sql(rng, context):
+    left, right = rng.randrange(1000), rng.randrange(1000)
+    return (f"proc sql;\n  create table work.sql_{left} as\n"
+            f"  select a.id, a.amount, b.category\n  from src.tbl_{left} a\n"
+            f"  inner join src.tbl_{right} b on a.id = b.id\n  where a.amount > {rng.randrange(100)};\nquit;\n")
+
+
+def _export(rng, context):
+    return f"proc export data=work.ds_{rng.randrange(1000)} outfile='/out/file_{rng.randrange(1000)}.csv' dbms=csv;\nrun;\n"
+
+
+def _null(rng, context):
+    return "data _null_;\n  set work.ctl;\n  call symputx('run_dt', put(today(), yymmdd10.));\nrun;\n"
+
+
+def _libname(rng, context):
+    return f"libname lib{rng.randrange(100)} '/data/lib/{rng.randrange(100)}';\n"
+
+
+def _date(rng, context):
+    return f"%let cutoff = {rng.randrange(2000, 2030)}-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d};\n"
+
+
+def _include(rng, context):
+    return f"%include \"{rng.choice(context['paths'])}\";\n"
+
+
+def _macro(rng, context):
+    name = f"m_{rng.randrange(100)}"
+    return f"%macro {name}(ds);\n  proc sort data=&ds; by id; run;\n%mend {name};\n%{name}(work.a);\n"
+
+
+def _comment(rng, context):
+    return rng.choice(["/* proc sql; generated block, do not edit */\n", "* quick fix 2019-01-01;\n",
+                       "/* run; quit; */\n"])
+
+
+def _open_sql(rng, context):
+    return f"proc sql;\n  select * from src.tbl_{rng.randrange(1000)}\n"
+
+
+def _open_export(rng, context):
+    return f"proc export data=work.ds_{rng.randrange(1000)}\n"
+
+
+def _open_null(rng, context):
+    return "data _null_;\n  x = 1;\n"
+
+
+TEMPLATES = {
+    'data': _data_step,
+    'sql': _sql,
+    'export': _export,
+    'null': _null,
+    'libname': _libname,
+    'date': _date,
+    'include': _include,
+    'macro': _macro,
+    'comment': _comment,
+    'open_sql': _open_sql,
+    'open_export': _open_export,
+    'open_null': _open_null,
+}
+#-----------------------------------------------------------------------------
+
+
+def generate_corpus(output_dir, shape='small', files=None, statements=None, seed=0, file_type='sas'):
+    """Write a synthetic SAS corpus
+
+    Args:
+        output_dir (string): directory the programs are written to (in sub directories of 100 programs)
+        shape (string): one of SHAPES
+        files (int): number of programs, overrides the shape
+        statements (int): statements per program, overrides the shape
+        seed (int): random seed, the same arguments always generate the same corpus
+        file_type (string): file extension of the programs
+
+    Returns:
+        dict: description of the corpus (shape, files, bytes, paths)
+    """
+    settings = SHAPES[shape]
+    files = files if files is not None else settings['files']
+    statements = statements if statements is not None else settings['statements']
+    kinds = list(settings['weights'])
+    weights = [settings['weights'][kind] for kind in kinds]
+    rng = random.Random(seed)
+
+    paths = [os.path.join(output_dir, f"dir_{index // 100:04d}", f"prog_{index:06d}.{file_type}")
+             for index in range(files)]
+    context = {'paths': [path.replace('\\', '/') for path in paths]}
+    total_bytes = 0
+    for path in paths:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        chosen = rng.choices(kinds, weights, k=statements)
+        code = ''.join(TEMPLATES[kind](rng, context) for kind in chosen)
+        with open(path, 'w', encoding='cp1252', newline='') as file:
+            file.write(code)
+        total_bytes += len(code)
+    return {'shape': shape, 'files': files, 'statements': statements, 'seed': seed, 'bytes': total_bytes,
+            'paths': paths}
+
+
+#================================================================
+# This is the entry point of the script
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate a synthetic SAS corpus.')
+    parser.add_argument('-o', '--output_dir', type=str, required=True, help='Output directory')
+    parser.add_argument('-s', '--shape', type=str, default='small', choices=sorted(SHAPES), help='Shape of the corpus')
+    parser.add_argument('-n', '--files', type=int, help='Number of programs (default depends on the shape)')
+    parser.add_argument('--statements', type=int, help='Statements per program (default depends on the shape)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+
+    corpus = generate_corpus(args.output_dir, args.shape, args.files, args.statements, args.seed)
+    print(f"{corpus['files']} programs, {corpus['bytes'] / (1024 * 1024):.1f} MB written to {args.output_dir}")